@@ -1,6 +1,7 @@
 from dash import Dash, dcc, html, Input, Output
 import dash_bootstrap_components as dbc
 from .pages import wfa, genes, pv, blankPage, interactions
+from .utils import settings, payloadMetrics, geneCorrelation, dataRegistry, pageRegistry
 
 
 app = Dash(__name__,
@@ -13,18 +14,20 @@ indexLayout = html.Div([
     html.Div(id='page-content')
 ])
 
+# Page shown at each url. Importing the pages only registers their callbacks: the
+# data of each page is loaded and its layout is built the first time it is visited
+atlasPages = pageRegistry.PageRegistry({
+    '/wfa': wfa,
+    '/pv': pv,
+    '/interactions': interactions,
+    '/genes': genes,
+}, notFound=blankPage)
+
 # Create a "complete" layout for validating all callbacks. Otherwise when dash tries
 # to validate them, most of them will thorw an error since they are linked to
 # components that are not currently on the displayed page and so are not part of the 
-# current layout
-#app.validation_layout = html.Div([
-#    indexLayout,
-#    wfa.layout,
-#    pv.layout,
-#    interactions.layout,
-#    genes.layout,
-#    blankPage.layout
-#])
+# current layout. The pages are built without their data, so nothing is loaded here.
+app.validation_layout = atlasPages.validationLayout(indexLayout)
 
 # This is the actual layout of the app
 app.layout = indexLayout
@@ -34,22 +37,24 @@ app.layout = indexLayout
     Input('url', 'pathname')
 )
 def display_page(pathname):
-    if pathname == '/wfa':
-        return wfa.layout
-    elif pathname == '/pv':
-        return pv.layout
-    elif pathname == '/interactions':
-        return interactions.layout
-    elif pathname == '/genes':
-        return genes.layout
-    else:
-        return blankPage.layout
+    return atlasPages.layout(pathname)
 
 
 # This server object will be loaded by the WSGI script to be served as a webapp
 # in a production server
 server = app.server
 
+# Size of the data sent by the callbacks, to find the ones that move too much
+if settings.PAYLOAD_METRICS:
+    payloadMetrics.installPayloadMetrics(server)
+
+# Json API with the correlation of all the genes with the staining metrics
+geneCorrelation.installGeneCorrelationApi(server, dataRegistry.getGeneCorrelationTable)
+
+# Load the data of all the pages now instead of when they are first visited
+if settings.PRELOAD_PAGES:
+    atlasPages.preload()
+
 
 # This will only be executed during debug when run locally, since WSGI does not 
 # run this as __main__ but only takes the "server" variable
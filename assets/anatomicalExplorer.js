@@ -0,0 +1,105 @@
+/*
+Clientside rendering of the anatomical explorer.
+
+Used when the atlas runs with PNNATLAS_CLIENTSIDE_EXPLORER=1. The page ships all
+the data needed to draw the explorer in a dcc.Store (see
+makeAnatExplorerStoreData() in utils/callbackFunctions.py) and this function
+builds the same figure that redrawAnatExplorerScatter() builds on the server.
+*/
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    anatomicalExplorer: {
+        render: function(selMetric, cmap, apIdx, store) {
+            if (!store) {
+                return window.dash_clientside.no_update;
+            }
+            const geom = store.geometry;
+            const stats = store.metrics[selMetric];
+            const vmin = store.clims[selMetric][0];
+            const vmax = store.clims[selMetric][1];
+            const lut = store.colormaps[cmap];
+
+            // Polygons of each region, in the order regions appear in the slice
+            const regionOrder = [];
+            const regionPolys = {};
+            for (let p = geom.sliceOffsets[apIdx]; p < geom.sliceOffsets[apIdx + 1]; p++) {
+                const regionID = geom.polyRegionID[p];
+                if (!(regionID in regionPolys)) {
+                    regionPolys[regionID] = [];
+                    regionOrder.push(regionID);
+                }
+                regionPolys[regionID].push(p);
+            }
+            // Draw root first (below all the other areas)
+            const isRoot = (regionID) => geom.regions[regionID][0] === 'root';
+            const drawOrder = regionOrder.filter(isRoot).concat(regionOrder.filter((r) => !isRoot(r)));
+
+            // Same color binning as matplotlib: clip to [vmin, vmax], N equal bins
+            const colorOf = function(value) {
+                const norm = Math.min(Math.max((value - vmin) / (vmax - vmin), 0), 1);
+                return lut[Math.min(Math.floor(norm * lut.length), lut.length - 1)];
+            };
+            const fmt = (value) => (value === null || value === undefined) ? 'nan' : value.toFixed(3);
+
+            const traces = drawOrder.map(function(regionID) {
+                // All the polygons of the region separated by nulls
+                const x = [];
+                const y = [];
+                regionPolys[regionID].forEach(function(p, k) {
+                    if (k > 0) {
+                        x.push(null);
+                        y.push(null);
+                    }
+                    for (let v = geom.polyOffsets[p]; v < geom.polyOffsets[p + 1]; v++) {
+                        x.push(geom.vertices[2 * v]);
+                        y.push(geom.vertices[2 * v + 1]);
+                    }
+                });
+
+                const acronym = geom.regions[regionID][0];
+                const regionName = geom.regions[regionID][1];
+                const regionStats = stats[regionID] || [null, null];
+                const root = acronym === 'root';
+                const hasData = regionStats[0] !== null;
+
+                const trace = {
+                    type: 'scatter',
+                    x: x,
+                    y: y,
+                    mode: 'lines',
+                    line: {width: 1, color: 'rgb(0,0,0)'},
+                    fill: 'toself',
+                    fillcolor: (root || !hasData) ? 'rgb(0,0,0)' : colorOf(regionStats[0]),
+                    hoverlabel: {namelength: 0, bgcolor: 'rgb(255,255,255)', font: {color: 'black'}},
+                    text: root ? 'root' : '<b>' + acronym + '</b><br><i>' + regionName + '</i><br>Mean: ' +
+                        fmt(regionStats[0]) + '<br>SEM: ' + fmt(regionStats[1]),
+                    name: acronym,
+                    visible: root || hasData,
+                };
+                if (root) {
+                    trace.opacity = 0.3;
+                }
+                return trace;
+            });
+
+            // Colorbar
+            traces.push({
+                type: 'scatter',
+                x: [null],
+                y: [null],
+                mode: 'markers',
+                marker: {
+                    // plotly.js does not know most of the colormaps by name
+                    colorscale: store.colorscales[cmap],
+                    showscale: true,
+                    cmin: vmin,
+                    cmax: vmax,
+                    colorbar: {thickness: 10, tickvals: [vmin, vmax], ticktext: [String(vmin), String(vmax)],
+                        outlinewidth: 0, ypad: 200},
+                },
+                hoverinfo: 'none',
+            });
+
+            return {data: traces, layout: store.layout};
+        }
+    }
+});
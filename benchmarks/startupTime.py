@@ -0,0 +1,69 @@
+"""
+Startup time benchmark of the atlas.
+
+Imports the pnnatlas package (the entry point of the app, which imports all the
+pages and registers their callbacks) in fresh python processes and fails if the fastest import takes
+longer than the budget, or if modules that should only be loaded on demand are
+imported at startup. The package is imported from the parent folder of the
+atlas, as the WSGI server does. Run it with:
+    python benchmarks/startupTime.py [budget in seconds]
+
+Run it once before measuring, so that the data cache is already built.
+"""
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+
+# Maximum time in seconds to import pnnatlas. The import takes about 1.3 s, and
+# parsing any of the data files at import time would take longer than this
+IMPORT_BUDGET = float(os.environ.get('PNNATLAS_IMPORT_BUDGET', 3))
+
+# Number of imports to measure, the fastest one is compared to the budget
+REPEATS = 3
+
+# Modules that must never be imported at startup
+LAZY_MODULES = ['matplotlib', 'plotly.express']
+
+_CHILD = """
+import importlib, json, sys, time
+start = time.perf_counter()
+importlib.import_module({packageName!r})
+elapsed = time.perf_counter() - start
+print(json.dumps(dict(
+    seconds=elapsed,
+    loaded=[m for m in {lazyModules!r} if m in sys.modules],
+)))
+"""
+
+
+def measureImport(rootFolder):
+    """
+    Imports the package in rootFolder in a new python process and returns the
+    import time in seconds and the lazy modules that were loaded
+    """
+    child = _CHILD.format(packageName=rootFolder.name, lazyModules=LAZY_MODULES)
+    result = subprocess.run([sys.executable, '-c', child], cwd=rootFolder.parent,
+        capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import pnnatlas failed:\n{result.stderr}")
+    # The app may print to stdout while loading, the result is the last line
+    out = json.loads(result.stdout.strip().splitlines()[-1])
+    return out['seconds'], out['loaded']
+
+
+def main(budget=IMPORT_BUDGET):
+    rootFolder = Path(__file__).parent.parent.absolute()
+    times = []
+    for _ in range(REPEATS):
+        seconds, loaded = measureImport(rootFolder)
+        times.append(seconds)
+        assert not loaded, f"Imported at startup: {', '.join(loaded)}"
+    print(f"import pnnatlas: best {min(times):.2f}s, worst {max(times):.2f}s (budget {budget:.2f}s)")
+    assert min(times) <= budget, f"import pnnatlas took {min(times):.2f}s, over the budget of {budget:.2f}s"
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else IMPORT_BUDGET)
@@ -1,12 +1,11 @@
-from dash import dcc, html, Input, Output, State, callback
+from dash import dcc, html, Input, Output, State, callback, ctx, no_update
 import dash_bootstrap_components as dbc
 
-from pathlib import Path
-import pandas as pd
-
-from ..utils import dataManager as dm
+from ..utils import dataRegistry as dr
 from ..utils import layoutFunctions as lf
 from ..utils import callbackFunctions as cf
+from ..utils import geneCorrelation as gc
+from ..utils import pageRegistry as pr
 
 # ------------------------------------------------------------------------------
 # Initialize utility objects and useful functions
@@ -16,79 +15,137 @@ from ..utils import callbackFunctions as cf
 # the name of the page to a string so that writing ids specific for each page is easier 
 id = cf.id_factory('genes')          
 
-# Full path of the data folder where to load raw data
-dataFolder = Path(__file__).parent.parent.absolute() / 'data'
-
-# Load the Atlas dataFrame with all structures, acronyms, colors etc
-structuresDf = cf.loadStructuresDf(dataFolder/'structures.json')
-
 # ------------------------------------------------------------------------------
 # Load the necessary data
 # ------------------------------------------------------------------------------
 
-# Metrics data for WFA and PV
-wfa = dm.readMetricsDataForGenes(dataFolder/'originalData/data_SD1.xlsx')
-pv = dm.readMetricsDataForGenes(dataFolder/'originalData/data_SD2.xlsx')
-# Load Genes data
-geneDict = dm.readGenesCorrelationSupplData(dataFolder/'originalData/data_SD4.xlsx')
-# genesDf = df = pd.read_excel(dataFolder/'originalData/data_SD4.xlsx', header=0, index_col=0)
-
-# Load ISH data
-ish_en =  pd.read_csv(dataFolder/'gene_expression_ABA_energy.csv', index_col=0)
-ish_en.columns = pd.to_numeric(ish_en.columns)
+# The data is taken from the data registry the first time the page is visited or
+# one of its callbacks is called, not when this module is imported
 
+# Empty scatter plot that the correlation callback fills with data
+scatterTemplate = cf.make_GeneScatter().to_plotly_json()
 
 
 # ------------------------------------------------------------------------------
 # LAYOUT
 # ------------------------------------------------------------------------------
-layout = dbc.Container([
-    lf.make_CitationOffCanvas(id),
-    lf.make_AboutUsOffCanvas(id),
-    lf.make_GeneInfoModal(id),
-    dbc.Row(lf.make_NavBar()),                  # Navigation Bar
-    dbc.Row(lf.make_GenesHeader(id)),             # Big header
-
-    # # Second portion (Histogram)
-    dbc.Row([lf.make_Subtitle('Explore correlations')]),
-    dbc.Row([
-        dbc.Col(lf.make_GeneCorrSelectionMenu(id, geneDict['wfa_en']),
-            xs=12,lg=4, className='mt-5'
-        ),
-        dbc.Col(
-            dbc.Spinner(
-                dcc.Graph(
-                    figure=cf.make_GeneScatter(),
-                    id=id('corrPlot'), config={'displaylogo':False}, className='mt-3'),
-                color='primary'
+def makeLayout(geneOptions):
+    """
+    Layout of the page, with the initial options of the gene dropdown
+    """
+    return dbc.Container([
+        lf.make_CitationOffCanvas(id),
+        lf.make_AboutUsOffCanvas(id),
+        lf.make_GeneInfoModal(id),
+        dbc.Row(lf.make_NavBar()),                  # Navigation Bar
+        dbc.Row(lf.make_GenesHeader(id)),             # Big header
+
+        # # Second portion (Histogram)
+        dbc.Row([lf.make_Subtitle('Explore correlations')]),
+        dbc.Row([
+            dbc.Col(lf.make_GeneCorrSelectionMenu(id, geneOptions),
+                xs=12,lg=4, className='mt-5'
+            ),
+            dbc.Col(
+                dbc.Spinner(
+                    dcc.Graph(
+                        figure=scatterTemplate,
+                        id=id('corrPlot'), config={'displaylogo':False}, className='mt-3'),
+                    color='primary'
+                )
             )
-        )
-    ]),
-    # dbc.Row([lf.make_CollapsableTable(id)]),
-    dbc.Row([lf.make_CC_licenseBanner(id)]),
+        ]),
+        dbc.Row([lf.make_Subtitle('Top correlated genes')], className='mt-5'),
+        dbc.Row([lf.make_TopGenesTable(id)]),
+        # dbc.Row([lf.make_CollapsableTable(id)]),
+        dbc.Row([lf.make_CC_licenseBanner(id)]),
+
+        dbc.Row([],style={"margin-top": "500px"}),
+    ])
+
 
-    dbc.Row([],style={"margin-top": "500px"}),
-])
+@pr.loadOnce
+def layout():
+    """
+    Layout of the page with its data, built the first time the page is visited
+    """
+    # Correlation of all the genes with the metrics, computed once and cached on disk
+    dr.getGeneCorrelations()
+    return makeLayout(dr.getGeneSearchIndex().search('', selected=lf.DEFAULT_GENE))
 
 
+def validationLayout():
+    """
+    Same components of layout() without any data, to validate the callbacks
+    """
+    return makeLayout([])
+
+
+
+@callback(
+    Output(component_id=id('drpD_geneSelect'), component_property='options'),
+    Input(component_id=id('drpD_geneSelect'), component_property='search_value'),
+    State(component_id=id('drpD_geneSelect'), component_property='value'),
+)
+def searchGenes(searchValue, selGene):
+    """
+    Update the options of the gene dropdown with the genes matching the search
+    """
+    if not searchValue:
+        return no_update
+    return dr.getGeneSearchIndex().search(searchValue, selected=selGene)
+
 
 @callback(
     Output(component_id=id('corrPlot'), component_property='figure'),
+    Input(component_id=id('drpD_geneSelect'), component_property='value'),
+    Input(component_id=id('drpD_metricSelector'), component_property='value'),
+)
+def updateGenecorr(selGene, selMetric):
+    structuresDf = dr.getStructuresDf()
+    _, geneName = cf.getGeneInfoTable(selMetric, selGene, dr.getGeneInfoRecords())
+
+    metricData = cf.getMetricDf(selMetric, dr.getMetricsDataForGenes('wfa'), dr.getMetricsDataForGenes('pv'))
+    aggreDf = cf.combineGenesDf(selGene, metricData, dr.getIshEnergy(), structuresDf)
+    fig = cf.update_GenesScatter(scatterTemplate, aggreDf, structuresDf, geneName)
+
+    return fig
+
+
+@callback(
     Output(component_id=id('collps_Tab'), component_property='children'),
-    State(component_id=id('corrPlot'), component_property='figure'),
     Input(component_id=id('drpD_geneSelect'), component_property='value'),
     Input(component_id=id('drpD_metricSelector'), component_property='value'),
+    Input(component_id=id('collps_Tab'), component_property='is_open'),
 )
-def updateGenecorr(fig, selGene, selMetric):
-    # Update the table with Gene info
-    g, geneName = cf.getGeneInfoTable(selMetric, selGene, geneDict)
-    tab = dbc.Table.from_dataframe(g, striped=True, bordered=True, hover=True)
+def updateGeneInfo(selGene, selMetric, isOpen):
+    """
+    Update the table with Gene info, only while it is open
+    """
+    if not isOpen:
+        return no_update
+    record, _ = cf.getGeneInfoTable(selMetric, selGene, dr.getGeneInfoRecords())
+    return lf.make_GeneInfoTable(record)
 
-    metricData = cf.getMetricDf(selMetric, wfa, pv)
-    aggreDf = cf.combineGenesDf(selGene, metricData, ish_en, structuresDf)
-    fig = cf.update_GenesScatter(fig, aggreDf, structuresDf, geneName)
 
-    return fig, tab
+@callback(
+    Output(component_id=id('table_topGenes'), component_property='data'),
+    Output(component_id=id('table_topGenes'), component_property='page_count'),
+    Output(component_id=id('table_topGenes'), component_property='page_current'),
+    Input(component_id=id('drpD_metricSelector'), component_property='value'),
+    Input(component_id=id('table_topGenes'), component_property='page_current'),
+    Input(component_id=id('table_topGenes'), component_property='sort_by'),
+)
+def updateTopGenes(selMetric, pageCurrent, sortBy):
+    """
+    Update the page of the table of the genes most correlated with the metric
+    """
+    # Go back to the first page whenever the metric or the sorting change
+    if id('table_topGenes') + '.page_current' not in ctx.triggered_prop_ids:
+        pageCurrent = 0
+    table = gc.sortGenes(dr.getGeneCorrelationTable(selMetric), sortBy).reset_index()
+    data, pageCount, pageCurrent = cf.tablePage(table, pageCurrent, lf.TABLE_PAGE_SIZE)
+    return data, pageCount, pageCurrent
 
 
 @callback(
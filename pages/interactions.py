@@ -1,12 +1,12 @@
-from dash import dcc, html, Input, Output, State, callback
+from dash import dcc, html, Input, Output, State, callback, ctx, no_update
 import dash_bootstrap_components as dbc
 
-from pathlib import Path
-import pandas as pd
-
-from ..utils import dataManager as dm
+from ..utils import dataRegistry as dr
 from ..utils import layoutFunctions as lf
 from ..utils import callbackFunctions as cf
+from ..utils import cacheManager as cm
+from ..utils import settings
+from ..utils import pageRegistry as pr
 
 # ------------------------------------------------------------------------------
 # Initialize utility objects and useful functions
@@ -16,32 +16,35 @@ from ..utils import callbackFunctions as cf
 # the name of the page to a string so that writing ids specific for each page is easier 
 id = cf.id_factory('interactions')          
 
-# Full path of the data folder where to load raw data
-dataFolder = Path(__file__).parent.parent.absolute() / 'data'
-
-# Load the Atlas dataFrame with all structures, acronyms, colors etc
-structuresDf = cf.loadStructuresDf(dataFolder/'structures.json')
-
 # ------------------------------------------------------------------------------
 # Load the necessary data
 # ------------------------------------------------------------------------------
 
-# Metrics data for WFA
-Dw = dm.readSupplDataMetrics(dataFolder/'originalData/data_SD1.xlsx', removeAcronyms=True)
-Dp = dm.readSupplDataMetrics(dataFolder/'originalData/data_SD2.xlsx', removeAcronyms=True)
-Dc = dm.readSupplDataMetrics(dataFolder/'originalData/data_SD3.xlsx', removeAcronyms=True)
+# The data is taken from the data registry the first time the page is visited or
+# one of its callbacks is called, not when this module is imported
 
-# Coronal Slice Coordinates
-coronalCoordDfList = cf.loadAllSlices(dataFolder/'coordinates')
+# Empty scatter plot that the scatter callback fills with data
+scatterTemplate = cf.makeInteractionScatter().to_plotly_json()
 
-# ------------------------------------------------------------------------------
-# Perform some preprocessing
-# ------------------------------------------------------------------------------
 
-# Create lists of dictionaries {label:areaName, value=areaID} for populating dropDowns
-coarseDict = cf.dataFrame_to_labelDict(Dc['coarse'],'coarse',structuresDf)
-midDict = cf.dataFrame_to_labelDict(Dc['mid'],'mid',structuresDf)
-fineDict = cf.dataFrame_to_labelDict(Dc['fine'],'fine',structuresDf)
+@pr.loadOnce
+def histogramCache():
+    """
+    Rendered histograms, shared by all the workers
+    """
+    return cm.FigureCache('colocHistogram', maxBytes=settings.RESPONSE_CACHE_MAX_BYTES,
+        version=f"{cf.HISTOGRAM_VERSION}-{dr.getDataFingerprint('coloc')}")
+
+
+@pr.loadOnce
+def regionLabels():
+    """
+    Lists of dictionaries {label:areaName, value=areaID} for populating the
+    dropdowns of each resolution {coarse, mid, fine}
+    """
+    Dc = dr.getSupplDataMetrics('coloc')
+    structuresDf = dr.getStructuresDf()
+    return {res: cf.dataFrame_to_labelDict(Dc[res], res, structuresDf) for res in ('coarse', 'mid', 'fine')}
 
 
 # ------------------------------------------------------------------------------
@@ -49,75 +52,95 @@ fineDict = cf.dataFrame_to_labelDict(Dc['fine'],'fine',structuresDf)
 # ------------------------------------------------------------------------------
 
 
-layout = dbc.Container([
-    lf.make_CitationOffCanvas(id),
-    lf.make_AboutUsOffCanvas(id),
-    lf.make_ColocInfoModal(id),
-    dbc.Row(lf.make_NavBar()),                           # Navigation Bar
-    dbc.Row(lf.make_InteractionHeader(id)),            # Big header
-
-    #
-
-    dbc.Row([lf.make_Subtitle('Correlation between metrics')]),
-    dbc.Row([
-        dbc.Col([
-            lf.make_InteractionSelectionMenu(id)
-        ],xs=12,lg=3),
-        dbc.Col([
-            dbc.Spinner(
-                dcc.Graph(
-                    figure=cf.makeInteractionScatter(),
-                    id=id('scatter'),
-                    config= {'displaylogo': False}
-                ),color='primary'
+def makeLayout(labels):
+    """
+    Layout of the page, with the options of the region dropdowns in labels
+    {coarse, mid, fine}
+    """
+    return dbc.Container([
+        lf.make_CitationOffCanvas(id),
+        lf.make_AboutUsOffCanvas(id),
+        lf.make_ColocInfoModal(id),
+        dbc.Row(lf.make_NavBar()),                           # Navigation Bar
+        dbc.Row(lf.make_InteractionHeader(id)),            # Big header
+
+        #
+
+        dbc.Row([lf.make_Subtitle('Correlation between metrics')]),
+        dbc.Row([
+            dbc.Col([
+                lf.make_InteractionSelectionMenu(id)
+            ],xs=12,lg=3),
+            dbc.Col([
+                dbc.Spinner(
+                    dcc.Graph(
+                        figure=scatterTemplate,
+                        id=id('scatter'),
+                        config= {'displaylogo': False}
+                    ),color='primary'
+                ),
+                # lf.make_AreasChecklist(id, labels['coarse']),
+            ])
+        ], className = 'align-items-center'),
+
+        dbc.Row([lf.make_Subtitle('Colocalization')]),
+        dbc.Row([
+            dbc.Col(lf.make_ColocalizationHistogramSelectionMenu(id, labels['coarse'], labels['mid'], labels['fine']),
+                xs=12,lg=4, className='mt-5'
             ),
-            # lf.make_AreasChecklist(id, coarseDict),
-        ])
-    ], className = 'align-items-center'),
-
-    dbc.Row([lf.make_Subtitle('Colocalization')]),
-    dbc.Row([
-        dbc.Col(lf.make_ColocalizationHistogramSelectionMenu(id, coarseDict, midDict, fineDict),
-            xs=12,lg=4, className='mt-5'
-        ),
-        dbc.Col(
-            dbc.Spinner(
-                dcc.Graph(id=id('hist_coloc'), config={'displaylogo':False}),
-                color='primary'
+            dbc.Col(
+                dbc.Spinner(
+                    dcc.Graph(id=id('hist_coloc'), config={'displaylogo':False}),
+                    color='primary'
+                )
             )
-        )
-    ]),
-    dbc.Row([lf.make_CollapsableTable(id)]),
-    dbc.Row([lf.make_CC_licenseBanner(id)]),
+        ]),
+        dbc.Row([lf.make_CollapsableTable(id)]),
+        dbc.Row([lf.make_CC_licenseBanner(id)]),
+
+
+        dbc.Row([],style={"margin-top": "500px"}),
+    ])
+
+
+@pr.loadOnce
+def layout():
+    """
+    Layout of the page with its data, built the first time the page is visited
+    """
+    # Build the matrix of the scatter now, not in its first callback
+    dr.getInteractionMatrix()
+    return makeLayout(regionLabels())
 
 
-    dbc.Row([],style={"margin-top": "500px"}),
-])
+def validationLayout():
+    """
+    Same components of layout() without any data, to validate the callbacks
+    """
+    return makeLayout({'coarse': [], 'mid': [], 'fine': []})
 
 
 
 @callback(
     Output(component_id=id('scatter'), component_property='figure'),
-    State(component_id=id('scatter'), component_property='figure'),
     Input(component_id=id('drpD_xStaining'), component_property='value'),
     Input(component_id=id('drpD_xMetric'), component_property='value'),
     Input(component_id=id('drpD_yStaining'), component_property='value'),
     Input(component_id=id('drpD_yMetric'), component_property='value'),
     Input(component_id=id('switch_zScore'), component_property='value')
 )
-def updateScatter(fig, xStaining, xMetric, yStaining, yMetric, zScore):    
-    xData = cf.selectData(Dw, Dp, xStaining, xMetric, 'mid')
-    yData = cf.selectData(Dw, Dp, yStaining, yMetric, 'mid')
-    aggrDf = cf.intScattAggregateData(structuresDf, xData, yData, zScore)
+def updateScatter(xStaining, xMetric, yStaining, yMetric, zScore):
+    structuresDf = dr.getStructuresDf()
+    aggrDf, correlation = cf.intScattAggregateData(dr.getInteractionMatrix(), xStaining, xMetric, yStaining, yMetric, zScore)
 
-    fig = cf.update_IntScatter(fig, aggrDf, structuresDf, xStaining, xMetric, yStaining, yMetric, zScore)
+    fig = cf.update_IntScatter(scatterTemplate, aggrDf, structuresDf, xStaining, xMetric, yStaining, yMetric, zScore,
+        correlation)
 
     return fig
 
 
 @callback(
     Output(component_id=id('hist_coloc'), component_property='figure'),
-    Output(component_id=id('collps_Tab'), component_property='children'),
     Input(component_id=id('drpD_Metric'), component_property='value'),
     Input(component_id=id('drpD_majorSubd'), component_property='value'),
     Input(component_id=id('drpD_addCoarse'), component_property='value'),
@@ -127,24 +150,66 @@ def updateScatter(fig, xStaining, xMetric, yStaining, yMetric, zScore):
 )
 def updateHistogram(selMetric, maj_sel, addC_sel, addM_sel, addF_sel, sortRegions):
     """
-    Update the diffuse fluorescence histogram
+    Update the colocalization histogram
+    """
+    # Equivalent selections are rendered only once
+    selection = cf.canonicalHistogramSelection(selMetric, maj_sel, addC_sel, addM_sel, addF_sel, sortRegions,
+        dr.getRegionIndex('coloc'))
+    return histogramCache().getOrBuild(selection, makeHistogram, *selection)
+
+
+def makeHistogram(selMetric, maj_sel, addC_sel, addM_sel, addF_sel, sortRegions):
+    """
+    Renders the colocalization histogram for a selection
+    """
+    aggrDf = selectHistogramData(selMetric, maj_sel, addC_sel, addM_sel, addF_sel, sortRegions)
+    fig = cf.update_colocHistogram(aggrDf, selMetric)
+    return fig
+
+
+def selectHistogramData(selMetric, maj_sel, addC_sel, addM_sel, addF_sel, sortRegions):
+    """
+    Mean, SEM, name and color of all the regions in a selection, in the order
+    in which they are shown
     """
-    # Filter data for the selected metric only
-    slicedCoarse = Dc['coarse'].xs(selMetric, axis=1, level='params')
-    slicedMid = Dc['mid'].xs(selMetric, axis=1, level='params')
-    slicedFine = Dc['fine'].xs(selMetric, axis=1, level='params')
     # Combine data from all the area selected from multiple menus
     combinedDf = cf.combineDiffuseDataframes(maj_sel, addC_sel, addM_sel, addF_sel,
-        slicedCoarse, slicedMid, slicedFine)
-    # Aggregate to calculate Mean and SEM
-    aggrDf = cf.aggregateFluoDataframe(combinedDf, structuresDf)
+        dr.getRegionIndex('coloc'), selMetric)
+    # Add names and colors to Mean and SEM
+    aggrDf = cf.aggregateFluoDataframe(combinedDf, dr.getStructuresDf())
     if sortRegions:
         aggrDf = aggrDf.sort_values(by='mean',ascending=False)
+    return aggrDf
 
-    # Create a new visualization and table and return them
-    fig = cf.update_colocHistogram(aggrDf, selMetric)
-    tab = dbc.Table.from_dataframe(aggrDf.drop(columns=['color']), striped=True, bordered=True, hover=True)
-    return fig, tab
+
+@callback(
+    Output(component_id=id('table_data'), component_property='data'),
+    Output(component_id=id('table_data'), component_property='page_count'),
+    Output(component_id=id('table_data'), component_property='page_current'),
+    Input(component_id=id('drpD_Metric'), component_property='value'),
+    Input(component_id=id('drpD_majorSubd'), component_property='value'),
+    Input(component_id=id('drpD_addCoarse'), component_property='value'),
+    Input(component_id=id('drpD_addMid'), component_property='value'),
+    Input(component_id=id('drpD_addFine'), component_property='value'),
+    Input(component_id=id('switch_sortDiff'), component_property='value'),
+    Input(component_id=id('table_data'), component_property='page_current'),
+    Input(component_id=id('collps_Tab'), component_property='is_open'),
+)
+def updateTable(selMetric, maj_sel, addC_sel, addM_sel, addF_sel, sortRegions, pageCurrent, isOpen):
+    """
+    Update the tabular data, sending only the rows of the page that is shown.
+    Nothing is computed while the table is collapsed: it is filled when it opens
+    """
+    if not isOpen:
+        return no_update, no_update, no_update
+    # Go back to the first page whenever the selection changes
+    if id('table_data') + '.page_current' not in ctx.triggered_prop_ids:
+        pageCurrent = 0
+    selection = cf.canonicalHistogramSelection(selMetric, maj_sel, addC_sel, addM_sel, addF_sel, sortRegions,
+        dr.getRegionIndex('coloc'))
+    aggrDf = selectHistogramData(*selection)
+    data, pageCount, pageCurrent = cf.tablePage(aggrDf, pageCurrent, lf.TABLE_PAGE_SIZE)
+    return data, pageCount, pageCurrent
 
 
 @callback(
@@ -172,7 +237,7 @@ def invertTabVisibility( _ , previousState):
     prevent_initial_call=True
 )
 def addAllColocHist(n_clicks):
-    coarseIDs = [x['value'] for x in coarseDict]
+    coarseIDs = [x['value'] for x in regionLabels()['coarse']]
     return coarseIDs
 
 
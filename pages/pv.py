@@ -1,12 +1,16 @@
-from dash import dcc, html, Input, Output, State, callback
+from dash import dcc, html, Input, Output, State, callback, clientside_callback, ctx, no_update
+from dash import ClientsideFunction
 import dash_bootstrap_components as dbc
 
-from pathlib import Path
-import pandas as pd
+import itertools
 
-from ..utils import dataManager as dm
+from ..utils import dataRegistry as dr
 from ..utils import layoutFunctions as lf
 from ..utils import callbackFunctions as cf
+from ..utils import sliceGeometry as sg
+from ..utils import cacheManager as cm
+from ..utils import settings
+from ..utils import pageRegistry as pr
 
 
 # ------------------------------------------------------------------------------
@@ -17,78 +21,138 @@ from ..utils import callbackFunctions as cf
 # the name of the page to a string so that writing ids specific for each page is easier 
 id = cf.id_factory('pv')          
 
-# Full path of the data folder where to load raw data
-dataFolder = Path(__file__).parent.parent.absolute() / 'data'
-
-# Load the Atlas dataFrame with all structures, acronyms, colors etc
-structuresDf = cf.loadStructuresDf(dataFolder/'structures.json')
-
 # ------------------------------------------------------------------------------
 # Load the necessary data
 # ------------------------------------------------------------------------------
 
-# Metrics data for WFA
-D = dm.readSupplDataMetrics(dataFolder/'originalData/data_SD2.xlsx', removeAcronyms=True)
+# The data is taken from the data registry the first time the page is visited or
+# one of its callbacks is called, not when this module is imported
 
-# Coronal Slice Coordinates
-coronalCoordDfList = cf.loadAllSlices(dataFolder/'coordinates')
+# Empty anatomical explorer that the callbacks fill with data
+anatExplorerTemplate = cf.makeAnatExplorerScatter().to_plotly_json()
 
-# ------------------------------------------------------------------------------
-# Perform some preprocessing
-# ------------------------------------------------------------------------------
 
-# Create lists of dictionaries {label:areaName, value=areaID} for populating dropDowns
-coarseDict = cf.dataFrame_to_labelDict(D['coarse'],'coarse',structuresDf)
-midDict = cf.dataFrame_to_labelDict(D['mid'],'mid',structuresDf)
-fineDict = cf.dataFrame_to_labelDict(D['fine'],'fine',structuresDf)
+@pr.loadOnce
+def explorerCache():
+    """
+    Cache of the rendered anatomical explorer figures
+    """
+    return cm.FigureCache('pvExplorer', maxBytes=settings.FIGURE_CACHE_MAX_BYTES,
+        version=f"{cf.ANAT_EXPLORER_VERSION}-{dr.getExplorerFingerprint('pv')}")
 
 
+@pr.loadOnce
+def histogramCache():
+    """
+    Rendered histograms, shared by all the workers
+    """
+    return cm.FigureCache('pvHistogram', maxBytes=settings.RESPONSE_CACHE_MAX_BYTES,
+        version=f"{cf.HISTOGRAM_VERSION}-{dr.getDataFingerprint('pv')}")
+
+
+@pr.loadOnce
+def regionLabels():
+    """
+    Lists of dictionaries {label:areaName, value=areaID} for populating the
+    dropdowns of each resolution {coarse, mid, fine}
+    """
+    D = dr.getSupplDataMetrics('pv')
+    structuresDf = dr.getStructuresDf()
+    return {res: cf.dataFrame_to_labelDict(D[res], res, structuresDf) for res in ('coarse', 'mid', 'fine')}
+
 
 # ------------------------------------------------------------------------------
 # LAYOUT
 # ------------------------------------------------------------------------------
-layout = dbc.Container([
-    lf.make_CitationOffCanvas(id),
-    lf.make_AboutUsOffCanvas(id),
-    lf.make_MetricInfoModal(id),
-    dbc.Row(lf.make_NavBar()),                  # Navigation Bar
-    dbc.Row(lf.make_PvHeader(id)),             # Big header
-
-    # First portion (anatomical explorer)
-    dbc.Row([
-        dbc.Col(lf.make_AnatomicalExplorerSelectionMenu(id, staining='pv'),
-            xs=12,lg=3
-        ),
-        dbc.Col(
-            dbc.Spinner(
-                dcc.Graph(
-                    figure=cf.makeAnatExplorerScatter(),
-                    id=id('scatterSlice'),
-                    config={'displaylogo':False}
+def makeLayout(labels, explorerStore):
+    """
+    Layout of the page, with the options of the region dropdowns in labels
+    {coarse, mid, fine} and the stores of the clientside explorer in explorerStore
+    """
+    return dbc.Container([
+        lf.make_CitationOffCanvas(id),
+        lf.make_AboutUsOffCanvas(id),
+        lf.make_MetricInfoModal(id),
+        dbc.Row(lf.make_NavBar()),                  # Navigation Bar
+        dbc.Row(lf.make_PvHeader(id)),             # Big header
+
+        # First portion (anatomical explorer)
+        dbc.Row([
+            dbc.Col(lf.make_AnatomicalExplorerSelectionMenu(id, staining='pv'),
+                xs=12,lg=3
+            ),
+            dbc.Col([
+                dbc.Spinner(
+                    dcc.Graph(
+                        figure=cf.makeAnatExplorerScatter(),
+                        id=id('scatterSlice'),
+                        config={'displaylogo':False}
+                    ),
+                    color='primary',
                 ),
-                color='primary',
+                # Metric, colormap and slice drawn in the figure, to patch only what changes
+                dcc.Store(id=id('store_renderedExplorer')),
+            ] + explorerStore)
+        ], className = 'align-items-center'),
+
+        # Second portion (Histogram)
+        dbc.Row([lf.make_Subtitle('Comparative analysis')]),
+        dbc.Row([
+            dbc.Col(lf.make_MetricsHistogramSelectionMenu(id, labels['coarse'], labels['mid'], labels['fine'],'pv'),
+                xs=12,lg=4, className='mt-5'
+            ),
+            dbc.Col(
+                dbc.Spinner(
+                    dcc.Graph(id=id('hist_diffuse'), config={'displaylogo':False}),
+                    color='primary'
+                )
             )
-        )
-    ], className = 'align-items-center'),
-
-    # Second portion (Histogram)
-    dbc.Row([lf.make_Subtitle('Comparative analysis')]),
-    dbc.Row([
-        dbc.Col(lf.make_MetricsHistogramSelectionMenu(id, coarseDict, midDict, fineDict,'pv'),
-            xs=12,lg=4, className='mt-5'
-        ),
-        dbc.Col(
-            dbc.Spinner(
-                dcc.Graph(id=id('hist_diffuse'), config={'displaylogo':False}),
-                color='primary'
-            )
-        )
-    ]),
-    dbc.Row([lf.make_CollapsableTable(id)]),
-    dbc.Row([lf.make_CC_licenseBanner(id)]),
+        ]),
+        dbc.Row([lf.make_CollapsableTable(id)]),
+        dbc.Row([lf.make_CC_licenseBanner(id)]),
+
+        dbc.Row([],style={"margin-top": "500px"}),
+    ])
+
+
+@pr.loadOnce
+def layout():
+    """
+    Layout of the page with its data, built the first time the page is visited
+    """
+    # Everything the browser needs to draw the anatomical explorer by itself
+    explorerStore = []
+    if settings.CLIENTSIDE_EXPLORER:
+        explorerStore = [dcc.Store(
+            id=id('store_explorer'),
+            data=cf.makeAnatExplorerStoreData(dr.getAggregatedMetrics('pv')['mid'], dr.getSliceGeometry(), 'pv',
+                anatExplorerTemplate['layout'], [x['value'] for x in lf.colormapDictListDropdown()])
+        )]
 
-    dbc.Row([],style={"margin-top": "500px"}),
-])
+    return makeLayout(regionLabels(), explorerStore)
+
+
+def warmCache():
+    """
+    Renders all the figures of the anatomical explorer in advance, when the pages
+    are preloaded at startup. Since the disk level of the cache is shared, this
+    needs to happen only once for each version of the data.
+    """
+    if settings.WARM_FIGURE_CACHE and not settings.CLIENTSIDE_EXPLORER:
+        explorerCache().warm(
+            itertools.product(
+                [x['value'] for x in lf.getMetricsLabels(staining='pv')],
+                [x['value'] for x in lf.colormapDictListDropdown()],
+                range(sg.numSlices(dr.getSliceGeometry()))),
+            makeAnatomicalExplorerFigure)
+
+
+def validationLayout():
+    """
+    Same components of layout() without any data, to validate the callbacks
+    """
+    explorerStore = [dcc.Store(id=id('store_explorer'))] if settings.CLIENTSIDE_EXPLORER else []
+    return makeLayout({'coarse': [], 'mid': [], 'fine': []}, explorerStore)
 
 
 # ------------------------------------------------------------------------------
@@ -97,7 +161,6 @@ layout = dbc.Container([
 
 @callback(
     Output(component_id=id('hist_diffuse'), component_property='figure'),
-    Output(component_id=id('collps_Tab'), component_property='children'),
     Input(component_id=id('drpD_histogMetric'), component_property='value'),
     Input(component_id=id('drpD_majorSubd'), component_property='value'),
     Input(component_id=id('drpD_addCoarse'), component_property='value'),
@@ -109,49 +172,146 @@ def updateHistogram(selMetric, maj_sel, addC_sel, addM_sel, addF_sel, sortRegion
     """
     Update the diffuse fluorescence histogram
     """
-    # Filter data for the selected metric only
-    slicedCoarse = D['coarse'].xs(selMetric, axis=1, level='params')
-    slicedMid = D['mid'].xs(selMetric, axis=1, level='params')
-    slicedFine = D['fine'].xs(selMetric, axis=1, level='params')
+    # Equivalent selections are rendered only once
+    selection = cf.canonicalHistogramSelection(selMetric, maj_sel, addC_sel, addM_sel, addF_sel, sortRegions,
+        dr.getRegionIndex('pv'))
+    return histogramCache().getOrBuild(selection, makeHistogram, *selection)
+
+
+def makeHistogram(selMetric, maj_sel, addC_sel, addM_sel, addF_sel, sortRegions):
+    """
+    Renders the diffuse fluorescence histogram for a selection
+    """
+    aggrDf = selectHistogramData(selMetric, maj_sel, addC_sel, addM_sel, addF_sel, sortRegions)
+    fig = cf.update_diffuseFluoHistogram(aggrDf, selMetric, 'pv')
+    return fig
+
+
+def selectHistogramData(selMetric, maj_sel, addC_sel, addM_sel, addF_sel, sortRegions):
+    """
+    Mean, SEM, name and color of all the regions in a selection, in the order
+    in which they are shown
+    """
     # Combine data from all the area selected from multiple menus
     combinedDf = cf.combineDiffuseDataframes(maj_sel,addC_sel,addM_sel,addF_sel,
-        slicedCoarse,
-        slicedMid,
-        slicedFine)
-    # Aggregate to calculate Mean and SEM
-    aggrDf = cf.aggregateFluoDataframe(combinedDf, structuresDf)
+        dr.getRegionIndex('pv'), selMetric)
+    # Add names and colors to Mean and SEM
+    aggrDf = cf.aggregateFluoDataframe(combinedDf, dr.getStructuresDf())
     if sortRegions:
         aggrDf = aggrDf.sort_values(by='mean',ascending=False)
-
-    # Create a new visualization and table and return them
-    fig = cf.update_diffuseFluoHistogram(aggrDf, selMetric, 'pv')
-    tab = dbc.Table.from_dataframe(aggrDf.drop(columns=['color']), striped=True, bordered=True, hover=True)
-    return fig, tab
+    return aggrDf
 
 
 @callback(
-    Output(component_id=id('scatterSlice'), component_property='figure'),
-    State(component_id=id('scatterSlice'), component_property='figure'),
-    Input(component_id=id('drpD_anatomMetric'),component_property='value'),
-    Input(component_id=id('drpD_anatomCmap'),component_property='value'),
-    Input(component_id=id('slider_ap'),component_property='value'),
+    Output(component_id=id('table_data'), component_property='data'),
+    Output(component_id=id('table_data'), component_property='page_count'),
+    Output(component_id=id('table_data'), component_property='page_current'),
+    Input(component_id=id('drpD_histogMetric'), component_property='value'),
+    Input(component_id=id('drpD_majorSubd'), component_property='value'),
+    Input(component_id=id('drpD_addCoarse'), component_property='value'),
+    Input(component_id=id('drpD_addMid'), component_property='value'),
+    Input(component_id=id('drpD_addFine'), component_property='value'),
+    Input(component_id=id('switch_sortDiff'), component_property='value'),
+    Input(component_id=id('table_data'), component_property='page_current'),
+    Input(component_id=id('collps_Tab'), component_property='is_open'),
 )
-def updateAnatomicalExplorer(fig, selMetric, cmap, apIdx):
+def updateTable(selMetric, maj_sel, addC_sel, addM_sel, addF_sel, sortRegions, pageCurrent, isOpen):
+    """
+    Update the tabular data, sending only the rows of the page that is shown.
+    Nothing is computed while the table is collapsed: it is filled when it opens
+    """
+    if not isOpen:
+        return no_update, no_update, no_update
+    # Go back to the first page whenever the selection changes
+    if id('table_data') + '.page_current' not in ctx.triggered_prop_ids:
+        pageCurrent = 0
+    selection = cf.canonicalHistogramSelection(selMetric, maj_sel, addC_sel, addM_sel, addF_sel, sortRegions,
+        dr.getRegionIndex('pv'))
+    aggrDf = selectHistogramData(*selection)
+    data, pageCount, pageCurrent = cf.tablePage(aggrDf, pageCurrent, lf.TABLE_PAGE_SIZE)
+    return data, pageCount, pageCurrent
+
+
+def updateAnatomicalExplorer(selMetric, cmap, apIdx, rendered):
     """
     Update the anatomical explore plot with the data selected from the multiple
     sliders and dropdown menus on the left.
+    rendered is the metric, colormap and slice of the figure in the browser.
     """
-    # Select which dataset to show
-    data = D['mid'].xs(selMetric, axis=1, level='params')
+    if not isExplorerSelection(selMetric, cmap, apIdx):
+        return no_update, no_update
+    selection = dict(metric=selMetric, cmap=cmap, slice=apIdx)
+    # If the slice did not change only what changed in the regions is updated.
+    # The patch is only valid for the figure of the same slice: the figure in the
+    # browser may still be another one (e.g. the response for a new slice has not
+    # arrived yet, or nothing has been drawn so far)
+    if isinstance(rendered, dict) and rendered.get('slice') == apIdx:
+        if rendered == selection:
+            return no_update, no_update
+        sliceGeometry = dr.getSliceGeometry()
+        min, max, = cf.getClimsAnatomicalExplorer(selMetric, staining='pv')
+        aggrDf = cf.midRegionStats(dr.getAggregatedMetrics('pv')['mid'], selMetric)
+        sliceView = sg.getSliceView(sliceGeometry, apIdx)
+        patch = cf.patchAnatExplorerScatter(sliceView, sliceGeometry['regions'], aggrDf, cmap, min, max,
+            metricChanged=rendered.get('metric') != selMetric, cmapChanged=rendered.get('cmap') != cmap)
+        return patch, selection
+
+    fig = explorerCache().getOrBuild((selMetric, cmap, apIdx),
+        makeAnatomicalExplorerFigure, selMetric, cmap, apIdx)
+    return fig, selection
+
+
+def isExplorerSelection(selMetric, cmap, apIdx):
+    """
+    Whether the anatomical explorer can be drawn for a metric, colormap and slice.
+    Only the values offered by the page are drawn, so that requests with any
+    other value do not fill the figure cache.
+    """
+    return (selMetric in [x['value'] for x in lf.getMetricsLabels(staining='pv')]
+        and cmap in [x['value'] for x in lf.colormapDictListDropdown()]
+        and type(apIdx) is int and 0 <= apIdx < sg.numSlices(dr.getSliceGeometry()))
+
+
+def makeAnatomicalExplorerFigure(selMetric, cmap, apIdx):
+    """
+    Renders the anatomical explorer for a metric, colormap and slice
+    """
+    sliceGeometry = dr.getSliceGeometry()
     # Get the correct limits to the colormap
     min, max, = cf.getClimsAnatomicalExplorer(selMetric, staining='pv')
 
-    df = cf.mergeCoordinatesAndData(coronalCoordDfList[apIdx], data)
-    fig = cf.redrawAnatExplorerScatter(fig, df, cmap, min, max)
+    # Select which dataset to show
+    aggrDf = cf.midRegionStats(dr.getAggregatedMetrics('pv')['mid'], selMetric)
+    # Draw the slice only with the detail that the graph can show
+    lod = sg.chooseLodLevel(sliceGeometry, apIdx, anatExplorerTemplate['layout']['height'])
+    sliceView = sg.getSliceView(sliceGeometry, apIdx, lod)
+    fig = cf.redrawAnatExplorerScatter(anatExplorerTemplate, sliceView, sliceGeometry['regions'], aggrDf, cmap, min, max)
 
     return fig
 
 
+# The anatomical explorer is drawn either in the browser or here on the server
+if settings.CLIENTSIDE_EXPLORER:
+    clientside_callback(
+        ClientsideFunction(namespace='anatomicalExplorer', function_name='render'),
+        Output(component_id=id('scatterSlice'), component_property='figure'),
+        Input(component_id=id('drpD_anatomMetric'),component_property='value'),
+        Input(component_id=id('drpD_anatomCmap'),component_property='value'),
+        Input(component_id=id('slider_ap'),component_property='value'),
+        State(component_id=id('store_explorer'), component_property='data'),
+    )
+else:
+    callback(
+        Output(component_id=id('scatterSlice'), component_property='figure'),
+        Output(component_id=id('store_renderedExplorer'), component_property='data'),
+        Input(component_id=id('drpD_anatomMetric'),component_property='value'),
+        Input(component_id=id('drpD_anatomCmap'),component_property='value'),
+        Input(component_id=id('slider_ap'),component_property='value'),
+        State(component_id=id('store_renderedExplorer'), component_property='data'),
+    )(updateAnatomicalExplorer)
+
+
+
 @callback(
     Output(component_id=id('collps_Tab'), component_property='is_open'),
     Output(component_id=id('btn_openTabDiffuse'), component_property='children'),
@@ -177,7 +337,7 @@ def invertTabVisibility( _ , previousState):
     prevent_initial_call=True
 )
 def addAllCoarseDiffuse(n_clicks):
-    coarseIDs = [x['value'] for x in coarseDict]
+    coarseIDs = [x['value'] for x in regionLabels()['coarse']]
     return coarseIDs
 
 
@@ -0,0 +1,22 @@
+"""
+Tests of the colormaps baked in as lookup tables
+"""
+import sys
+
+import pytest
+
+from utils import colormaps
+from utils import layoutFunctions as lf
+
+
+def test_dropdownColormaps():
+    for option in lf.colormapDictListDropdown():
+        rgb = colormaps.getColormap(option['value'])
+        assert rgb.shape == (256, 3) and rgb.dtype.name == 'uint8'
+
+
+@pytest.mark.parametrize('name', ['jet', 'PuBu_r', None, ['PuBu']])
+def test_unknownColormaps(name):
+    with pytest.raises(KeyError):
+        colormaps.getColormap(name)
+    assert 'matplotlib' not in sys.modules
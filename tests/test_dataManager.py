@@ -0,0 +1,109 @@
+"""
+Tests of the files written in the cache folder
+"""
+import os
+import stat
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import cacheManager as cm
+from utils import dataManager as dm
+from utils import settings
+
+
+@pytest.fixture
+def cacheFolder(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'CACHE_FOLDER', tmp_path)
+    monkeypatch.setattr(settings, 'USE_DATA_CACHE', True)
+    return tmp_path
+
+
+def makeArrays():
+    return dict(a=np.arange(10, dtype=np.int64), b=np.ones((3, 4), dtype=np.float32)), {'name': 'x'}
+
+
+def counted(build):
+    calls = []
+    def wrapper():
+        calls.append(1)
+        return build()
+    return wrapper, calls
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_packedCache(cacheFolder):
+    build, calls = counted(makeArrays)
+    arrays, meta = dm.loadPackedCache('test', 'v1', build)
+    arrays, meta = dm.loadPackedCache('test', 'v1', build)
+    assert len(calls) == 1
+    np.testing.assert_array_equal(arrays['b'], np.ones((3, 4)))
+    assert meta == {'name': 'x'}
+    assert not arrays['a'].flags['WRITEABLE']
+
+    # A new version replaces the previous one
+    dm.loadPackedCache('test', 'v2', build)
+    assert len(calls) == 2
+    assert [p.name for p in cacheFolder.glob('test_*.bin')] == ['test_v2.bin']
+
+
+def test_permissions(cacheFolder):
+    dm.loadPackedCache('test', 'v1', makeArrays)
+    df = pd.DataFrame({'x': [1.0, 2.0]}, index=pd.Index(['a', 'b'], name='id'))
+    dm._saveDataFrameNpz(df, cacheFolder/'df.npz')
+    cache = cm.DiskCache(cacheFolder/'figures', maxBytes=1000)
+    cache.set('key', 'value')
+    files = [cacheFolder/'test_v1.bin', cacheFolder/'df.npz'] + list((cacheFolder/'figures').glob('*.json'))
+    assert len(files) == 3
+    for path in files:
+        assert mode(path) == dm.CACHE_FILE_MODE
+
+
+@pytest.mark.parametrize('content', [b'', b'PNNPACK1', b'PNNPACK1' + b'\xff' * 100, b'garbage' * 100])
+def test_corruptedPackedFile(cacheFolder, content):
+    dm.loadPackedCache('test', 'v1', makeArrays)
+    (cacheFolder/'test_v1.bin').write_bytes(content)
+    build, calls = counted(makeArrays)
+    arrays, _ = dm.loadPackedCache('test', 'v1', build)
+    assert len(calls) == 1
+    np.testing.assert_array_equal(arrays['a'], np.arange(10))
+    # The file was built again
+    assert dm.readPackedArrays(cacheFolder/'test_v1.bin')[1] == {'name': 'x'}
+
+
+def test_truncatedPackedFile(cacheFolder):
+    dm.loadPackedCache('test', 'v1', makeArrays)
+    path = cacheFolder/'test_v1.bin'
+    path.write_bytes(path.read_bytes()[:-20])
+    arrays, _ = dm.loadPackedCache('test', 'v1', makeArrays)
+    np.testing.assert_array_equal(arrays['b'], np.ones((3, 4)))
+
+
+def test_unreadableFile(cacheFolder, monkeypatch):
+    dm.loadPackedCache('test', 'v1', makeArrays)
+    def unreadable(path):
+        raise PermissionError(path)
+    build, calls = counted(makeArrays)
+    result = dm.loadCacheFile(cacheFolder/'test_v1.bin', build, unreadable,
+        lambda content, path: dm.writePackedArrays(path, *content))
+    # Rebuilt in memory when the new file can't be read either
+    assert len(calls) == 1 and result[1] == {'name': 'x'}
+
+
+def test_readOnlyFolder(cacheFolder):
+    def readOnly(content, path):
+        raise PermissionError(path)
+    build, calls = counted(makeArrays)
+    arrays, meta = dm.loadCacheFile(cacheFolder/'test_v1.bin', build, dm.readPackedArrays, readOnly)
+    assert len(calls) == 1 and meta == {'name': 'x'}
+    assert not (cacheFolder/'test_v1.bin').exists()
+
+
+def test_withoutCache(cacheFolder, monkeypatch):
+    monkeypatch.setattr(settings, 'USE_DATA_CACHE', False)
+    dm.loadPackedCache('test', 'v1', makeArrays)
+    assert not list(cacheFolder.iterdir())
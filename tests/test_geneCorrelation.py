@@ -0,0 +1,133 @@
+"""
+Tests of the batched gene correlations against pandas, on synthetic data
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from flask import Flask
+
+from utils import geneCorrelation as gc
+
+
+REGION_IDS = np.arange(100, 140)
+
+
+def referenceCorrelation(x, metric):
+    """
+    Correlation of one gene computed with DataFrame.corr, as in the scatter plot
+    of the genes page
+    """
+    df = pd.concat([pd.Series(x, index=REGION_IDS, name='x'), metric.rename('y')], axis=1, join='inner')
+    df = df.drop(list(gc.EXCLUDED_REGIONS), errors='ignore')
+    df = df[(df > 0).all(axis=1) & np.isfinite(df).all(axis=1)]
+    df = np.log10(df)
+    if len(df) < gc.MIN_REGIONS:
+        return np.nan, np.nan, len(df)
+    return df.corr().iat[0, 1], df.rank().corr().iat[0, 1], len(df)
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    # One region of the metric is missing from the expression, and the
+    # expression has a region that is not in the metric
+    metric = pd.Series(10**rng.normal(size=len(REGION_IDS)), index=pd.Index(REGION_IDS + 1, name='mid'))
+    metric.iloc[[3, 4]] = [np.nan, 0]
+    energy = 10**rng.normal(size=(30, len(REGION_IDS)))
+    energy[:10] = metric.reindex(REGION_IDS).to_numpy()**rng.uniform(-2, 2, (10, 1)) * 10**rng.normal(0, .3, (10, len(REGION_IDS)))
+    energy[rng.random(energy.shape) < .1] = np.nan
+    energy[10, ::2] = -1
+    # Ties in the ranks
+    energy[11, :20] = 5
+    return energy, metric
+
+
+def test_againstPandas(data):
+    energy, metric = data
+    correlations = gc.correlateGenes(energy, REGION_IDS, metric, chunkSize=7)
+    for k in range(len(energy)):
+        pearson, spearman, n = referenceCorrelation(energy[k], metric)
+        assert correlations['n'][k] == n
+        np.testing.assert_allclose(correlations['pearson'][k], pearson, atol=1e-10)
+        np.testing.assert_allclose(correlations['spearman'][k], spearman, atol=1e-10)
+    # The first genes follow the metric
+    assert np.all(np.abs(correlations['spearman'][:10]) > .5)
+
+
+def test_excludedRegions(data):
+    energy, metric = data
+    regionIDs = REGION_IDS.copy()
+    metric = metric.rename({regionIDs[8]: gc.EXCLUDED_REGIONS[0]})
+    regionIDs[8] = gc.EXCLUDED_REGIONS[0]
+    correlations = gc.correlateGenes(energy, regionIDs, metric)
+    withoutRegion = gc.correlateGenes(np.delete(energy, 8, axis=1), np.delete(regionIDs, 8), metric)
+    for k in ('pearson', 'spearman', 'n'):
+        np.testing.assert_array_equal(correlations[k], withoutRegion[k])
+
+
+def test_constantAndMissingRows(data):
+    energy, metric = data
+    energy = energy[:4].copy()
+    energy[0] = 3.
+    energy[1] = np.nan
+    energy[2] = 0
+    correlations = gc.correlateGenes(energy, REGION_IDS, metric)
+    assert np.isnan(correlations['pearson'][:3]).all()
+    assert np.isnan(correlations['spearman'][:3]).all()
+    assert correlations['n'][:3].tolist() == [len(REGION_IDS) - 3, 0, 0]
+    assert np.isfinite(correlations['pearson'][3])
+
+    # Constant metric
+    correlations = gc.correlateGenes(energy, REGION_IDS, pd.Series(2., index=metric.index))
+    assert np.isnan(correlations['pearson']).all() and np.isnan(correlations['spearman']).all()
+
+
+def test_minRegions(data):
+    energy, metric = data
+    x = np.full((2, len(REGION_IDS)), np.nan)
+    # The regions of columns 10 to 12 have a value of the metric
+    x[0, 10:10 + gc.MIN_REGIONS] = [1, 3, 2]
+    x[1, 10:10 + gc.MIN_REGIONS - 1] = [1, 3]
+    correlations = gc.correlateGenes(x, REGION_IDS, metric)
+    assert correlations['n'].tolist() == [gc.MIN_REGIONS, gc.MIN_REGIONS - 1]
+    assert np.isfinite(correlations['pearson'][0]) and np.isnan(correlations['pearson'][1])
+    assert np.isfinite(correlations['spearman'][0]) and np.isnan(correlations['spearman'][1])
+
+
+@pytest.fixture
+def table():
+    return pd.DataFrame({
+        'gene_acronym': ['Acan', 'Bcan', np.nan],
+        'spearman': [.1, np.nan, .3],
+        'pearson': [.2, .2, .1],
+        'n': [5, 2, 6],
+    }, index=pd.Index([30, 10, 20], name='gene_AGEA_id'))
+
+
+def test_sortGenes(table):
+    assert gc.sortGenes(table).index.tolist() == [20, 30, 10]
+    assert gc.sortGenes(table, [{'column_id': 'spearman', 'direction': 'asc'}]).index.tolist() == [30, 20, 10]
+    assert gc.sortGenes(table, [{'column_id': 'gene_AGEA_id', 'direction': 'asc'}]).index.tolist() == [10, 20, 30]
+    assert gc.sortGenes(table, [
+        {'column_id': 'pearson', 'direction': 'desc'},
+        {'column_id': 'gene_AGEA_id', 'direction': 'desc'},
+    ]).index.tolist() == [30, 10, 20]
+    assert gc.sortGenes(table, [{'column_id': 'unknown', 'direction': 'asc'}]).equals(table)
+
+
+def test_api(table):
+    server = Flask(__name__)
+    gc.installGeneCorrelationApi(server, lambda metric: table)
+    client = server.test_client()
+
+    response = client.get(f"{gc.GENE_CORRELATION_ROUTE}?metric=wfa_energy&limit=2")
+    assert response.status_code == 200
+    genes = response.get_json()['genes']
+    assert [g['gene_AGEA_id'] for g in genes] == [20, 30]
+    assert genes[0]['gene_acronym'] is None
+
+    response = client.get(f"{gc.GENE_CORRELATION_ROUTE}?sort=gene_AGEA_id&order=asc")
+    assert [g['gene_AGEA_id'] for g in response.get_json()['genes']] == [10, 20, 30]
+
+    for query in ('metric=unknown', 'sort=unknown', 'order=up'):
+        assert client.get(f"{gc.GENE_CORRELATION_ROUTE}?{query}").status_code == 400
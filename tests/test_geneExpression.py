@@ -0,0 +1,78 @@
+"""
+Tests of the gene expression store on a small synthetic csv
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import geneExpression as ge
+from utils import settings
+
+
+@pytest.fixture
+def ishCsv(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'CACHE_FOLDER', tmp_path/'cache')
+    monkeypatch.setattr(settings, 'USE_DATA_CACHE', True)
+    (tmp_path/'cache').mkdir()
+    rng = np.random.default_rng(0)
+    # The Allen csv stores the gene IDs as floats
+    ishDf = pd.DataFrame(rng.random((3, 4)),
+        index=pd.Index([11126.0, 11382.0, 1041936.0], name='gene_id'),
+        columns=['184', '985', '993', '353'])
+    path = tmp_path/'ish.csv'
+    ishDf.to_csv(path)
+    return path, ishDf
+
+
+def test_floatIDs(ishCsv):
+    path, _ = ishCsv
+    energy, geneIDs, regionIDs = ge.packGeneExpression(path)
+    assert geneIDs.dtype == np.int64
+    assert geneIDs.tolist() == [11126, 11382, 1041936]
+    assert regionIDs.tolist() == [184, 985, 993, 353]
+    assert energy.dtype == np.float32 and energy.flags['C_CONTIGUOUS']
+
+
+def test_stringIDs(tmp_path):
+    path = tmp_path/'ish.csv'
+    pd.DataFrame([[1.0, 2.0]], index=pd.Index(['Acan'], name='gene_id'), columns=['184', '985']).to_csv(path)
+    _, geneIDs, _ = ge.packGeneExpression(path)
+    assert geneIDs.tolist() == ['Acan']
+
+
+def test_rowLookup(ishCsv):
+    path, ishDf = ishCsv
+    store = ge.loadGeneExpression(path)
+    assert len(store) == 3
+    for gene in (11382, 11382.0, '11382', np.int64(11382)):
+        assert gene in store
+        assert store.rowOf(gene) == 1
+    assert 1 not in store and 'Acan' not in store and None not in store
+    with pytest.raises(KeyError):
+        store.rowOf(1)
+
+    series = store.geneSeries(1041936)
+    assert series.index.name == 'mid'
+    assert series.index.tolist() == [184, 985, 993, 353]
+    np.testing.assert_array_equal(series.to_numpy(), ishDf.loc[1041936.0].to_numpy(dtype=np.float32))
+
+
+def test_cache(ishCsv):
+    path, _ = ishCsv
+    store = ge.loadGeneExpression(path)
+    cached = list(settings.CACHE_FOLDER.glob('geneExpression_*.bin'))
+    assert len(cached) == 1
+
+    # The second load memory-maps the packed file
+    again = ge.loadGeneExpression(path)
+    assert not again.energy.flags['OWNDATA'] and not again.energy.flags['WRITEABLE']
+    assert again.fingerprint == store.fingerprint
+    np.testing.assert_array_equal(again.energy, store.energy)
+    assert again.geneIDs.tolist() == store.geneIDs.tolist()
+    assert again.rowOf(11126) == 0
+
+    # A new csv replaces the stale file
+    pd.DataFrame([[1.0]], index=pd.Index([5.0], name='gene_id'), columns=['184']).to_csv(path)
+    assert ge.loadGeneExpression(path).rowOf(5) == 0
+    assert list(settings.CACHE_FOLDER.glob('geneExpression_*.bin')) != cached
+    assert len(list(settings.CACHE_FOLDER.glob('geneExpression_*.bin'))) == 1
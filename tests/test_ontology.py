@@ -0,0 +1,102 @@
+"""
+Tests of the ontology index on a small tree with the same fields as structures.json:
+
+    1
+    ├── 2
+    │   ├── 4
+    │   └── 5
+    │       └── 7
+    └── 3
+        └── 6
+"""
+import json
+
+import numpy as np
+import pytest
+
+from utils import ontology as onto
+
+
+def makeStructures():
+    paths = {1: [1], 2: [1, 2], 3: [1, 3], 4: [1, 2, 4], 5: [1, 2, 5], 7: [1, 2, 5, 7], 6: [1, 3, 6]}
+    # Listed out of graph order on purpose
+    order = [1, 2, 4, 5, 7, 3, 6]
+    return [{'id': i, 'structure_id_path': paths[i], 'graph_order': order.index(i)}
+        for i in sorted(paths, reverse=True)]
+
+
+@pytest.fixture
+def ontology():
+    return onto.Ontology(makeStructures())
+
+
+def test_preorder(ontology):
+    assert ontology.ids.tolist() == [1, 2, 4, 5, 7, 3, 6]
+    assert ontology.rootID == 1
+    assert len(ontology) == 7
+    assert 7 in ontology and 8 not in ontology
+
+
+def test_parentAndDepth(ontology):
+    assert ontology.parentOf(1) is None
+    assert ontology.parentOf(7) == 5
+    assert ontology.depthOf(1) == 0
+    assert ontology.depthOf(7) == 3
+
+
+def test_descendants(ontology):
+    assert ontology.descendants(2).tolist() == [2, 4, 5, 7]
+    assert ontology.descendants(2, strict=True).tolist() == [4, 5, 7]
+    assert ontology.descendants(6).tolist() == [6]
+    assert ontology.children(1).tolist() == [2, 3]
+    assert ontology.children(2).tolist() == [4, 5]
+
+
+def test_isDescendant(ontology):
+    ids = [1, 2, 3, 4, 5, 6, 7]
+    assert ontology.isDescendant(ids, 2).tolist() == [False, True, False, True, True, False, True]
+    assert ontology.isDescendant(ids, 2, strict=True).tolist() == [False, False, False, True, True, False, True]
+    assert bool(ontology.isDescendant(7, 1))
+    assert not ontology.isDescendant(6, 2)
+
+
+def test_ancestors(ontology):
+    assert ontology.ancestors(7).tolist() == [1, 2, 5, 7]
+    assert ontology.ancestors(7, strict=True).tolist() == [1, 2, 5]
+    assert ontology.ancestors(1, strict=True).tolist() == []
+
+
+def test_ancestorAtDepth(ontology):
+    assert ontology.ancestorAtDepth(7, 1) == 2
+    assert ontology.ancestorAtDepth(7, 0) == 1
+    # Structures that are not as deep are returned unchanged
+    assert ontology.ancestorAtDepth(2, 2) == 2
+    assert ontology.ancestorAtDepth(np.array([7, 6, 4, 1]), 1).tolist() == [2, 3, 2, 1]
+
+
+@pytest.mark.parametrize('a, b, expected', [
+    (4, 7, 2), (7, 4, 2), (7, 6, 1), (5, 7, 5), (7, 5, 5), (7, 7, 7), (1, 6, 1),
+])
+def test_lowestCommonAncestor(ontology, a, b, expected):
+    assert ontology.lowestCommonAncestor(a, b) == expected
+
+
+def test_unknownIDs(ontology):
+    with pytest.raises(KeyError):
+        ontology.positionOf(8)
+    with pytest.raises(KeyError):
+        ontology.positionOf([1, 8])
+    with pytest.raises(KeyError):
+        ontology.descendants(0)
+
+
+def test_singleRoot():
+    structures = makeStructures() + [{'id': 9, 'structure_id_path': [9], 'graph_order': 7}]
+    with pytest.raises(ValueError):
+        onto.Ontology(structures)
+
+
+def test_loadOntology(tmp_path):
+    path = tmp_path/'structures.json'
+    path.write_text(json.dumps(makeStructures()))
+    assert onto.loadOntology(path).ids.tolist() == [1, 2, 4, 5, 7, 3, 6]
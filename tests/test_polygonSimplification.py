@@ -0,0 +1,159 @@
+"""
+Tests of the topology-preserving simplification of the polygons of a slice.
+Crossings and containment are checked by brute force on small polygons.
+"""
+import numpy as np
+import pytest
+
+from utils import polygonSimplification as ps
+
+
+def ring(points):
+    points = np.asarray(points, dtype=float)
+    return np.vstack([points, points[:1]])
+
+
+def noisyCircle(center, radius, n, rng, noise=.05):
+    angles = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    r = radius * (1 + noise * rng.standard_normal(n))
+    return ring(np.column_stack([center[0] + r * np.cos(angles), center[1] + r * np.sin(angles)]))
+
+
+def pack(rings):
+    vertices = np.vstack(rings)
+    polyOffsets = np.cumsum([0] + [len(r) for r in rings])
+    return vertices, polyOffsets
+
+
+def simplifiedRings(vertices, polyOffsets, keep):
+    return [vertices[a:b][keep[a:b]] for a, b in zip(polyOffsets[:-1], polyOffsets[1:])]
+
+
+def edges(rings):
+    return [(r[k], r[k + 1], p) for p, r in enumerate(rings) for k in range(len(r) - 1)]
+
+
+def crosses(p, p2, q, q2):
+    def orientation(a, b, c):
+        return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+    return (orientation(p, p2, q) * orientation(p, p2, q2) < 0
+        and orientation(q, q2, p) * orientation(q, q2, p2) < 0)
+
+
+def countCrossings(rings):
+    allEdges = edges(rings)
+    return sum(crosses(p, p2, q, q2)
+        for i, (p, p2, _) in enumerate(allEdges) for q, q2, _ in allEdges[i + 1:])
+
+
+def inside(point, polygon):
+    x, y = point
+    result = False
+    for (x0, y0), (x1, y1) in zip(polygon[:-1], polygon[1:]):
+        if (y0 > y) != (y1 > y) and x < x0 + (y - y0) * (x1 - x0) / (y1 - y0):
+            result = not result
+    return result
+
+
+def containment(rings):
+    return [[p != q and inside(rings[q][0], rings[p]) for q in range(len(rings))] for p in range(len(rings))]
+
+
+def test_douglasPeuckerTolerance():
+    rng = np.random.default_rng(0)
+    points = np.cumsum(rng.standard_normal((200, 2)), axis=0)
+    for tolerance in (.5, 2, 10):
+        keep = ps.douglasPeucker(points, tolerance)
+        assert keep[0] and keep[-1]
+        kept = np.flatnonzero(keep)
+        assert len(kept) < len(points)
+        # Every removed vertex is close to the simplified edge that replaces it
+        for a, b in zip(kept[:-1], kept[1:]):
+            if b - a > 1:
+                dist = ps._pointSegmentDistance(points[a + 1:b], points[a], points[b])
+                assert dist.max() <= tolerance
+
+
+def test_simplifyRing():
+    rng = np.random.default_rng(1)
+    circle = noisyCircle((0, 0), 10, 100, rng)
+    keep = ps.simplifyRing(circle, .5)
+    assert keep[0] and keep[-1]
+    assert 3 <= keep[:-1].sum() < 100
+    # Never collapsed to a segment, even with a huge tolerance
+    keep = ps.simplifyRing(circle, 1000)
+    assert keep[:-1].sum() >= 3
+    assert len(np.unique(circle[keep], axis=0)) >= 3
+    # Nothing is removed from triangles or without tolerance
+    assert ps.simplifyRing(ring([(0, 0), (1, 0), (0, 1)]), 10).all()
+    assert ps.simplifyRing(circle, 0).all()
+
+
+def test_noTolerance():
+    vertices, polyOffsets = pack([noisyCircle((0, 0), 10, 50, np.random.default_rng(2))])
+    assert ps.simplifyPolygons(vertices, polyOffsets, 0).all()
+
+
+def test_neighborsDoNotCross():
+    # Two regions sharing a jagged border, each with its own copy of the border
+    rng = np.random.default_rng(3)
+    y = np.linspace(10, 0, 60)
+    border = np.column_stack([5 + rng.uniform(-1, 1, len(y)), y])
+    left = ring(np.vstack([border, [(0, 0), (0, 10)]]))
+    right = ring(np.vstack([border[::-1], [(10, 10), (10, 0)]]))
+    rings = [left, right]
+    assert countCrossings(rings) == 0
+
+    vertices, polyOffsets = pack(rings)
+    keep = ps.simplifyPolygons(vertices, polyOffsets, 1.5)
+    simplified = simplifiedRings(vertices, polyOffsets, keep)
+    assert keep.sum() < len(vertices)
+    assert countCrossings(simplified) == 0
+    # Each region simplified on its own would cross its neighbor
+    alone = [r[ps.simplifyRing(r, 1.5)] for r in rings]
+    assert countCrossings(alone) > 0
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_randomSlices(seed):
+    rng = np.random.default_rng(seed)
+    rings = [noisyCircle(rng.uniform(0, 20, 2), rng.uniform(1, 4), 40, rng, noise=.2) for _ in range(8)]
+    vertices, polyOffsets = pack(rings)
+    keep = ps.simplifyPolygons(vertices, polyOffsets, .6)
+    simplified = simplifiedRings(vertices, polyOffsets, keep)
+    # Crossings of the original data can't be fixed, but no new one is added
+    assert countCrossings(simplified) <= countCrossings(rings)
+    for r in simplified:
+        assert len(r) >= 4 and np.array_equal(r[0], r[-1])
+
+
+def test_containment():
+    # A small region in a notch of a bigger one: removing the notch puts it
+    # inside the bigger region without any crossing
+    big = ring([(0, 0), (4, 0), (5, .8), (6, 0), (10, 0), (10, 5), (0, 5)])
+    small = ring([(4.9, .1), (5.1, .1), (5, .3)])
+    rings = [big, small]
+    alone = [big[ps.simplifyRing(big, 1)], small]
+    assert containment(alone) != containment(rings)
+
+    vertices, polyOffsets = pack(rings)
+    keep = ps.simplifyPolygons(vertices, polyOffsets, 1)
+    simplified = simplifiedRings(vertices, polyOffsets, keep)
+    assert containment(simplified) == containment(rings)
+    assert countCrossings(simplified) == 0
+
+
+def test_notch():
+    # A small region that sticks out of the notch: removing the notch makes the
+    # bigger region cross it
+    big = ring([(0, 0), (4, 0), (5, .8), (6, 0), (10, 0), (10, 5), (0, 5)])
+    small = ring([(4.9, -.2), (5.1, -.2), (5, .3)])
+    rings = [big, small]
+    alone = [big[ps.simplifyRing(big, 1)], small]
+    assert countCrossings(rings) == 0 and countCrossings(alone) > 0
+
+    vertices, polyOffsets = pack(rings)
+    keep = ps.simplifyPolygons(vertices, polyOffsets, 1)
+    simplified = simplifiedRings(vertices, polyOffsets, keep)
+    assert countCrossings(simplified) == 0
+    assert containment(simplified) == containment(rings)
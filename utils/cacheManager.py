@@ -0,0 +1,255 @@
+"""
+Caches for the figures produced by the callbacks.
+
+Figures are stored serialized as json, the same format sent to the browser, so
+that a cache hit does not need to build any pandas or plotly object. Each cache
+has a bounded in-memory LRU level (private to each worker process) and an
+optional level in the cache folder that is shared by all the workers, either as
+one json file per entry or as a SQLite database (see SHARED_CACHE_BACKEND in
+settings.py).
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from plotly.io.json import to_json_plotly
+
+from . import dataManager as dm
+from . import settings
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory LRU cache that keeps at most maxItems entries and, if
+    maxBytes is given, at most maxBytes of values (measured with len())
+    """
+    def __init__(self, maxItems=128, maxBytes=None):
+        self.maxItems = maxItems
+        self.maxBytes = maxBytes
+        self.nBytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return None
+            return self._data[key]
+
+    def set(self, key, value):
+        if self.maxItems <= 0 or (self.maxBytes is not None and len(value) > self.maxBytes):
+            return
+        with self._lock:
+            if key in self._data:
+                self.nBytes -= len(self._data[key])
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self.nBytes += len(value)
+            while len(self._data) > self.maxItems or (self.maxBytes is not None and self.nBytes > self.maxBytes):
+                _, evicted = self._data.popitem(last=False)
+                self.nBytes -= len(evicted)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskCache:
+    """
+    Folder of json files, one for each key, shared by all the worker processes.
+    When the files exceed maxBytes, the least recently used ones are removed.
+    """
+    def __init__(self, folder, maxBytes=None):
+        self.folder = Path(folder)
+        self.maxBytes = maxBytes
+
+    def _path(self, key):
+        return self.folder / f"{hashlib.sha1(key.encode()).hexdigest()}.json"
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                value = f.read()
+        except OSError:
+            return None
+        if self.maxBytes is not None:
+            # The modification time records when each entry was last used
+            try:
+                os.utime(path)
+            except OSError:
+                pass    # Entry written by another user
+        return value
+
+    def set(self, key, value):
+        # Write to a temporary file first so that other workers never read a
+        # partially written entry
+        try:
+            self.folder.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile('w', dir=self.folder, suffix='.tmp',
+                    encoding='utf-8', delete=False) as f:
+                f.write(value)
+            dm.replaceWithTempFile(f.name, self._path(key))
+            if self.maxBytes is not None:
+                self._evict()
+        except OSError:
+            pass    # Read-only cache folder, the memory level still works
+
+    def _evict(self):
+        entries = []
+        for path in self.folder.glob('*.json'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue    # Removed by another worker
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        # Remove the least recently used entries until the total fits
+        for _, size, path in sorted(entries, key=lambda e: e[0]):
+            if total <= self.maxBytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            total -= size
+
+
+class SqliteCache:
+    """
+    SQLite database of json strings shared by all the worker processes. When the
+    values stored exceed maxBytes, the least recently used entries are removed.
+    """
+    def __init__(self, pathToFile, maxBytes=None):
+        self.path = Path(pathToFile)
+        self.maxBytes = maxBytes
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite connections can't be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS entries "
+                "(key TEXT PRIMARY KEY, value TEXT, size INTEGER, accessed REAL)")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        try:
+            conn = self._connection()
+            row = conn.execute("SELECT value FROM entries WHERE key=?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self.maxBytes is not None:
+                conn.execute("UPDATE entries SET accessed=? WHERE key=?", (time.time(), key))
+            return row[0]
+        except (sqlite3.Error, OSError):
+            return None
+
+    def set(self, key, value):
+        try:
+            conn = self._connection()
+            conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time()))
+            if self.maxBytes is not None:
+                self._evict(conn)
+        except (sqlite3.Error, OSError):
+            pass    # Read-only cache folder, the memory level still works
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.maxBytes:
+            return
+        # Remove the least recently used entries until the total fits
+        removed = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed"):
+            if total <= self.maxBytes:
+                break
+            removed.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM entries WHERE key=?", removed)
+
+
+def makeSharedCache(name, maxBytes=None):
+    """
+    Shared level of the cache called name, in the backend chosen in settings.py
+    """
+    folder = settings.CACHE_FOLDER / 'figures'
+    if settings.SHARED_CACHE_BACKEND == 'sqlite':
+        return SqliteCache(folder / f"{name}.sqlite", maxBytes=maxBytes)
+    return DiskCache(folder / name, maxBytes=maxBytes)
+
+
+class FigureCache:
+    """
+    Two-level (memory + disk) cache of serialized figures.
+
+    PARAMETERS
+    ********************
+    name:str name of the cache, used as the folder name of the disk level
+    version:str fingerprint of the data used to build the figures. Entries built
+        from a different version of the data are never returned
+    maxItems:int maximum number of figures kept in memory by each worker
+    maxBytes:int maximum size of the figures kept in memory by each worker and
+        in the shared level
+    onDisk:bool whether to keep a copy of the figures in the cache folder
+    """
+    def __init__(self, name, version='', maxItems=None, maxBytes=None, onDisk=None):
+        self.version = version
+        self.memory = LRUCache(settings.FIGURE_CACHE_SIZE if maxItems is None else maxItems, maxBytes)
+        if onDisk is None:
+            onDisk = settings.FIGURE_CACHE_ON_DISK and settings.USE_DATA_CACHE
+        self.disk = makeSharedCache(name, maxBytes) if onDisk else None
+
+    def _key(self, key):
+        return json.dumps([self.version, key])
+
+    def getJson(self, key):
+        """
+        Returns the serialized figure stored under key, or None
+        """
+        key = self._key(key)
+        payload = self.memory.get(key)
+        if payload is None and self.disk is not None:
+            payload = self.disk.get(key)
+            if payload is not None:
+                self.memory.set(key, payload)
+        return payload
+
+    def setJson(self, key, payload):
+        key = self._key(key)
+        self.memory.set(key, payload)
+        if self.disk is not None:
+            self.disk.set(key, payload)
+
+    def getOrBuild(self, key, builder, *args, **kwargs):
+        """
+        Returns the figure stored under key, building it with builder(*args, **kwargs)
+        and storing it in the cache if it's not there yet.
+        key must be json-serializable.
+        """
+        payload = self.getJson(key)
+        if payload is None:
+            payload = to_json_plotly(builder(*args, **kwargs))
+            self.setJson(key, payload)
+        return json.loads(payload)
+
+    def warm(self, keys, builder):
+        """
+        Builds and stores the figures for all the keys that are not cached yet.
+        builder is called as builder(*key)
+        """
+        for key in keys:
+            if self.getJson(key) is None:
+                self.setJson(key, to_json_plotly(builder(*key)))
@@ -1,11 +1,13 @@
 # from matplotlib.pyplot import axis
-import plotly.express as px
+from dash import Patch
 import plotly.graph_objects as go
 import numpy as np
-import matplotlib as mpl
-import matplotlib.cm as cm
 import pandas as pd
-import os
+import math
+import functools
+
+from . import colormaps
+from . import sliceGeometry as sg
 
 def id_factory(page: str):
     def func(_id: str):
@@ -104,11 +106,13 @@ def loadStructuresDf(structuresPath):
 
     return structuresDf
 
-def mergeCoordinatesAndData(coordDf, dataDf):
-    aggrData = dataDf.aggregate(func=['mean','sem'], axis=1)
-    mergedDf = coordDf.merge(aggrData,how='left',left_on='regionID',right_on='mid')
-
-    return mergedDf
+def midRegionStats(aggrMidDf, metric):
+    """
+    Precomputed mean, SEM, n and std across animals of each mid-ontology region
+    for a metric, indexed by region ID (see dataManager.aggregateMetrics())
+    """
+    stats = aggrMidDf.xs(metric, axis=1, level='params')
+    return stats.set_axis(stats.index.get_level_values('mid'), axis=0)
 
 def calculateGraphHeight(numRows):
     """
@@ -162,30 +166,6 @@ def getClimsAnatomicalExplorer(selMetric, staining='wfa'):
 
     return min,max
 
-def loadAllSlices(folderPath:str):
-    """
-    loadAllSlices(folderPath)
-
-    Loads all the json files in a folder in a list of pandas dataframes and 
-    returns the list
-    """
-    fileNames = sorted(os.listdir(folderPath))
-    dfList = []
-    for fileName in fileNames:
-        df = pd.read_json(os.path.join(folderPath,fileName))
-        dfList.append(df)
-    return dfList
-
-def selectData(dataWfa, dataPv, selStaining, selMetric, resolution):
-
-    if selStaining=='wfa':
-        output = dataWfa[resolution].xs(selMetric, axis=1, level='params')
-        return output
-    elif selStaining=='pv':
-        output = dataPv[resolution].xs(selMetric, axis=1, level='params')
-        return output
-    return []
-
 
 # ------------------------------------------------------------------------------
 # Page-Specific Functions
@@ -239,151 +219,344 @@ def makeAnatExplorerScatter():
 
     return fig
 
-def redrawAnatExplorerScatter(fig, dataFrame, cmap, vmin, vmax):
-    """
-    Updates the data of the figure fig.
+# Version of the figures made by redrawAnatExplorerScatter(). Bump it whenever
+# they change, so that figures cached on disk are rendered again
+ANAT_EXPLORER_VERSION = 7
+
+# Number of colors in the lookup table of each colormap
+COLORMAP_LUT_SIZE = 256
+_colormapLuts = {}
 
-    This function is used to update the Anatomical Explorer
+def getColormapLut(cmap):
     """
-    
-    # Add the color column to the dataframe based on the colormap and vmin vmax
-    norm = mpl.colors.Normalize(vmin=vmin, vmax=vmax, clip=True)
-    mapper = cm.ScalarMappable(norm=norm, cmap=cmap)
-    rgb = mapper.to_rgba(dataFrame['mean'])
-    rgb[rgb == 1] = 0.999
-    rgb = [f'rgb({x[0]},{x[1]},{x[2]})' for x in rgb]
-    dataFrame['color'] = rgb
-
-    # Empty List that will contain all the go.Scatter traces for the brain regions
-    newData = []
+    Lookup table of the COLORMAP_LUT_SIZE colors of the colormap cmap (see
+    colormaps.py), with the color strings built only the first time each
+    colormap is requested.
+
+    RETURNS
+    ********************
+    lut:dict
+        rgb:        np.ndarray uint8 (N, 3) color components 0-255
+        colors:     np.ndarray (N) the same colors as plotly 'rgb(r,g,b)' strings
+        colorscale: list [[position, color], ...] plotly colorscale with each
+                    color at the center of its bin (see colormapIndex()), so that
+                    the colorbar shows the same colors as the regions
+    """
+    if cmap not in _colormapLuts:
+        rgb = colormaps.getColormap(cmap)
+        colors = np.array([f'rgb({r},{g},{b})' for r, g, b in rgb])
+        N = len(colors)
+        # Hex colors and rounded positions keep the colorscale short in the patches
+        hexColors = [f'#{r:02x}{g:02x}{b:02x}' for r, g, b in rgb]
+        colorscale = ([[0, hexColors[0]]]
+            + [[round((i + 0.5) / N, 5), c] for i, c in enumerate(hexColors)]
+            + [[1, hexColors[-1]]])
+        _colormapLuts[cmap] = dict(rgb=rgb, colors=colors, colorscale=colorscale)
+    return _colormapLuts[cmap]
+
+def colormapIndex(values, vmin, vmax, N=COLORMAP_LUT_SIZE):
+    """
+    Index in a colormap lookup table of each value: values are clipped to
+    [vmin, vmax] and binned in N equal bins. NaN values get index 0.
+    """
+    norm = (np.asarray(values, dtype=float) - vmin) / (vmax - vmin)
+    norm = np.nan_to_num(norm, nan=0.0)
+    return np.clip((norm * N).astype(np.int64), 0, N - 1)
 
-    # Draw a shape for each area in the dataframe
-    for _, area in dataFrame.iterrows():
+def anatExplorerRegionStyles(sliceView, regions, aggrDf, cmap, vmin, vmax):
+    """
+    Computes colors and hover strings of all the brain regions in a slice at once.
+
+    Regions are returned in the order in which they are drawn by
+    redrawAnatExplorerScatter(): root first, then all the others in the order they
+    appear in the slice. Regions without data (NaN mean) are not visible.
+
+    RETURNS
+    ********************
+    styles:dict
+        regionIDs:      (nRegions) region IDs in drawing order
+        polyRegionIdx:  (nPolygons) position in regionIDs of the region of each polygon
+        acronyms:       list of acronyms
+        fillcolors:     list of plotly color strings
+        texts:          list of hover strings
+        visible:        list of bools
+    """
+    polyRegionID = sliceView['polyRegionID']
+
+    # Unique regions in the order they appear in the slice
+    uniqIDs, firstIdx, polyRegionIdx = np.unique(polyRegionID, return_index=True, return_inverse=True)
+    acronyms = np.array([regions[str(x)][0] for x in uniqIDs])
+    # Draw root first (below all the other areas)
+    order = np.lexsort((firstIdx, acronyms != 'root'))
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    uniqIDs = uniqIDs[order]
+    acronyms = acronyms[order].tolist()
+    names = [regions[str(x)][1] for x in uniqIDs]
+    isRoot = [x == 'root' for x in acronyms]
+
+    # Statistics, colors and hover strings of all the regions
+    stats = aggrDf.reindex(uniqIDs)
+    means = stats['mean'].to_numpy(dtype=float)
+    sems = stats['sem'].to_numpy(dtype=float)
+
+    colors = getColormapLut(cmap)['colors'][colormapIndex(means, vmin, vmax)]
+    hoverStrings = [f"<b>{a}</b><br><i>{n}</i><br>Mean: {m:.3f}<br>SEM: {s:.3f}"
+        for a, n, m, s in zip(acronyms, names, means, sems)]
+
+    styles = dict(
+        regionIDs=uniqIDs,
+        polyRegionIdx=rank[polyRegionIdx.ravel()],
+        acronyms=acronyms,
+        fillcolors=['rgb(0,0,0)' if r or np.isnan(m) else str(c) for r, m, c in zip(isRoot, means, colors)],
+        texts=['root' if r else h for r, h in zip(isRoot, hoverStrings)],
         # Do not draw Areas that have NaN as a mean value
-        if (np.isnan(area['mean'])) and (area['acronym']!='root'):
-            continue
+        visible=[bool(r or not np.isnan(m)) for r, m in zip(isRoot, means)],
+    )
+    return styles
 
-        # Create and format the hover string of this area
-        if area['acronym']!='root':
-            hoverString = ("<b>" + area['acronym'] + "</b>" + "<br>" + "<i>" + area['regionName'] + "</i>" + "<br>" +
-                f"Mean: {area['mean']:.3f}" + "<br>" + f"SEM: {area['sem']:.3f}"
-            )
-        else:
-            hoverString='root'
+def anatExplorerColorbar(cmap, vmin, vmax):
+    """
+    Invisible trace that only draws the colorbar of the anatomical explorer
+    """
+    colorbar_trace = dict(
+        type='scatter',
+        x=[None],
+        y=[None],
+        mode='markers',
+        marker=dict(
+            # plotly.js does not know most of the colormaps by name
+            colorscale=getColormapLut(cmap)['colorscale'],
+            showscale=True,
+            cmin=vmin,
+            cmax=vmax,
+            colorbar=dict(thickness=10, tickvals=[vmin, vmax], ticktext=[f'{vmin}', f'{vmax}'], outlinewidth=0, ypad=200)
+        ),
+        hoverinfo='none'
+    )
+    return colorbar_trace
 
-        # Create the go.Scatter trace
-        thisTrace = go.Scatter(
-            x=np.array(area['coord'])[:, 0],
-            y=np.array(area['coord'])[:, 1],
-            
+def redrawAnatExplorerScatter(fig, sliceView, regions, aggrDf, cmap, vmin, vmax):
+    """
+    Updates the data of the figure fig.
+
+    This function is used to update the Anatomical Explorer. All the polygons of
+    a brain region are drawn in a single trace (separated by NaNs) and colors and
+    hover texts are computed for all the regions of the slice at once.
+    There is always one trace for each region in the slice (plus the colorbar),
+    so that colors can later be changed with patchAnatExplorerScatter().
+
+    PARAMETERS
+    ********************
+    fig: the current figure (dict)
+    sliceView:dict polygons of the slice (see sliceGeometry.getSliceView)
+    regions:dict {regionID: [acronym, regionName]}
+    aggrDf:pd.DataFrame 'mean' and 'sem' of each region, indexed by region ID
+    cmap, vmin, vmax: colormap and its limits
+    """
+    vertices = sliceView['vertices']
+    offsets = sliceView['polyOffsets']
+    styles = anatExplorerRegionStyles(sliceView, regions, aggrDf, cmap, vmin, vmax)
+    polyRegionIdx = styles['polyRegionIdx']
+    nRegions = len(styles['regionIDs'])
+
+    # Gather the vertices of all the polygons grouped by region, adding a NaN
+    # after each polygon so that plotly draws them as separate shapes
+    polyOrder = np.argsort(polyRegionIdx, kind='stable')
+    segLen = np.diff(offsets)[polyOrder] + 1
+    segStart = np.cumsum(segLen) - segLen
+    src = np.repeat(offsets[:-1][polyOrder] - segStart, segLen) + np.arange(segLen.sum())
+    xy = vertices[np.minimum(src, len(vertices) - 1)].astype(float)
+    xy[segStart + segLen - 1] = np.nan
+    # Position of each region in xy
+    regionEnd = np.cumsum(np.bincount(polyRegionIdx[polyOrder], weights=segLen,
+        minlength=nRegions)).astype(int)
+    regionStart = np.concatenate(([0], regionEnd[:-1]))
+
+    # List that will contain all the scatter traces for the brain regions
+    newData = []
+    for i in range(nRegions):
+        regionXY = xy[regionStart[i]:regionEnd[i] - 1]
+        thisTrace = dict(
+            type='scatter',
+            x=regionXY[:, 0],
+            y=regionXY[:, 1],
             mode='lines',
-            line=dict(
-                width=1,
-                color='rgb(0,0,0)',
-            ),
-            fill="toself",
-            fillcolor= area['color'] if area['acronym']!='root' else 'rgb(0,0,0)',
+            line=dict(width=1, color='rgb(0,0,0)'),
+            fill='toself',
+            fillcolor=styles['fillcolors'][i],
             # Customize the hover labels
             hoverlabel=dict(
                 namelength=0,
                 bgcolor='rgb(255,255,255)',
                 font=dict(color='black')),
-            text=hoverString,
-            # Name of this specific Scatter Trace
-            name=area['acronym'],
-            opacity=0.3 if area['acronym'] == "root" else None,
+            text=styles['texts'][i],
+            # Name of this specific trace
+            name=styles['acronyms'][i],
+            visible=styles['visible'][i],
         )
-        # Add this trace to the list
+        if styles['acronyms'][i] == 'root':
+            thisTrace['opacity'] = 0.3
         newData.append(thisTrace)
 
-    # Reorder data so that root is first (drawn below all the other areas)
-    idx = []
-    for i,scatter  in enumerate(newData):
-        if 'root' in scatter['name']:
-            idx.append(i)   
-    [newData.insert(0,newData.pop(x)) for x in idx]
-    fig['data'] = newData
+    # Add the colorbar
+    newData.append(anatExplorerColorbar(cmap, vmin, vmax))
 
-    # Somehow here fig is just a dict and not a go.Figure object so here we reinitialize it 
-    # as an object
-    fig = go.Figure({'data':fig['data'], 'layout':fig['layout']})
+    return {'data': newData, 'layout': fig['layout']}
 
-    # Add the colorbar
-    colorbar_trace  = go.Scatter(
-        x=[None],
-        y=[None],
-        mode='markers',
-        marker=dict(
-            colorscale=cmap, 
-            showscale=True,
-            cmin=vmin,
-            cmax=vmax,
-            colorbar=dict(thickness=10, tickvals=[vmin, vmax], ticktext=[f'{vmin}', f'{vmax}'], outlinewidth=0, ypad=200)
-        ),
-        hoverinfo='none'
+def patchAnatExplorerScatter(sliceView, regions, aggrDf, cmap, vmin, vmax, metricChanged=True, cmapChanged=True):
+    """
+    Returns a dash Patch that updates a figure made by redrawAnatExplorerScatter()
+    for the same slice with only what changed, without sending the geometry of
+    the regions again to the browser:
+        - a new colormap changes the colors of the regions that have data and the
+          colorscale of the colorbar
+        - a new metric changes the colors, hover texts and visibility of all the
+          regions and the limits of the colorbar
+    """
+    styles = anatExplorerRegionStyles(sliceView, regions, aggrDf, cmap, vmin, vmax)
+    nRegions = len(styles['regionIDs'])
+
+    patched = Patch()
+    for i in range(nRegions):
+        # Root and regions without data are black whatever the colormap
+        if metricChanged or styles['fillcolors'][i] != 'rgb(0,0,0)':
+            patched['data'][i]['fillcolor'] = styles['fillcolors'][i]
+        if metricChanged:
+            patched['data'][i]['text'] = styles['texts'][i]
+            patched['data'][i]['visible'] = styles['visible'][i]
+
+    colorbar = anatExplorerColorbar(cmap, vmin, vmax)['marker']
+    if cmapChanged:
+        patched['data'][nRegions]['marker']['colorscale'] = colorbar['colorscale']
+    if metricChanged:
+        for key in ('cmin', 'cmax'):
+            patched['data'][nRegions]['marker'][key] = colorbar[key]
+        for key in ('tickvals', 'ticktext'):
+            patched['data'][nRegions]['marker']['colorbar'][key] = colorbar['colorbar'][key]
+    return patched
+
+def makeAnatExplorerStoreData(aggrMidDf, sliceGeometry, staining, layout, cmaps):
+    """
+    Collects everything that the browser needs to draw the anatomical explorer
+    by itself (see assets/anatomicalExplorer.js) in a json-serializable dict:
+    the packed geometry of all the slices, mean and sem of each region for all the
+    metrics, colormap limits, colormap lookup tables and colorscales and the
+    figure layout.
+    Each slice is shipped at the level of detail that fits the figure height.
+    """
+    vertices, polyOffsets = [], [0]
+    for sliceIdx in range(sg.numSlices(sliceGeometry)):
+        lod = sg.chooseLodLevel(sliceGeometry, sliceIdx, layout.get('height'))
+        sliceView = sg.getSliceView(sliceGeometry, sliceIdx, lod)
+        vertices.append(sliceView['vertices'])
+        polyOffsets.extend(sliceView['polyOffsets'][1:] + polyOffsets[-1])
+    geometry = dict(
+        # Flat list of x,y coordinates. Decimals of micrometers are not visible
+        vertices=np.round(np.concatenate(vertices).astype(float), 1).ravel().tolist(),
+        polyOffsets=[int(x) for x in polyOffsets],
+        polyRegionID=sliceGeometry['polyRegionID'].tolist(),
+        sliceOffsets=sliceGeometry['sliceOffsets'].tolist(),
+        regions=sliceGeometry['regions'],
     )
-    fig.add_trace(colorbar_trace)
 
-    return fig
+    metrics = {}
+    clims = {}
+    for metric in aggrMidDf.columns.unique(level='params'):
+        aggrDf = midRegionStats(aggrMidDf, metric)
+        metrics[metric] = {str(regionID): [None if np.isnan(m) else float(m), None if np.isnan(s) else float(s)]
+            for regionID, m, s in zip(aggrDf.index, aggrDf['mean'], aggrDf['sem'])}
+        clims[metric] = getClimsAnatomicalExplorer(metric, staining=staining)
+
+    storeData = dict(
+        geometry=geometry,
+        metrics=metrics,
+        clims=clims,
+        colormaps={cmap: getColormapLut(cmap)['colors'].tolist() for cmap in cmaps},
+        colorscales={cmap: getColormapLut(cmap)['colorscale'] for cmap in cmaps},
+        layout=layout,
+    )
+    return storeData
+
+# Version of the figures and tables made by the histogram callbacks. Bump it
+# whenever they change, so that responses cached on disk are built again
+HISTOGRAM_VERSION = 3
+
+def canonicalHistogramSelection(selMetric, major_selection, addCoarse_selection, addMid_selection,
+        addFine_selection, sortRegions, regionIndex=None):
+    """
+    Normalizes the inputs of the histogram callbacks so that equivalent selections
+    share the same cache entry: empty selections become None and repeated regions
+    are removed. When regions are sorted by their mean the order in which they
+    were selected does not matter, so the selections are sorted as well.
+    With regionIndex (see dataManager.buildRegionIndex()) regions that are not
+    in the data are removed too, so made-up IDs can't fill the caches.
+
+    RETURNS
+    ********************
+    selection:tuple (selMetric, major, addCoarse, addMid, addFine, sortRegions)
+    """
+    sortRegions = bool(sortRegions)
+    def normalize(selection, resolution):
+        if not selection:
+            return None
+        selection = list(dict.fromkeys(int(x) for x in selection))
+        if regionIndex is not None:
+            selection = [x for x in selection if (resolution, x) in regionIndex['rows']]
+            if not selection:
+                return None
+        return sorted(selection) if sortRegions else selection
+
+    major = int(major_selection) if major_selection else None
+    if regionIndex is not None and major not in regionIndex['majorRows']:
+        major = None
+    return (selMetric, major, normalize(addCoarse_selection, 'coarse'), normalize(addMid_selection, 'mid'),
+        normalize(addFine_selection, 'fine'), sortRegions)
 
 def combineDiffuseDataframes(major_selection, addCoarse_selection, addMid_selection, addFine_selection,
-        coarseDf, midDf, fineDf):
+        regionIndex, metric):
     """
     combineDiffuseDataframes(major_selection, addCoarse_selection, addMid_selection, addFine_selection)
 
     Takes the user selection on the dropdown menus and returns a combined dataframe
-    with all the selected areas on each row.
+    with the statistics of all the selected areas on each row.
+    All the rows are read from the region index (see dataManager.buildRegionIndex())
+    with a single gather.
     """
-    emptyDf = emptyMetricsDf()
+    rows = regionIndex['rows']
+    selectedRows = []
 
-    # Dataframe with all the regions in the selected major subdivision
+    # All the regions in the selected major subdivision
     if major_selection:
-        d1 = midDf.loc[major_selection,:]
-    else:
-        d1 = emptyDf
+        for coarseID in np.atleast_1d(major_selection):
+            selectedRows.extend(regionIndex['majorRows'].get(int(coarseID), []))
 
-    # Df with the selected coarse regions
-    if addCoarse_selection: 
-        d2 = coarseDf.loc[addCoarse_selection]
-    else:
-        d2 = emptyDf
-
-    # Df with the selected mid regions
-    if addMid_selection:
-        idx = pd.IndexSlice
-        d3 = midDf.loc[idx[:,addMid_selection],:]
-        d3.index = d3.index.droplevel(level=0)
-    else:
-        d3 = emptyDf
-
-    # Df with the selected fine regions
-    if addFine_selection:
-        idx = pd.IndexSlice
-        d4 = fineDf.loc[idx[:,:,addFine_selection],:]
-        d4.index = d4.index.droplevel(level=[0,1])
-    else:
-        d4 = emptyDf
+    # The selected coarse, mid and fine regions
+    for resolution, selection in (('coarse', addCoarse_selection), ('mid', addMid_selection),
+            ('fine', addFine_selection)):
+        if selection:
+            selectedRows.extend(rows[(resolution, int(x))] for x in selection if (resolution, int(x)) in rows)
 
-    # Concatenate all the dataframes together
-    dfList = [d1,d2,d3,d4]
-    if all([x.empty for x in dfList]):
-        combinedDf = emptyDf
-    else:
-        combinedDf = pd.concat([x for x in dfList if not x.empty], axis=0)
+    if not selectedRows:
+        return emptyMetricsDf()
 
+    selectedRows = np.array(selectedRows, dtype=np.int64)
+    combinedDf = pd.DataFrame(regionIndex['stats'][metric][selectedRows],
+        index=regionIndex['regionID'][selectedRows],
+        columns=regionIndex['statNames'])
     return combinedDf
 
 def aggregateFluoDataframe(combinedDf, structuresDf):
     """
-    Takes a combined DataFrame of a multiple selection of regions and aggregate it
-    to calculate mean and SEM and add color, name and acronym information for all 
+    Takes a combined DataFrame with the precomputed statistics of a multiple
+    selection of regions and adds color, name and acronym information for all 
     the regions
     """
     if combinedDf.empty:
         return emptyMetricsDf()
 
-    # Aggregate data and calculate statistics and display options for all the areas 
-    aggrDf = combinedDf.aggregate(func=['mean','sem'], axis=1)
+    # Statistics and display options for all the areas 
+    aggrDf = combinedDf[['mean','sem']]
     # Merge combinedDf with some columns of the structures Df
     aggrDf = aggrDf.join(structuresDf.loc[:,['acronym','name','rgb_plotly']], how='inner')
     # Change column names
@@ -395,29 +568,87 @@ def aggregateFluoDataframe(combinedDf, structuresDf):
 
     return aggrDf
 
-def update_diffuseFluoHistogram(aggrDf, selMetric='diffuseFluo', staining='wfa'):
-
-    # Return an empty graph with a warning if no regions are selected
+def tablePage(aggrDf, pageCurrent, pageSize):
+    """
+    Rows of a single page of the tabular data, as records for a DataTable
+    with custom pagination. Numbers are sent with the precision of the data.
+
+    RETURNS
+    ********************
+    data:list list of {column: value} dicts for the rows in the page
+    pageCount:int total number of pages
+    pageCurrent:int index of the page, moved to the last one if out of range
+    """
     if aggrDf.empty:
-        return emptyGraph()
+        return [], 1, 0
+    pageCount = math.ceil(len(aggrDf) / pageSize)
+    pageCurrent = min(max(pageCurrent or 0, 0), pageCount - 1)
+    page = aggrDf.drop(columns=['color'], errors='ignore').iloc[pageCurrent * pageSize:(pageCurrent + 1) * pageSize]
+
+    columns = {}
+    for col in page.columns:
+        values = page[col].to_numpy()
+        if values.dtype.kind == 'f':
+            # str() of float32 values is the shortest string that reads back the same
+            columns[col] = [None if np.isnan(x) else float(str(x)) for x in values]
+        else:
+            columns[col] = [None if pd.isna(x) else x for x in values.tolist()]
+    data = [dict(zip(columns, row)) for row in zip(*columns.values())]
+    return data, pageCount, pageCurrent
 
-    # Assemble a dict that links regiona names to colors
-    colorDict = {k:v for (k,v) in zip(aggrDf['regionName'], aggrDf['color'])}
+@functools.lru_cache(maxsize=None)
+def templateLayout(name):
+    """
+    Layout of a plotly template as a plain dict, to be used in figure dicts
+    (plotly.js does not know templates by name)
+    """
+    import plotly.io as pio
+    return pio.templates[name].to_plotly_json()
 
-    # Create the barplot
-    fig = px.bar(data_frame=aggrDf, x='mean', y='regionName',
-        color='regionName',
-        error_x='sem',
-        template='plotly_white',
-        color_discrete_map=colorDict,
+def barHistogramFigure(aggrDf, xTitle):
+    """
+    Horizontal bar chart of the mean and SEM of each region, with the first
+    region on top. All the bars are in a single trace with a color for each bar,
+    and the figure is built directly as a dict, skipping the validation of
+    plotly express and graph_objects.
+
+    PARAMETERS
+    ********************
+    aggrDf:pd.DataFrame with columns 'regionName', 'mean', 'sem' and 'color'
+    xTitle:str title of the x axis
+    """
+    names = aggrDf['regionName'].tolist()
+    sem = aggrDf['sem'].to_numpy()
+    trace = dict(
+        type='bar',
         orientation='h',
-
+        x=aggrDf['mean'].to_numpy(),
+        y=names,
+        error_x=dict(array=sem),
+        marker=dict(color=aggrDf['color'].tolist()),
         # Customization of the Hovers
-        hover_name='regionName',
-        hover_data={'regionName':False,
-            'mean':':.3f',
-            'sem':':.3f'},
-        )
+        customdata=sem,
+        hovertext=names,
+        hovertemplate='<b>%{hovertext}</b><br><br>mean=%{x:.3f}<br>sem=%{customdata:.3f}<extra></extra>',
+    )
+    layout = dict(
+        template=templateLayout('plotly_white'),
+        font=dict(family='arial'),
+        xaxis=dict(title=dict(text=xTitle, font=dict(size=16))),
+        yaxis=dict(title=dict(text=''), categoryorder='array',
+            categoryarray=list(dict.fromkeys(names))[::-1]),
+        barmode='relative',
+        margin=dict(t=60),
+        showlegend=False,
+        height=calculateGraphHeight(aggrDf.shape[0]),
+    )
+    return {'data': [trace], 'layout': layout}
+
+def update_diffuseFluoHistogram(aggrDf, selMetric='diffuseFluo', staining='wfa'):
+
+    # Return an empty graph with a warning if no regions are selected
+    if aggrDf.empty:
+        return emptyGraph()
 
     # Determine the label for the x axis based on the staining and metric selected
     if staining == 'wfa':
@@ -435,40 +666,54 @@ def update_diffuseFluoHistogram(aggrDf, selMetric='diffuseFluo', staining='wfa')
             'density': 'PV Density (cells/mm^2)'
         }
 
-    fig.update_layout(
-        font_family="arial",
-        xaxis_title=switchName[selMetric],
-        yaxis_title="",
-        showlegend=False,
-        height= calculateGraphHeight(aggrDf.shape[0]),
-        )
-
-    fig.update_xaxes(
-        title_font = {"size":16}
-    )
-    return fig
+    return barHistogramFigure(aggrDf, switchName[selMetric])
 
 
 
 # Interactions
 # ------------------------------------------------------------------------------
-def intScattAggregateData(structuresDf, xData, yData, zScore):
-    
-    xData = xData.aggregate(func=['mean'], axis=1)
-    yData = yData.aggregate(func=['mean'], axis=1)
-    structuresDf = structuresDf[['name','acronym','rgb_plotly']]
-
-    merged = xData.join(yData, how='inner', lsuffix='_x', rsuffix='_y')
-    merged = merged.join(structuresDf, on='mid', how='left')
-    merged = merged.drop(1009, level='mid')
-
-    # Z-score
-    if zScore:
-        means = merged[['mean_x','mean_y']]
-        means = (means - means.mean()).divide(means.std())
-        merged[['mean_x','mean_y']] = means        
+def intScattAggregateData(interactionMatrix, xStaining, xMetric, yStaining, yMetric, zScore):
+    """
+    Picks the two columns of the precomputed interaction matrix (see
+    dataManager.buildInteractionMatrix()) that are shown in the scatter plot
+
+    RETURNS
+    ********************
+    merged:pd.DataFrame indexed by (coarse, mid) with columns 'mean_x', 'mean_y',
+        'name', 'acronym' and 'rgb_plotly'
+    correlation:dict Pearson and Spearman r and number of regions of the pair
+    """
+    x = interactionMatrix['columns'][(xStaining, xMetric)]
+    y = interactionMatrix['columns'][(yStaining, yMetric)]
+    values = interactionMatrix['zScore' if zScore else 'mean']
+
+    merged = interactionMatrix['regions'].assign(mean_x=values[:, x], mean_y=values[:, y])
+    correlation = dict(
+        pearson=interactionMatrix['pearson'][x, y],
+        spearman=interactionMatrix['spearman'][x, y],
+        n=interactionMatrix['n'][x, y],
+    )
+    return merged, correlation
 
-    return merged
+def correlationAnnotation(correlation):
+    """
+    Annotation in the top left corner of a figure with the correlation
+    coefficients returned by intScattAggregateData()
+    """
+    fmt = lambda r: 'n/a' if np.isnan(r) else f"{r:.2f}"
+    text = (f"Pearson r = {fmt(correlation['pearson'])}<br>"
+        f"Spearman ρ = {fmt(correlation['spearman'])}<br>"
+        f"n = {correlation['n']}")
+    return dict(
+        text=text,
+        xref='paper', yref='paper',
+        x=0.01, y=0.99,
+        xanchor='left', yanchor='top',
+        align='left',
+        showarrow=False,
+        font=dict(size=12),
+        bgcolor='rgba(255,255,255,0.8)',
+    )
 
 def makeInteractionScatter():
     """
@@ -504,51 +749,77 @@ def makeInteractionScatter():
 
     return fig
 
-def update_IntScatter(fig, aggrDf, structDf, xStaining, xMetric, yStaining, yMetric, zScore):
-
-    # Convert back the figure in a go object
-    fig = go.Figure(fig)
-    # remove all present data
-    fig.data = []
-
-    # Draw a Scatter trace for each area in the dataFrame
-    for coarse, new_df in aggrDf.groupby(level='coarse'):
-        thisTrace = go.Scatter(
-            x = new_df['mean_x'], y = new_df['mean_y'],
-            name = structDf.loc[coarse]['name'],
-            marker_color = new_df['rgb_plotly'],
+def coarseGroupedScatterTraces(df, xCol, yCol, structDf, hoverX, hoverY):
+    """
+    Scatter traces of mid-ontology regions, one for each coarse region so that
+    they can be toggled from the legend, sorted alphabetically by coarse region
+    name. Traces are built as plain dicts by slicing the columns of df once
+    sorted by coarse region, without grouping the DataFrame.
+
+    PARAMETERS
+    ********************
+    df:pd.DataFrame indexed by ('coarse','mid') with columns xCol, yCol, 'name',
+        'acronym' and 'rgb_plotly'
+    structDf:pd.DataFrame structures, to get the names of the coarse regions
+    hoverX, hoverY:str labels of the x and y values in the hover text
+    """
+    coarse = df.index.get_level_values('coarse').to_numpy()
+    order = np.argsort(coarse, kind='stable')
+    coarseIDs, starts = np.unique(coarse[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+    groupNames = structDf['name'].reindex(coarseIDs).to_numpy()
+
+    x = df[xCol].to_numpy()[order]
+    y = df[yCol].to_numpy()[order]
+    colors = df['rgb_plotly'].to_numpy()[order]
+    customdata = np.stack((df['name'].to_numpy(), df['acronym'].to_numpy()), axis=-1)[order]
+
+    traces = []
+    for g in sorted(range(len(coarseIDs)), key=lambda g: groupNames[g]):
+        a, b = starts[g], ends[g]
+        traces.append(dict(
+            type='scatter',
+            x=x[a:b],
+            y=y[a:b],
+            name=groupNames[g],
+            legendgroup=str(coarseIDs[g]),
             mode='markers',
-            marker = dict(
+            marker=dict(
+                color=colors[a:b],
                 size=13,
-                line_width=1,
+                line=dict(width=1),
                 opacity=0.85,
             ),
-            customdata  = np.stack((new_df['name'], new_df['acronym']), axis=-1),
+            customdata=customdata[a:b],
             hovertemplate= "<b>%{customdata[1]}</b>" + "<br>" +
-                "<i>%{customdata[0]}</i>" + "<br>" + 
-                f"{structDf.loc[coarse]['name']}" + "<br>" +
-                f"<b>{xStaining}-{xMetric}</b>:" "%{x:.3f}" + "<br>" + 
-                f"<b>{yStaining}-{yMetric}</b>:" + "%{y:.3f}" +
+                "<i>%{customdata[0]}</i>" + "<br>" +
+                f"{groupNames[g]}" + "<br>" +
+                f"<b>{hoverX}</b>:" "%{x:.3f}" + "<br>" +
+                f"<b>{hoverY}</b>:" + "%{y:.3f}" +
                 "<extra></extra>",
-            
-        )
-        fig.add_trace(thisTrace)
+        ))
+    return traces
 
-    # Sort traces alphabetically
-    fig.data = sorted(fig.data, key=lambda d: d['name']) 
+def update_IntScatter(fig, aggrDf, structDf, xStaining, xMetric, yStaining, yMetric, zScore, correlation=None):
+    """
+    Draws the data of the interactions scatter on the layout of fig, the figure
+    made by makeInteractionScatter() (as a dict), with the correlation
+    coefficients of the two metrics if given
+    """
+    traces = coarseGroupedScatterTraces(aggrDf, 'mean_x', 'mean_y', structDf,
+        f"{xStaining}-{xMetric}", f"{yStaining}-{yMetric}")
 
     xLabel = f"{xStaining.upper()} - {xMetric}"
     yLabel = f"{yStaining.upper()} - {yMetric}"
     if zScore:
         xLabel = xLabel + " - (Z-Score)"
         yLabel = yLabel + " - (Z-Score)"
-    fig.update_xaxes(
-        title=xLabel
-    )
-    fig.update_yaxes(
-        title=yLabel
-    )
-    return fig
+    layout = dict(fig['layout'])
+    layout['xaxis'] = dict(layout.get('xaxis', {}), title=dict(text=xLabel))
+    layout['yaxis'] = dict(layout.get('yaxis', {}), title=dict(text=yLabel))
+    if correlation is not None:
+        layout['annotations'] = [correlationAnnotation(correlation)]
+    return {'data': traces, 'layout': layout}
 
 def update_colocHistogram(aggrDf, selMetric):
 
@@ -556,41 +827,12 @@ def update_colocHistogram(aggrDf, selMetric):
     if aggrDf.empty:
         return emptyGraph()
 
-    # Assemble a dict that links regiona names to colors
-    colorDict = {k:v for (k,v) in zip(aggrDf['regionName'], aggrDf['color'])}
-
-    # Create the barplot
-    fig = px.bar(data_frame=aggrDf, x='mean', y='regionName',
-        color='regionName',
-        error_x='sem',
-        template='plotly_white',
-        color_discrete_map=colorDict,
-        orientation='h',
-
-        # Customization of the Hovers
-        hover_name='regionName',
-        hover_data={'regionName':False,
-            'mean':':.3f',
-            'sem':':.3f'},
-        )
-
     # Determine the label for the x axis based on the staining and metric selected
     switchName = {
         'pvPositive_pnn': 'Percentage of PNNs around a PV cell',
         'wfaPositive_pv': 'Percentage of PV cells surrounded by a PNN',
     }
-    fig.update_layout(
-        font_family="arial",
-        xaxis_title=switchName[selMetric],
-        yaxis_title="",
-        showlegend=False,
-        height= calculateGraphHeight(aggrDf.shape[0]),
-        )
-
-    fig.update_xaxes(
-        title_font = {"size":16}
-    )
-    return fig
+    return barHistogramFigure(aggrDf, switchName[selMetric])
 
 
 # Genes
@@ -606,17 +848,18 @@ def getMetricDf(selMetric, wfa, pv):
     else:
         return []
 
-def combineGenesDf(selGene, selMetric, ishData, structuresDf):
-
+def combineGenesDf(selGene, selMetric, ishStore, structuresDf):
+    """
+    Staining metric and expression energy of selGene in each mid-ontology
+    region. ishStore is the GeneExpressionStore from dataRegistry.getIshEnergy()
+    """
     # Prepare the Df with staining metric data
     metricDf = pd.DataFrame(selMetric)
     metricDf.columns=['metric']
     metric = metricDf.reset_index()
 
-    # Prepare the Df with gene expression data
-    ishData.index.name = 'mid'
-    ish = pd.DataFrame(ishData.loc[selGene])
-    ish.columns = ['geneExp']
+    # Expression of the gene in each region, read from the store without copies
+    ish = ishStore.geneSeries(selGene, name='geneExp')
 
     # Merge the 2 dataframes
     merged = metric.join(ish, on='mid')
@@ -631,40 +874,14 @@ def combineGenesDf(selGene, selMetric, ishData, structuresDf):
     return merged
 
 def update_GenesScatter(fig, combinedDfCorrDf, structureDf, geneName):
-    # Convert back the figure in a go object
-    fig = go.Figure(fig)
-    # remove all present data
-    fig.data = []
-
-    # Draw a Scatter trace for each area in the dataFrame
-    for coarse, new_df in combinedDfCorrDf.groupby(level='coarse'):
-        thisTrace = go.Scatter(
-            x = new_df['geneExp'], y = new_df['metric'],
-            name = structureDf.loc[coarse]['name'],
-            marker_color = new_df['rgb_plotly'],
-            mode='markers',
-            marker = dict(
-                size=13,
-                line_width=1,
-                opacity=0.85,
-            ),
-            customdata  = np.stack((new_df['name'], new_df['acronym']), axis=-1),
-            hovertemplate= "<b>%{customdata[1]}</b>" + "<br>" +
-                "<i>%{customdata[0]}</i>" + "<br>" + 
-                f"{structureDf.loc[coarse]['name']}" + "<br>" +
-                f"<b>Staining Metric</b>:" "%{x:.3f}" + "<br>" + 
-                f"<b>Gene Expression</b>:" + "%{y:.3f}" +
-                "<extra></extra>",
-            
-        )
-        fig.add_trace(thisTrace)
-
-    # Sort traces alphabetically
-    fig.data = sorted(fig.data, key=lambda d: d['name']) 
-
-    fig.update_layout(title=geneName)
-
-    return fig
+    """
+    Draws the data of the genes scatter on the layout of fig, the figure made by
+    make_GeneScatter() (as a dict)
+    """
+    traces = coarseGroupedScatterTraces(combinedDfCorrDf, 'geneExp', 'metric', structureDf,
+        'Gene Expression', 'Staining Metric')
+    layout = dict(fig['layout'], title=dict(text=geneName))
+    return {'data': traces, 'layout': layout}
 
 def make_GeneScatter():
     fig = go.Figure()
@@ -696,20 +913,20 @@ def make_GeneScatter():
     )
     return fig
 
-def getGeneInfoTable(selMetric, selGene, geneDict):
+# Table of the supplementary data (SD4) with the gene info of each metric
+GENE_INFO_TABLES = {'wfa_energy':'wfa_en', 'wfa_diffuseFluo':'wfa_diff', 'pv_energy':'pv_en'}
 
-    if selMetric=='wfa_energy':
-        data = geneDict['wfa_en']
-    elif selMetric=='wfa_diffuseFluo':
-        data = geneDict['wfa_diff']
-    elif selMetric=='pv_energy':
-        data = geneDict['pv_en']    
-    else:
-        return []
-
-    data = data.loc[data['gene_AGEA_id']==selGene]
-    geneName = data.iloc[0]['gene_name']
-    data = data.T.reset_index()
-    data.columns = ['Parameter', 'Value']
+def getGeneInfoTable(selMetric, selGene, geneInfo):
+    """
+    Info of a gene for the selected metric, looked up in the records returned
+    by dataRegistry.getGeneInfoRecords()
 
-    return data, geneName
+    RETURNS
+    ********************
+    record:dict {parameter: value}, empty for unknown genes or metrics
+    geneName:str name of the gene, None if unknown
+    """
+    record = geneInfo.get(GENE_INFO_TABLES.get(selMetric), {}).get(selGene)
+    if record is None:
+        return {}, None
+    return record, record['gene_name']
@@ -0,0 +1,257 @@
+"""
+Colormaps of the atlas baked in as lookup tables, so that coloring the brain
+regions needs neither matplotlib nor any computation at startup.
+
+Each table holds the 256 colors of the matplotlib colormap with the same name,
+as hex strings. To add a colormap, print its table with:
+    python -m pnnatlas.utils.colormaps <name>
+"""
+import numpy as np
+
+
+_HEX_TABLES = {
+    'PuBu': (
+        'fff7fbfef6fbfef6fafdf5fafdf5fafcf4fafbf4f9fbf3f9'
+        'faf3f9faf2f8f9f2f8f8f1f8f8f1f8f7f0f7f7f0f7f6eff7'
+        'f5eff6f5eef6f4eef6f4edf6f3edf5f2ecf5f2ecf5f1ebf5'
+        'f1ebf4f0eaf4f0eaf4efe9f3eee9f3eee8f3ede8f3ede7f2'
+        'ece7f2ebe6f2eae6f1e9e5f1e8e4f0e7e3f0e7e3f0e6e2ef'
+        'e5e1efe4e1efe3e0eee2dfeee1dfede0deede0ddeddfddec'
+        'dedcecdddbecdcdaebdbdaebdad9ead9d8ead9d8ead8d7e9'
+        'd7d6e9d6d6e9d5d5e8d4d4e8d3d4e7d2d3e7d2d2e7d1d2e6'
+        'd0d1e6ced0e6cdd0e5cccfe5cacee5c9cee4c8cde4c6cce3'
+        'c5cce3c4cbe3c2cbe2c1cae2c0c9e2bfc9e1bdc8e1bcc7e1'
+        'bbc7e0b9c6e0b8c6e0b7c5dfb5c4dfb4c4dfb3c3deb1c2de'
+        'b0c2deafc1ddadc1ddacc0ddabbfdca9bfdca8bedca7bddb'
+        'a5bddba4bcdaa2bcdaa1bbda9fbad99ebad99cb9d99ab8d8'
+        '99b8d897b7d796b6d794b6d793b5d691b5d68fb4d68eb3d5'
+        '8cb3d58bb2d489b1d488b1d486b0d384b0d383afd381aed2'
+        '80aed27eadd17dacd17bacd179abd078abd076aad075a9cf'
+        '73a9cf71a8ce6fa7ce6da6cd6ba5cd69a5cc67a4cc65a3cb'
+        '63a2cb62a2cb60a1ca5ea0ca5c9fc95a9ec9589ec8569dc8'
+        '549cc7529bc7509ac64e9ac64c99c54a98c54897c44697c4'
+        '4496c34295c34094c33f93c23d93c23b92c13991c13790c0'
+        '358fc0348ebf328dbf308cbe2f8bbe2d8abd2c89bd2a88bc'
+        '2987bc2786bb2685bb2484ba2383ba2182b92081b91e80b8'
+        '1c7fb81b7eb7197db7187cb6167bb6157ab51379b51278b4'
+        '1077b40f76b30d75b30c74b20a73b20872b10771b10570b0'
+        '056faf056fae056ead056dac056dab056caa056ba9056ba7'
+        '056aa60569a50569a40568a30567a20567a10566a005659f'
+        '04649e04649d04639b04629a046299046198046097046096'
+        '045f95045e94045e93045d92045c90045b8f045b8e045a8d'
+        '04598c04588a045788045687045585045483045382045280'
+        '03517e034f7d034e7b034d79034c78034b76034a74034973'
+        '03487103476f03466e03456c03446a034369034267034165'
+        '023f64023e62023d60023c5f023b5d023a5b02395a023858'
+    ),
+    'Reds': (
+        'fff5f0fff4effff4eefff3edfff2ecfff2ebfff1eafff0e9'
+        'fff0e8ffefe8ffeee7ffeee6ffede5ffece4ffece3ffebe2'
+        'feeae1feeae0fee9dffee8defee8ddfee7dcfee7dbfee6da'
+        'fee5d9fee5d8fee4d8fee3d7fee3d6fee2d5fee1d4fee1d3'
+        'fee0d2fedfd0fedecffedccdfedbccfedacafed9c9fed8c7'
+        'fdd7c6fdd5c4fdd4c2fdd3c1fdd2bffdd1befdd0bcfdcebb'
+        'fdcdb9fdccb8fdcbb6fdcab5fdc9b3fdc7b2fdc6b0fdc5ae'
+        'fcc4adfcc3abfcc2aafcc1a8fcbfa7fcbea5fcbda4fcbca2'
+        'fcbba1fcb99ffcb89efcb79cfcb69bfcb499fcb398fcb296'
+        'fcb095fcaf93fcae92fcad90fcab8ffcaa8dfca98cfca78b'
+        'fca689fca588fca486fca285fca183fca082fc9e80fc9d7f'
+        'fc9c7dfc9b7cfc997afc9879fc9777fc9576fc9474fc9373'
+        'fc9272fc9070fc8f6ffc8e6efc8d6dfc8b6bfc8a6afc8969'
+        'fc8767fc8666fc8565fc8464fc8262fc8161fc8060fc7f5f'
+        'fb7d5dfb7c5cfb7b5bfb7a5afb7858fb7757fb7656fb7555'
+        'fb7353fb7252fb7151fb7050fb6e4efb6d4dfb6c4cfb6b4b'
+        'fb694afa6849fa6648fa6547f96346f96245f96044f85f43'
+        'f85d42f75c41f75b40f7593ff6583ef6563df6553cf5533b'
+        'f5523af4503af44f39f44d38f34c37f34a36f34935f24734'
+        'f24633f14432f14331f14130f0402ff03f2ef03d2def3c2c'
+        'ee3a2ced392bec382beb372aea362ae93529e83429e63328'
+        'e53228e43027e32f27e22e27e12d26e02c26de2b25dd2a25'
+        'dc2924db2824da2723d92523d82422d72322d52221d42121'
+        'd32020d21f20d11e1fd01d1fcf1c1fce1a1ecc191ecb181d'
+        'ca181dc9181dc8171cc7171cc5171cc4161cc3161bc2161b'
+        'c1161bbf151bbe151abd151abc141abb141ab91419b81419'
+        'b71319b61319b51318b31218b21218b11218b01217af1117'
+        'ad1117ac1117ab1016aa1016a91016a81016a60f15a50f15'
+        'a30f15a10e159f0e149d0d149c0d149a0c14980c13960b13'
+        '940b13920a13900a128e09128c09128a0812880811860811'
+        '8407118207118006107e06107c05107a051079040f77040f'
+        '75030f73030f71020e6f020e6d010e6b010e69000d67000d'
+    ),
+    'Greens': (
+        'f7fcf5f6fcf4f6fcf4f5fbf3f5fbf2f4fbf2f4fbf1f3faf0'
+        'f2faf0f2faeff1faeef1faeef0f9edf0f9eceff9eceff9eb'
+        'eef8eaedf8eaedf8e9ecf8e8ecf8e8ebf7e7ebf7e7eaf7e6'
+        'e9f7e5e9f7e5e8f6e4e8f6e3e7f6e3e7f6e2e6f5e1e5f5e1'
+        'e5f5e0e4f5dfe3f4dee2f4dde1f3dce0f3dbdff3dadef2d9'
+        'ddf2d8dcf2d7dbf1d6dbf1d5daf0d4d9f0d3d8f0d2d7efd1'
+        'd6efd0d5efcfd4eeced3eecdd2edccd1edcbd0edcacfecc9'
+        'ceecc8cdecc7ccebc6cbebc5cbeac4caeac3c9eac2c8e9c1'
+        'c7e9c0c6e8bfc4e8bdc3e7bcc2e7bbc1e6bac0e6b9bee5b8'
+        'bde5b6bce4b5bbe4b4bae3b3b8e3b2b7e2b1b6e2afb5e1ae'
+        'b4e1adb2e0acb1e0abb0dfaaafdfa8aedea7acdea6abdda5'
+        'aadda4a9dca3a8dca2a7dba0a5db9fa4da9ea3da9da2d99c'
+        'a0d99b9fd8999ed7989cd7979bd69699d59598d59497d492'
+        '95d39194d39092d28f91d28e90d18d8ed08b8dd08a8bcf89'
+        '8ace8888ce8787cd8686cc8584cc8383cb8281ca8180ca80'
+        '7fc97f7dc87e7cc87c7ac77b79c67a78c67976c57875c477'
+        '73c47672c37570c2746ec1736dc0726bc0726abf7168be70'
+        '66bd6f65bd6f63bc6e62bb6d60ba6c5eb96b5db96b5bb86a'
+        '5ab76958b66856b56755b56753b46652b36550b2644eb264'
+        '4db1634bb0624aaf6148ae6046ae6045ad5f43ac5e42ab5d'
+        '40aa5d3fa95c3fa85b3ea75a3da65a3ca5593ba4583aa357'
+        '39a25738a15637a055369f54359e53349d53339c52329b51'
+        '319a503099502f984f2f974e2e964d2d954d2c944c2b934b'
+        '2a924a29914a289049278f48268e47258d47248c46238b45'
+        '228a442189442088431f87421e87411d86401c85401a843f'
+        '19833e18823d17813d16803c157f3b147e3a137d39127c39'
+        '117b38107a370e79360d78360c77350b77340a7633097532'
+        '08743207733106723005712f03702e026f2e016e2d006d2c'
+        '006c2c006b2b00692a00682a006729006529006428006328'
+        '006227006027005f26005e26005c25005b25005a24005924'
+        '005723005622005522005321005221005120005020004e1f'
+        '004d1f004c1e004a1e00491d00481d00471c00451c00441b'
+    ),
+    'Greys': (
+        'fffffffffffffefefefefefefdfdfdfdfdfdfcfcfcfcfcfc'
+        'fbfbfbfbfbfbfafafafafafaf9f9f9f9f9f9f8f8f8f8f8f8'
+        'f7f7f7f7f7f7f7f7f7f6f6f6f6f6f6f5f5f5f5f5f5f4f4f4'
+        'f4f4f4f3f3f3f3f3f3f2f2f2f2f2f2f1f1f1f1f1f1f0f0f0'
+        'f0f0f0efefefeeeeeeeeeeeeedededececececececebebeb'
+        'eaeaeae9e9e9e9e9e9e8e8e8e7e7e7e7e7e7e6e6e6e5e5e5'
+        'e4e4e4e4e4e4e3e3e3e2e2e2e1e1e1e1e1e1e0e0e0dfdfdf'
+        'dfdfdfdedededddddddcdcdcdcdcdcdbdbdbdadadadadada'
+        'd9d9d9d8d8d8d7d7d7d6d6d6d5d5d5d4d4d4d4d4d4d3d3d3'
+        'd2d2d2d1d1d1d0d0d0cfcfcfcecececdcdcdcccccccccccc'
+        'cbcbcbcacacac9c9c9c8c8c8c7c7c7c6c6c6c5c5c5c5c5c5'
+        'c4c4c4c3c3c3c2c2c2c1c1c1c0c0c0bfbfbfbebebebebebe'
+        'bdbdbdbbbbbbbababab9b9b9b8b8b8b6b6b6b5b5b5b4b4b4'
+        'b3b3b3b2b2b2b0b0b0afafafaeaeaeadadadabababaaaaaa'
+        'a9a9a9a8a8a8a7a7a7a5a5a5a4a4a4a3a3a3a2a2a2a0a0a0'
+        '9f9f9f9e9e9e9d9d9d9c9c9c9a9a9a999999989898979797'
+        '9595959494949393939292929191919090908f8f8f8e8e8e'
+        '8d8d8d8c8c8c8a8a8a898989888888878787868686858585'
+        '8484848383838282828181817f7f7f7e7e7e7d7d7d7c7c7c'
+        '7b7b7b7a7a7a797979787878777777767676757575737373'
+        '7272727171717070706f6f6f6e6e6e6d6d6d6c6c6c6b6b6b'
+        '6a6a6a696969686868676767666666656565646464636363'
+        '6262626161616060605f5f5f5e5e5e5d5d5d5c5c5c5b5b5b'
+        '5a5a5a585858575757565656555555545454535353525252'
+        '5151515050504e4e4e4d4d4d4b4b4b4a4a4a484848474747'
+        '4646464444444343434141414040403f3f3f3d3d3d3c3c3c'
+        '3a3a3a393939383838363636353535333333323232303030'
+        '2f2f2f2e2e2e2c2c2c2b2b2b292929282828272727252525'
+        '2424242323232222222121211f1f1f1e1e1e1d1d1d1c1c1c'
+        '1b1b1b1a1a1a181818171717161616151515141414131313'
+        '1111111010100f0f0f0e0e0e0d0d0d0c0c0c0a0a0a090909'
+        '080808070707060606050505030303020202010101000000'
+    ),
+    'viridis': (
+        '44015444025645045745055946075a46085c460a5d460b5e'
+        '470d60470e61471063471164471365481467481668481769'
+        '48186a481a6c481b6d481c6e481d6f481f70482071482173'
+        '482374482475482576482677482878482979472a7a472c7a'
+        '472d7b472e7c472f7d46307e46327e46337f463480453581'
+        '453781453882443983443a83443b84433d84433e85423f85'
+        '4240864241864142874144874045884046883f47883f4889'
+        '3e49893e4a893e4c8a3d4d8a3d4e8a3c4f8a3c508b3b518b'
+        '3b528b3a538b3a548c39558c39568c38588c38598c375a8c'
+        '375b8d365c8d365d8d355e8d355f8d34608d34618d33628d'
+        '33638d32648e32658e31668e31678e31688e30698e306a8e'
+        '2f6b8e2f6c8e2e6d8e2e6e8e2e6f8e2d708e2d718e2c718e'
+        '2c728e2c738e2b748e2b758e2a768e2a778e2a788e29798e'
+        '297a8e297b8e287c8e287d8e277e8e277f8e27808e26818e'
+        '26828e26828e25838e25848e25858e24868e24878e23888e'
+        '23898e238a8d228b8d228c8d228d8d218e8d218f8d21908d'
+        '21918c20928c20928c20938c1f948c1f958b1f968b1f978b'
+        '1f988b1f998a1f9a8a1e9b8a1e9c891e9d891f9e891f9f88'
+        '1fa0881fa1881fa1871fa28720a38620a48621a58521a685'
+        '22a78522a88423a98324aa8325ab8225ac8226ad8127ad81'
+        '28ae8029af7f2ab07f2cb17e2db27d2eb37c2fb47c31b57b'
+        '32b67a34b67935b77937b87838b9773aba763bbb753dbc74'
+        '3fbc7340bd7242be7144bf7046c06f48c16e4ac16d4cc26c'
+        '4ec36b50c46a52c56954c56856c66758c7655ac8645cc863'
+        '5ec96260ca6063cb5f65cb5e67cc5c69cd5b6ccd5a6ece58'
+        '70cf5773d05675d05477d1537ad1517cd2507fd34e81d34d'
+        '84d44b86d54989d5488bd6468ed64590d74393d74195d840'
+        '98d83e9bd93c9dd93ba0da39a2da37a5db36a8db34aadc32'
+        'addc30b0dd2fb2dd2db5de2bb8de29bade28bddf26c0df25'
+        'c2df23c5e021c8e020cae11fcde11dd0e11cd2e21bd5e21a'
+        'd8e219dae319dde318dfe318e2e418e5e419e7e419eae51a'
+        'ece51befe51cf1e51df4e61ef6e620f8e621fbe723fde725'
+    ),
+    'magma': (
+        '00000401000501010601010802010902020b02020d03030f'
+        '03031204041405041606051806051a07061c08071e090720'
+        '0a08220b09240c09260d0a290e0b2b100b2d110c2f120d31'
+        '130d34140e36150e38160f3b180f3d19103f1a10421c1044'
+        '1d11471e114920114b21114e221150241253251255271258'
+        '29115a2a115c2c115f2d11612f1163311165331067341069'
+        '36106b38106c390f6e3b0f703d0f713f0f72400f74420f75'
+        '440f764510774710784910784a10794c117a4e117b4f127b'
+        '51127c52137c54137d56147d57157e59157e5a167e5c167f'
+        '5d177f5f187f601880621980641a80651a80671b80681c81'
+        '6a1c816b1d816d1d816e1e81701f81721f81732081752181'
+        '7621817822817922827b23827c23827e2482802582812581'
+        '8326818426818627818827818928818b29818c29818e2a81'
+        '902a81912b81932b80942c80962c80982d80992d809b2e7f'
+        '9c2e7f9e2f7fa02f7fa1307ea3307ea5317ea6317da8327d'
+        'aa337dab337cad347cae347bb0357bb2357bb3367ab5367a'
+        'b73779b83779ba3878bc3978bd3977bf3a77c03a76c23b75'
+        'c43c75c53c74c73d73c83e73ca3e72cc3f71cd4071cf4070'
+        'd0416fd2426fd3436ed5446dd6456cd8456cd9466bdb476a'
+        'dc4869de4968df4a68e04c67e24d66e34e65e44f64e55064'
+        'e75263e85362e95462ea5661eb5760ec5860ed5a5fee5b5e'
+        'ef5d5ef05f5ef1605df2625df2645cf3655cf4675cf4695c'
+        'f56b5cf66c5cf66e5cf7705cf7725cf8745cf8765cf9785d'
+        'f9795df97b5dfa7d5efa7f5efa815ffb835ffb8560fb8761'
+        'fc8961fc8a62fc8c63fc8e64fc9065fd9266fd9467fd9668'
+        'fd9869fd9a6afd9b6bfe9d6cfe9f6dfea16efea36ffea571'
+        'fea772fea973feaa74feac76feae77feb078feb27afeb47b'
+        'feb67cfeb77efeb97ffebb81febd82febf84fec185fec287'
+        'fec488fec68afec88cfeca8dfecc8ffecd90fecf92fed194'
+        'fed395fed597fed799fed89afdda9cfddc9efddea0fde0a1'
+        'fde2a3fde3a5fde5a7fde7a9fde9aafdebacfcecaefceeb0'
+        'fcf0b2fcf2b4fcf4b6fcf6b8fcf7b9fcf9bbfcfbbdfcfdbf'
+    ),
+}
+
+
+def _decode(hexTable):
+    return np.frombuffer(bytes.fromhex(hexTable), dtype=np.uint8).reshape(-1, 3)
+
+
+# Components 0-255 of the colors of each colormap, (256, 3) uint8
+COLORMAPS = {name: _decode(hexTable) for name, hexTable in _HEX_TABLES.items()}
+
+
+def makeHexTable(name, N=256):
+    """
+    Samples the center of each of the N colors of a matplotlib colormap and
+    returns them as a single hex string, the format of the tables above.
+    Requires matplotlib, only used to print new tables.
+    """
+    import matplotlib
+    rgba = matplotlib.colormaps[name].resampled(N)((np.arange(N) + 0.5) / N)
+    rgb = np.round(rgba[:, :3] * 255).astype(np.uint8)
+    return rgb.tobytes().hex()
+
+
+def getColormap(name):
+    """
+    Returns the (256, 3) uint8 table of a colormap. Raises KeyError for the
+    colormaps that are not baked in.
+    """
+    try:
+        return COLORMAPS[name]
+    except (KeyError, TypeError):
+        raise KeyError(f"Unknown colormap: {name}") from None
+
+
+if __name__ == '__main__':
+    import sys
+    hexTable = makeHexTable(sys.argv[1])
+    print(f"    '{sys.argv[1]}': (")
+    for i in range(0, len(hexTable), 48):
+        print(f"        '{hexTable[i:i + 48]}'")
+    print("    ),")
@@ -1,5 +1,14 @@
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
 
+from . import settings
+
 
 ################################################################################
 # READ AND PARSE SUPPLEMENTARY DATA
@@ -20,7 +29,7 @@ def readSupplDataMetrics(pathToFile:str, removeAcronyms:bool=False):
     """
 
     # Read the corase, single animal data
-    dfCoarse = pd.read_excel(
+    dfCoarse = readExcelCached(
         pathToFile,
         sheet_name=0,
         header=[0,1],
@@ -29,7 +38,7 @@ def readSupplDataMetrics(pathToFile:str, removeAcronyms:bool=False):
         dfCoarse.index = dfCoarse.index.droplevel('coarse_acro')
 
     # Read the medium, single animal data
-    dfMid = pd.read_excel(
+    dfMid = readExcelCached(
         pathToFile,
         sheet_name=2,
         header=[0,1],
@@ -38,7 +47,7 @@ def readSupplDataMetrics(pathToFile:str, removeAcronyms:bool=False):
         dfMid.index = dfMid.index.droplevel(['coarse_acro','mid_acro'])
     
     # Read the fine, single animal data
-    dfFine = pd.read_excel(
+    dfFine = readExcelCached(
         pathToFile,
         sheet_name=4,
         header=[0,1],
@@ -51,9 +60,155 @@ def readSupplDataMetrics(pathToFile:str, removeAcronyms:bool=False):
     return dfDict
 
 
+def aggregateMetrics(metricsDf):
+    """
+    Calculates mean, SEM, number of animals and standard deviation across animals
+    of every metric of every region, skipping missing values as pandas does
+
+    PARAMETERS
+    ********************
+    metricsDf:pd.DataFrame single animal metrics, with columns (mouse, params)
+
+    RETURNS
+    ********************
+    aggrDf:pd.DataFrame float32 table with the same index as metricsDf and columns
+        (params, stat) where stat is one of 'mean', 'sem', 'n', 'std'
+    """
+    stats = {}
+    for param in metricsDf.columns.unique(level='params'):
+        values = metricsDf.xs(param, axis=1, level='params').to_numpy(dtype=float)
+        valid = ~np.isnan(values)
+        n = valid.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(valid, values, 0).sum(axis=1) / n
+            sqDev = np.where(valid, values - mean[:, None], 0) ** 2
+            std = np.where(n > 1, np.sqrt(sqDev.sum(axis=1) / (n - 1)), np.nan)
+            sem = std / np.sqrt(n)
+        stats.update({(param, 'mean'): mean, (param, 'sem'): sem, (param, 'n'): n, (param, 'std'): std})
+    aggrDf = pd.DataFrame(stats, index=metricsDf.index, dtype=np.float32)
+    aggrDf.columns.names = ['params', 'stat']
+    return aggrDf
+
+def aggregateSupplDataMetrics(dfDict:dict):
+    """
+    Applies aggregateMetrics() to all the resolutions of the dictionary of
+    dataframes returned by readSupplDataMetrics()
+    """
+    return {resolution: aggregateMetrics(df) for resolution, df in dfDict.items()}
+
+def buildRegionIndex(aggrDict:dict, ontology):
+    """
+    Stacks the aggregated metrics of all the resolutions in contiguous arrays,
+    one for each metric, and indexes their rows so that any selection of regions
+    can be read with a single gather.
+    Mid and fine region IDs overlap, so rows are indexed by (resolution, regionID).
+
+    PARAMETERS
+    ********************
+    aggrDict:dict dictionary of aggregated dataframes {coarse, mid, fine} as
+        returned by aggregateSupplDataMetrics()
+    ontology:Ontology tree of the atlas structures (see ontology.py), used to
+        find the mid regions inside each coarse region
+
+    RETURNS
+    ********************
+    regionIndex:dict
+        rows:       {(resolution, regionID): row}
+        majorRows:  {coarseID: rows of all the mid regions in that coarse region}
+        regionID:   np.ndarray (nRows) region ID of each row
+        statNames:  names of the columns of the stats arrays
+        stats:      {metric: np.ndarray float32 (nRows, len(statNames))}
+    """
+    statNames = ['mean', 'sem', 'n', 'std']
+    resolutions = ['coarse', 'mid', 'fine']
+    rows, majorRows, regionIDs = {}, {}, []
+    for resolution in resolutions:
+        df = aggrDict[resolution]
+        offset = len(regionIDs)
+        ids = df.index.get_level_values(resolution).to_numpy(dtype=np.int64)
+        rows.update({(resolution, int(regionID)): offset + k for k, regionID in enumerate(ids)})
+        if resolution == 'mid':
+            coarseIDs = np.unique(df.index.get_level_values('coarse').to_numpy(dtype=np.int64))
+            majorRows = {int(c): offset + np.flatnonzero(ontology.isDescendant(ids, c)) for c in coarseIDs}
+        regionIDs.extend(ids)
+
+    stats = {}
+    for metric in aggrDict['coarse'].columns.unique(level='params'):
+        blocks = [aggrDict[r].xs(metric, axis=1, level='params')[statNames].to_numpy(dtype=np.float32)
+            for r in resolutions]
+        stats[metric] = np.ascontiguousarray(np.concatenate(blocks))
+
+    regionIndex = dict(
+        rows=rows,
+        majorRows=majorRows,
+        regionID=np.array(regionIDs, dtype=np.int64),
+        statNames=statNames,
+        stats=stats,
+    )
+    return regionIndex
+
+def buildInteractionMatrix(aggrDicts:dict, structuresDf, resolution:str='mid', excludedRegions=(1009,)):
+    """
+    Collects the mean of every metric of every staining in a single dense matrix
+    (regions x (staining, metric)), together with its z-scores and the
+    correlation between every pair of columns, so that the interactions scatter
+    only has to pick two columns.
+    Z-scores and correlations skip missing values, as pandas does.
+
+    PARAMETERS
+    ********************
+    aggrDicts:dict {staining: aggregated dataframes {coarse, mid, fine}} as
+        returned by aggregateSupplDataMetrics()
+    structuresDf:pd.DataFrame structures, for the names, acronyms and colors of the regions
+    excludedRegions: IDs of regions that are never shown (1009: fiber tracts)
+
+    RETURNS
+    ********************
+    interactionMatrix:dict
+        regions:    pd.DataFrame indexed by (coarse, regionID) with 'name', 'acronym', 'rgb_plotly'
+        columns:    {(staining, metric): column}
+        mean:       np.ndarray float32 (nRegions, nColumns)
+        zScore:     np.ndarray float32 (nRegions, nColumns)
+        pearson, spearman, n: np.ndarray float (nColumns, nColumns) correlation
+                    coefficients and number of regions with both values
+    """
+    means = pd.concat({staining: aggr[resolution].xs('mean', axis=1, level='stat')
+        for staining, aggr in aggrDicts.items()}, axis=1, join='outer')
+    means = means.drop(list(excludedRegions), level=resolution, errors='ignore')
+
+    values = means.to_numpy(dtype=float)
+    with np.errstate(invalid='ignore'):
+        zScore = (values - np.nanmean(values, axis=0)) / np.nanstd(values, axis=0, ddof=1)
+
+    valid = (~np.isnan(values)).astype(float)
+    n = valid.T @ valid
+    pearson = means.corr(method='pearson').to_numpy()
+    spearman = np.full_like(pearson, np.nan)
+    # Spearman correlation ranks the values of each pair of columns on the regions
+    # where both are available
+    for i in range(values.shape[1]):
+        for j in range(i, values.shape[1]):
+            both = means.iloc[:, [i, j]].dropna()
+            if len(both) > 1:
+                spearman[i, j] = spearman[j, i] = both.rank().corr().iat[0, 1]
+
+    regions = structuresDf.reindex(means.index.get_level_values(resolution))[['name', 'acronym', 'rgb_plotly']]
+    regions.index = means.index
+
+    interactionMatrix = dict(
+        regions=regions,
+        columns={col: k for k, col in enumerate(means.columns)},
+        mean=np.ascontiguousarray(values, dtype=np.float32),
+        zScore=np.ascontiguousarray(zScore, dtype=np.float32),
+        pearson=pearson,
+        spearman=spearman,
+        n=n.astype(np.int64),
+    )
+    return interactionMatrix
+
 def readMetricsDataForGenes(pathToFile:str):
     # Read the medium redolution data (average across mice)
-    metricDf = pd.read_excel(
+    metricDf = readExcelCached(
         pathToFile,
         sheet_name=3,
         header=[0],
@@ -67,21 +222,344 @@ def readMetricsDataForGenes(pathToFile:str):
 
 def readGenesCorrelationSupplData(pathToFile:str):
 
-    wfa_en = pd.read_excel(pathToFile,
+    wfa_en = readExcelCached(pathToFile,
         sheet_name=0,
         header=0,
         index_col=0)
     
-    wfa_diff = pd.read_excel(pathToFile,
+    wfa_diff = readExcelCached(pathToFile,
         sheet_name=2,
         header=0,
         index_col=0)
 
-    pv_en = pd.read_excel(pathToFile,
+    pv_en = readExcelCached(pathToFile,
         sheet_name=1,
         header=0,
         index_col=0)
 
     dfDict = {"wfa_en":wfa_en, "wfa_diff":wfa_diff, "pv_en":pv_en}
 
-    return dfDict
\ No newline at end of file
+    return dfDict
+
+
+def buildGeneInfoRecords(geneDict:dict):
+    """
+    Indexes the rows of the gene tables of the supplementary data (SD4) by
+    AGEA ID, so that the info of a gene is found without scanning the tables.
+
+    PARAMETERS
+    ********************
+    geneDict:dict {wfa_en, wfa_diff, pv_en} as returned by readGenesCorrelationSupplData()
+
+    RETURNS
+    ********************
+    geneInfo:dict {wfa_en, wfa_diff, pv_en} each one a dict {geneID: record},
+        where record is a dict {column: value} with all the columns of the table
+        (the first row of each gene if it is repeated)
+    """
+    geneInfo = {}
+    for key, df in geneDict.items():
+        records = {}
+        for record in df.to_dict(orient='records'):
+            records.setdefault(record['gene_AGEA_id'], record)
+        geneInfo[key] = records
+    return geneInfo
+
+
+################################################################################
+# BINARY CACHE OF THE SUPPLEMENTARY DATA
+################################################################################
+
+# Bump this number whenever the layout of the cache files changes
+EXCEL_CACHE_VERSION = 1
+
+# Hashes of the files already read in this process {path: (mtime, size, hash)}
+_fileHashes = {}
+
+
+def fileHash(pathToFile) -> str:
+    """
+    Returns the SHA1 hex digest of the content of a file.
+    The hash is computed only once per process unless the file changes on disk.
+    """
+    pathToFile = str(pathToFile)
+    stat = os.stat(pathToFile)
+    cached = _fileHashes.get(pathToFile)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+
+    sha = hashlib.sha1()
+    with open(pathToFile, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    digest = sha.hexdigest()
+    _fileHashes[pathToFile] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+
+def readExcelCached(pathToFile, sheet_name=0, header=0, index_col=None):
+    """
+    Drop-in replacement of pd.read_excel() that keeps a columnar binary copy
+    (.npz) of each parsed sheet in the cache folder.
+
+    The cache file is keyed by the hash of the excel file and by the reading
+    parameters, so it is rebuilt automatically as soon as the excel file changes.
+
+    PARAMETERS
+    ********************
+    pathToFile:str full path to the excel file to load
+    sheet_name, header, index_col: same as in pd.read_excel()
+
+    RETURNS
+    ********************
+    df:pd.DataFrame the content of the excel sheet
+    """
+    readArgs = dict(sheet_name=sheet_name, header=header, index_col=index_col)
+    if not settings.USE_DATA_CACHE:
+        return pd.read_excel(pathToFile, **readArgs)
+
+    # Cache files of the same sheet read with the same arguments share a prefix
+    # and differ only in the hash of the excel file
+    pathToFile = Path(pathToFile)
+    argsKey = hashlib.sha1(json.dumps([EXCEL_CACHE_VERSION, readArgs]).encode()).hexdigest()[:8]
+    prefix = f"{pathToFile.stem}_sheet{sheet_name}_{argsKey}_"
+    cachePath = settings.CACHE_FOLDER / f"{prefix}{fileHash(pathToFile)[:16]}.npz"
+
+    return loadCacheFile(cachePath, lambda: pd.read_excel(pathToFile, **readArgs),
+        _loadDataFrameNpz, _saveDataFrameNpz, staleFiles=f"{prefix}*.npz")
+
+
+def _arrayToNpz(values):
+    """
+    Converts an array of values to a (data, mask) pair that can be stored in a
+    .npz file without pickling. mask is None for non-object arrays.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in 'biufcmM':
+        return values, None
+    # Object or string arrays can be stored only if they contain strings and NaNs
+    mask = pd.isna(values)
+    if not all(isinstance(x, str) for x in values[~mask]):
+        raise TypeError("Only numeric or string data can be cached")
+    data = np.where(mask, '', values).astype(str)
+    return data, mask
+
+
+def _arrayFromNpz(data, mask):
+    if mask is None:
+        return data
+    values = data.astype(object)
+    values[mask] = np.nan
+    return values
+
+
+def _saveDataFrameNpz(df, cachePath):
+    """
+    Stores each column and each index level of df as a separate array in a .npz
+    file, together with a json string with the names of the axes.
+    """
+    arrays = {}
+    def addArray(name, values):
+        data, mask = _arrayToNpz(values)
+        arrays[name] = data
+        if mask is not None:
+            arrays[name + '_mask'] = mask
+
+    for i, col in enumerate(df.columns):
+        addArray(f"col{i}", df.iloc[:, i].to_numpy())
+    for i in range(df.index.nlevels):
+        addArray(f"idx{i}", df.index.get_level_values(i).to_numpy())
+    for i in range(df.columns.nlevels):
+        addArray(f"colname{i}", df.columns.get_level_values(i).to_numpy())
+
+    meta = dict(
+        nCols=df.shape[1],
+        indexNames=list(df.index.names),
+        columnNames=list(df.columns.names),
+    )
+    arrays['meta'] = np.array(json.dumps(meta))
+
+    # Write to a temporary file first so that concurrent workers never see
+    # a partially written cache
+    cachePath = Path(cachePath)
+    cachePath.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=cachePath.parent, suffix='.tmp', delete=False) as f:
+        np.savez(f, **arrays)
+    replaceWithTempFile(f.name, cachePath)
+
+
+def _loadDataFrameNpz(cachePath):
+    with np.load(cachePath, allow_pickle=False) as npz:
+        meta = json.loads(str(npz['meta']))
+        getArray = lambda name: _arrayFromNpz(
+            npz[name], npz[name + '_mask'] if name + '_mask' in npz.files else None)
+
+        def makeIndex(prefix, names):
+            levels = [getArray(f"{prefix}{i}") for i in range(len(names))]
+            if len(levels) == 1:
+                return pd.Index(levels[0], name=names[0])
+            return pd.MultiIndex.from_arrays(levels, names=names)
+
+        index = makeIndex('idx', meta['indexNames'])
+        columns = makeIndex('colname', meta['columnNames'])
+        data = {i: getArray(f"col{i}") for i in range(meta['nCols'])}
+
+    df = pd.DataFrame(data, index=index)
+    df.columns = columns
+    return df
+
+
+################################################################################
+# PACKED ARRAY FILES
+################################################################################
+
+# A packed file is made of a small json header followed by raw arrays, each one
+# aligned to PACKED_ALIGNMENT bytes. Since arrays are stored uncompressed they can
+# be memory-mapped, so that all the processes that read the same file share the
+# same physical memory through the OS page cache.
+PACKED_MAGIC = b'PNNPACK1'
+PACKED_ALIGNMENT = 64
+
+
+def writePackedArrays(pathToFile, arrays:dict, meta:dict=None):
+    """
+    Writes a dictionary of numpy arrays (and optional json-serializable metadata)
+    to a single packed file that can be memory-mapped with readPackedArrays()
+
+    PARAMETERS
+    ********************
+    pathToFile:str full path of the file to write
+    arrays:dict {name: np.ndarray} arrays to store. Object arrays are not supported
+    meta:dict additional json-serializable information to store in the header
+    """
+    arrays = {name: np.ascontiguousarray(a) for name, a in arrays.items()}
+    align = lambda n: -(-n // PACKED_ALIGNMENT) * PACKED_ALIGNMENT
+
+    # Compute the position of each array in the file
+    layout = {}
+    offset = 0
+    for name, a in arrays.items():
+        if a.dtype.hasobject:
+            raise TypeError(f"Array '{name}' has dtype object and can't be packed")
+        a = arrays[name] = a.astype(a.dtype.newbyteorder('<'), copy=False)
+        layout[name] = dict(dtype=a.dtype.str, shape=list(a.shape), offset=offset)
+        offset = align(offset + a.nbytes)
+
+    header = json.dumps(dict(arrays=layout, meta=meta or {})).encode()
+    dataStart = align(len(PACKED_MAGIC) + 8 + len(header))
+
+    pathToFile = Path(pathToFile)
+    pathToFile.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=pathToFile.parent, suffix='.tmp', delete=False) as f:
+        f.write(PACKED_MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        for name, a in arrays.items():
+            f.seek(dataStart + layout[name]['offset'])
+            f.write(a.tobytes())
+        f.truncate(dataStart + offset)
+    replaceWithTempFile(f.name, pathToFile)
+
+
+def readPackedArrays(pathToFile):
+    """
+    Memory-maps a file written with writePackedArrays()
+
+    RETURNS
+    ********************
+    arrays:dict {name: np.ndarray} read-only views on the memory-mapped file
+    meta:dict the metadata stored in the header
+    """
+    mm = np.memmap(pathToFile, dtype=np.uint8, mode='r')
+    if bytes(mm[:len(PACKED_MAGIC)]) != PACKED_MAGIC:
+        raise ValueError(f"{pathToFile} is not a packed array file")
+    headerLen = int.from_bytes(bytes(mm[len(PACKED_MAGIC):len(PACKED_MAGIC) + 8]), 'little')
+    headerStart = len(PACKED_MAGIC) + 8
+    header = json.loads(bytes(mm[headerStart:headerStart + headerLen]))
+    dataStart = -(-(headerStart + headerLen) // PACKED_ALIGNMENT) * PACKED_ALIGNMENT
+
+    arrays = {}
+    for name, info in header['arrays'].items():
+        arrays[name] = np.ndarray(tuple(info['shape']), dtype=np.dtype(info['dtype']),
+            buffer=mm, offset=dataStart + info['offset'])
+    return arrays, header['meta']
+
+
+################################################################################
+# FILES OF THE CACHE FOLDER
+################################################################################
+
+# Permissions of the files written in the cache folder, the same as any new file
+# of this process (temporary files are created readable only by their owner)
+_umask = os.umask(0)
+os.umask(_umask)
+CACHE_FILE_MODE = 0o666 & ~_umask
+
+
+def replaceWithTempFile(tempPath, pathToFile):
+    """
+    Moves a temporary file written next to pathToFile in its place, with the
+    permissions of a new file, so that the workers can read the cache even when
+    it was built by another user
+    """
+    os.chmod(tempPath, CACHE_FILE_MODE)
+    os.replace(tempPath, pathToFile)
+
+
+def loadCacheFile(cachePath, build, read, write, staleFiles=None):
+    """
+    Returns the content of a file of the cache folder, read with read(cachePath).
+    The first time, or whenever the file can't be read (e.g. truncated, corrupted
+    or readable only by another user), the content is built with build() and
+    saved with write(content, cachePath). The other files of the folder that
+    match the glob pattern staleFiles (previous versions of the same data) are
+    then removed.
+    When the file can't be written (e.g. read-only cache folder) or read back,
+    the content that was built is returned as is.
+    """
+    cachePath = Path(cachePath)
+    if cachePath.exists():
+        try:
+            return read(cachePath)
+        except (OSError, ValueError, TypeError, KeyError):
+            pass    # Corrupted, truncated or unreadable cache, build it again
+
+    content = build()
+    try:
+        write(content, cachePath)
+    except (OSError, TypeError):
+        return content      # Read-only cache folder or data that can't be cached
+    if staleFiles:
+        for stale in cachePath.parent.glob(staleFiles):
+            if stale != cachePath:
+                try:
+                    stale.unlink()
+                except OSError:
+                    pass
+    try:
+        return read(cachePath)
+    except (OSError, ValueError, TypeError, KeyError):
+        return content
+
+
+def loadPackedCache(prefix, fingerprint, build):
+    """
+    Arrays and metadata stored in the packed file {prefix}_{fingerprint}.bin of
+    the cache folder (see writePackedArrays()). The file is memory-mapped, so that
+    all the workers share a single read-only copy of the arrays.
+
+    PARAMETERS
+    ********************
+    prefix:str name of the data, shared by all its versions
+    fingerprint:str hash of everything the data is built from
+    build: function that returns the (arrays, meta) to store in a new file
+
+    RETURNS
+    ********************
+    arrays:dict {name: np.ndarray}
+    meta:dict
+    """
+    if not settings.USE_DATA_CACHE:
+        return build()
+    return loadCacheFile(settings.CACHE_FOLDER / f"{prefix}_{fingerprint}.bin", build, readPackedArrays,
+        lambda content, path: writePackedArrays(path, *content), staleFiles=f"{prefix}_*.bin")
@@ -0,0 +1,233 @@
+"""
+Process-wide registry of the atlas datasets.
+
+Each dataset is loaded from disk the first time one of the pages asks for it and
+the very same object is then handed out to every other page. The returned objects
+are shared across pages and callbacks, so they must be treated as read-only.
+"""
+import threading
+
+from . import dataManager as dm
+from . import geneExpression as ge
+from . import geneCorrelation as gc
+from . import geneSearch as gs
+from . import ontology as onto
+from . import callbackFunctions as cf
+from . import settings
+from . import sliceGeometry as sg
+
+
+# Full path of the data folder where to load raw data
+dataFolder = settings.DATA_FOLDER
+
+# Supplementary data file associated with each staining
+supplDataFiles = {
+    'wfa': 'originalData/data_SD1.xlsx',
+    'pv': 'originalData/data_SD2.xlsx',
+    'coloc': 'originalData/data_SD3.xlsx',
+}
+
+# Loaded datasets and the lock that guards their first load
+_registry = {}
+_lock = threading.RLock()
+
+
+def _getOrLoad(key, loader, *args, **kwargs):
+    """
+    Returns the dataset stored under key, loading it with loader(*args, **kwargs)
+    if this is the first time it is requested in this process.
+    """
+    # Fast path: the dataset is already loaded
+    try:
+        return _registry[key]
+    except KeyError:
+        pass
+    # Slow path: only one thread loads the dataset, the others wait for it
+    with _lock:
+        if key not in _registry:
+            _registry[key] = loader(*args, **kwargs)
+        return _registry[key]
+
+
+################################################################################
+# SHARED DATASETS
+################################################################################
+
+def getStructuresDf():
+    """
+    Atlas dataFrame with all structures, acronyms, colors etc
+    """
+    return _getOrLoad('structures', cf.loadStructuresDf, dataFolder/'structures.json')
+
+
+def getOntology():
+    """
+    Tree of the atlas structures with fast descendant/ancestor queries
+    """
+    return _getOrLoad('ontology', onto.loadOntology, dataFolder/'structures.json')
+
+
+def getSupplDataMetrics(staining:str):
+    """
+    Single-animal metrics of a staining ('wfa', 'pv' or 'coloc') as a dictionary
+    of dataframes {coarse, mid, fine} without the acronym index levels
+    """
+    return _getOrLoad(('supplData', staining), dm.readSupplDataMetrics,
+        dataFolder/supplDataFiles[staining], removeAcronyms=True)
+
+
+def getAggregatedMetrics(staining:str):
+    """
+    Mean, SEM, n and std across animals of all the metrics of a staining, as a
+    dictionary of float32 dataframes {coarse, mid, fine} with the same index as
+    the dataframes returned by getSupplDataMetrics()
+    """
+    return _getOrLoad(('aggrData', staining), dm.aggregateSupplDataMetrics,
+        getSupplDataMetrics(staining))
+
+
+def getRegionIndex(staining:str):
+    """
+    Aggregated metrics of a staining stacked in one array per metric, with the
+    row of each (resolution, regionID). See dataManager.buildRegionIndex()
+    """
+    return _getOrLoad(('regionIndex', staining), dm.buildRegionIndex,
+        getAggregatedMetrics(staining), getOntology())
+
+
+def getInteractionMatrix():
+    """
+    Mean and z-score of every WFA and PV metric of the mid-ontology regions in a
+    single matrix, with the correlation of every pair of metrics.
+    See dataManager.buildInteractionMatrix()
+    """
+    return _getOrLoad('interactionMatrix', dm.buildInteractionMatrix,
+        {staining: getAggregatedMetrics(staining) for staining in ('wfa', 'pv')},
+        getStructuresDf())
+
+
+def getMetricsDataForGenes(staining:str):
+    """
+    Mid-resolution metrics of a staining ('wfa' or 'pv') averaged across mice
+    """
+    return _getOrLoad(('genesMetrics', staining), dm.readMetricsDataForGenes,
+        dataFolder/supplDataFiles[staining])
+
+
+def getGenesCorrelationData():
+    """
+    Dictionary of dataframes with the gene-metric correlation results
+    {wfa_en, wfa_diff, pv_en}
+    """
+    return _getOrLoad('genesCorrelation', dm.readGenesCorrelationSupplData,
+        dataFolder/'originalData/data_SD4.xlsx')
+
+
+def getGeneInfoRecords():
+    """
+    Columns of the gene tables of the supplementary data (SD4) of each gene,
+    indexed by AGEA ID. See dataManager.buildGeneInfoRecords()
+    """
+    return _getOrLoad('geneInfo', dm.buildGeneInfoRecords, getGenesCorrelationData())
+
+
+def getGeneSearchIndex():
+    """
+    Search index of the acronyms, names and AGEA IDs of the genes of the gene
+    dropdown. See geneSearch.GeneSearchIndex
+    """
+    return _getOrLoad('geneSearch', gs.GeneSearchIndex, getGenesCorrelationData()['wfa_en'])
+
+
+def getIshEnergy():
+    """
+    Gene expression energy from the Allen ISH dataset (genes x regions), as a
+    memory-mapped store with a fast lookup of each gene
+    """
+    return _getOrLoad('ishEnergy', ge.loadGeneExpression,
+        dataFolder/'gene_expression_ABA_energy.csv')
+
+
+def getGeneCorrelations():
+    """
+    Pearson and Spearman correlation of every gene of the ISH dataset with each
+    staining metric of the genes page {metric: pd.DataFrame indexed by gene ID}.
+    See geneCorrelation.loadGeneCorrelations()
+    """
+    return _getOrLoad('geneCorrelations', _loadGeneCorrelations)
+
+
+def getGeneCorrelationTable(metric:str):
+    """
+    Correlations of all the genes with a metric, with the acronym and name of
+    the genes when they are known
+    """
+    return _getOrLoad(('geneCorrelationTable', metric), _geneCorrelationTable, metric)
+
+
+def getSliceGeometry():
+    """
+    Packed, memory-mapped coordinates of the brain regions in all the coronal slices
+    """
+    return _getOrLoad('sliceGeometry', sg.loadSliceGeometry, dataFolder/'coordinates')
+
+
+def getDataFingerprint(staining:str):
+    """
+    Short hash that changes whenever the data of a staining or the atlas
+    structures (names, colors, ontology) change. Used to invalidate the
+    histograms cached on disk.
+    """
+    return dm.fileHash(dataFolder/supplDataFiles[staining])[:8] + dm.fileHash(dataFolder/'structures.json')[:8]
+
+
+def getExplorerFingerprint(staining:str):
+    """
+    Same as getDataFingerprint(), changing also with the slice geometry. Used to
+    invalidate the anatomical explorer figures cached on disk.
+    """
+    return getDataFingerprint(staining) + getSliceGeometry()['fingerprint'][:8]
+
+
+def _loadGeneCorrelations():
+    wfa = getMetricsDataForGenes('wfa')
+    pv = getMetricsDataForGenes('pv')
+    metrics = {metric: cf.getMetricDf(metric, wfa, pv) for metric in gc.GENE_METRICS}
+    metricsFingerprint = ''.join(dm.fileHash(dataFolder/supplDataFiles[s]) for s in ('wfa', 'pv'))
+    return gc.loadGeneCorrelations(getIshEnergy(), metrics, metricsFingerprint)
+
+
+def _geneCorrelationTable(metric):
+    # The supplementary tables are indexed by gene acronym
+    genes = getGenesCorrelationData()['wfa_en'].reset_index()
+    genes = genes.drop_duplicates('gene_AGEA_id').set_index('gene_AGEA_id')[['gene_acronym', 'gene_name']]
+    table = getGeneCorrelations()[metric].join(genes, how='left')
+    return table[['gene_acronym', 'gene_name', 'spearman', 'pearson', 'n']]
+
+
+################################################################################
+# BUILD STEP
+################################################################################
+
+def precompileData():
+    """
+    Parses all the raw data files once so that their binary caches are written
+    to the cache folder. Run it after updating the raw data, e.g. with:
+    python -m pnnatlas.utils.dataRegistry
+    """
+    for staining in supplDataFiles:
+        dm.readSupplDataMetrics(dataFolder/supplDataFiles[staining], removeAcronyms=True)
+    for staining in ('wfa', 'pv'):
+        dm.readMetricsDataForGenes(dataFolder/supplDataFiles[staining])
+    sg.loadSliceGeometry(dataFolder/'coordinates')
+    genesFile = dataFolder/'originalData/data_SD4.xlsx'
+    if genesFile.exists():
+        dm.readGenesCorrelationSupplData(genesFile)
+    ishFile = dataFolder/'gene_expression_ABA_energy.csv'
+    if ishFile.exists():
+        ge.loadGeneExpression(ishFile)
+        getGeneCorrelations()
+
+
+if __name__ == '__main__':
+    precompileData()
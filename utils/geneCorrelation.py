@@ -0,0 +1,215 @@
+"""
+Correlation of the expression of every gene with the staining metrics.
+
+The expression energy of all the genes (see geneExpression.py) is correlated
+with a staining metric in a few batched array operations instead of one gene at
+a time. Both the expression and the metric are log-transformed (as in the
+scatter plot of the genes page), values that are missing or not positive are
+masked, and each gene is correlated over the regions where both values exist.
+Results are saved in the cache folder as a packed file, so they are computed
+only once for each version of the data.
+"""
+import hashlib
+
+import numpy as np
+import pandas as pd
+from flask import jsonify, request
+
+from . import dataManager as dm
+
+
+# Version of the results. Bump it whenever the computation changes.
+GENE_CORRELATION_VERSION = 1
+
+# Staining metrics that genes are correlated with (same values of the metric
+# dropdown of the genes page)
+GENE_METRICS = ('wfa_energy', 'wfa_diffuseFluo', 'pv_energy')
+
+# Regions that are never shown (1009: fiber tracts)
+EXCLUDED_REGIONS = (1009,)
+
+# Minimum number of regions for a correlation to be computed
+MIN_REGIONS = 3
+
+# Url of the json API with the correlations of all the genes
+GENE_CORRELATION_ROUTE = '/api/genes/correlations'
+
+
+def correlateGenes(energy, regionIDs, metric, chunkSize=2048):
+    """
+    Pearson and Spearman correlation of the log expression of every gene with
+    the log of a staining metric.
+
+    PARAMETERS
+    ********************
+    energy:np.ndarray (nGenes, nRegions) expression energy of each gene
+    regionIDs:np.ndarray (nRegions) region ID of each column of energy
+    metric:pd.Series staining metric, indexed by region ID (level 'mid')
+    chunkSize:int number of genes processed at once, to bound the memory used
+
+    RETURNS
+    ********************
+    correlations:dict {pearson, spearman, n} arrays (nGenes) with the two
+        coefficients (NaN with less than MIN_REGIONS regions) and the number of
+        regions used for each gene
+    """
+    metric = metric.groupby(level='mid').first()
+    regionIDs = np.asarray(regionIDs)
+    cols = np.flatnonzero(np.isin(regionIDs, metric.index) & ~np.isin(regionIDs, EXCLUDED_REGIONS))
+    y = _safeLog(metric.reindex(regionIDs[cols]).to_numpy(dtype=float))
+
+    nGenes = energy.shape[0]
+    correlations = {k: np.full(nGenes, np.nan) for k in ('pearson', 'spearman', 'n')}
+    for start in range(0, nGenes, chunkSize):
+        rows = slice(start, min(start + chunkSize, nGenes))
+        x = _safeLog(np.asarray(energy[rows][:, cols], dtype=float))
+        valid = ~np.isnan(x) & ~np.isnan(y)
+        x[~valid] = np.nan
+        yy = np.where(valid, y, np.nan)
+        correlations['pearson'][rows] = _maskedPearson(x, yy, valid)
+        # Ranks (with ties averaged) are computed for each gene on its own valid regions
+        rankX = pd.DataFrame(x).rank(axis=1).to_numpy()
+        rankY = pd.DataFrame(yy).rank(axis=1).to_numpy()
+        correlations['spearman'][rows] = _maskedPearson(rankX, rankY, valid)
+        correlations['n'][rows] = valid.sum(axis=1)
+    return correlations
+
+
+def _safeLog(values):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where((values > 0) & np.isfinite(values), np.log10(values), np.nan)
+
+
+def _maskedPearson(x, y, valid):
+    """
+    Pearson correlation of each row of x with the same row of y, using only the
+    valid entries of each row
+    """
+    n = valid.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dx = np.where(valid, x - np.nansum(np.where(valid, x, 0), axis=1, keepdims=True) / n[:, None], 0)
+        dy = np.where(valid, y - np.nansum(np.where(valid, y, 0), axis=1, keepdims=True) / n[:, None], 0)
+        r = (dx * dy).sum(axis=1) / np.sqrt((dx ** 2).sum(axis=1) * (dy ** 2).sum(axis=1))
+        # Rows without any variation have no correlation (rounding errors of the
+        # mean would give a tiny one)
+        constant = (_rowRange(x, valid) == 0) | (_rowRange(y, valid) == 0)
+    r[(n < MIN_REGIONS) | constant] = np.nan
+    return np.clip(r, -1, 1)
+
+
+def _rowRange(values, valid):
+    return np.max(np.where(valid, values, -np.inf), axis=1) - np.min(np.where(valid, values, np.inf), axis=1)
+
+
+def loadGeneCorrelations(geneStore, metrics:dict, metricsFingerprint:str):
+    """
+    Correlations of all the genes with all the metrics, computed the first time
+    and then read from the cache folder.
+
+    PARAMETERS
+    ********************
+    geneStore:GeneExpressionStore expression of all the genes
+    metrics:dict {metricName: pd.Series indexed by region ID ('mid')}
+    metricsFingerprint:str hash of the files the metrics come from
+
+    RETURNS
+    ********************
+    correlations:dict {metricName: pd.DataFrame indexed by gene ID with columns
+        'pearson', 'spearman' and 'n'}
+    """
+    sha = hashlib.sha1(str(GENE_CORRELATION_VERSION).encode())
+    sha.update(geneStore.fingerprint.encode())
+    sha.update(metricsFingerprint.encode())
+    sha.update(','.join(metrics).encode())
+
+    def build():
+        arrays = {}
+        for name, metric in metrics.items():
+            result = correlateGenes(geneStore.energy, geneStore.regionIDs, metric)
+            arrays.update({f"{name}_{k}": v.astype(np.float32) for k, v in result.items()})
+        return arrays, {}
+
+    arrays, _ = dm.loadPackedCache('geneCorrelation', sha.hexdigest()[:16], build)
+
+    geneIndex = pd.Index(geneStore.geneIDs, name='gene_AGEA_id')
+    correlations = {}
+    for name in metrics:
+        correlations[name] = pd.DataFrame({
+            'pearson': arrays[f"{name}_pearson"],
+            'spearman': arrays[f"{name}_spearman"],
+            'n': arrays[f"{name}_n"].astype(np.int64),
+        }, index=geneIndex)
+    return correlations
+
+
+def sortGenes(corrDf, sortBy=None):
+    """
+    Sorts a table of correlations as requested by a DataTable with custom
+    sorting. Missing values always go last. Defaults to the strongest Spearman
+    correlations first.
+
+    PARAMETERS
+    ********************
+    corrDf:pd.DataFrame table of correlations of the genes
+    sortBy:list [{'column_id': column, 'direction': 'asc' or 'desc'}] as the
+        sort_by property of a DataTable. The index of the table (gene_AGEA_id)
+        can be sorted as any column
+    """
+    if not sortBy:
+        sortBy = [{'column_id': 'spearman', 'direction': 'desc'}]
+    sortBy = [s for s in sortBy if s['column_id'] in sortableColumns(corrDf)]
+    if not sortBy:
+        return corrDf
+    indexName = corrDf.index.name
+    return corrDf.reset_index().sort_values(
+        by=[s['column_id'] for s in sortBy],
+        ascending=[s['direction'] == 'asc' for s in sortBy],
+        na_position='last',
+        kind='stable',
+    ).set_index(indexName)
+
+
+def sortableColumns(corrDf):
+    """
+    Names of the index and of the columns of a table of correlations
+    """
+    return [corrDf.index.name] + list(corrDf.columns)
+
+
+def installGeneCorrelationApi(server, getTable):
+    """
+    Serves the correlations of all the genes with a staining metric as json at
+    GENE_CORRELATION_ROUTE, e.g.
+        /api/genes/correlations?metric=wfa_energy&sort=spearman&order=desc&limit=50
+    'metric' is one of GENE_METRICS, 'sort' any column of the table (defaults
+    to spearman), 'order' asc or desc and 'limit' the number of genes (all of
+    them if missing).
+
+    PARAMETERS
+    ********************
+    server: flask server of the dash app (app.server)
+    getTable: function that returns the table of correlations of a metric
+    """
+    def geneCorrelations():
+        metric = request.args.get('metric', GENE_METRICS[0])
+        if metric not in GENE_METRICS:
+            return jsonify(error=f"Unknown metric '{metric}', use one of {list(GENE_METRICS)}"), 400
+        order = request.args.get('order', 'desc')
+        if order not in ('asc', 'desc'):
+            return jsonify(error="order must be 'asc' or 'desc'"), 400
+        limit = request.args.get('limit', type=int)
+
+        table = getTable(metric)
+        sortColumn = request.args.get('sort', 'spearman')
+        if sortColumn not in sortableColumns(table):
+            return jsonify(error=f"Unknown column '{sortColumn}', use one of {sortableColumns(table)}"), 400
+        table = sortGenes(table, [{'column_id': sortColumn, 'direction': order}])
+        if limit is not None:
+            table = table.head(max(limit, 0))
+
+        table = table.reset_index()
+        # NaN is not valid json
+        table = table.astype(object).where(table.notna(), None)
+        return jsonify(metric=metric, sort=sortColumn, order=order, genes=table.to_dict(orient='records'))
+
+    server.add_url_rule(GENE_CORRELATION_ROUTE, 'geneCorrelations', geneCorrelations)
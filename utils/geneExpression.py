@@ -0,0 +1,118 @@
+"""
+Columnar store of the gene expression energy from the Allen ISH dataset.
+
+The csv (one row per gene, one column per brain region) is parsed only once and
+saved in the cache folder as a packed file (see dataManager.writePackedArrays())
+with the arrays:
+    energy:     float32 (nGenes, nRegions) expression energy of each gene in each region
+    geneIDs:    (nGenes) AGEA ID of the gene in each row
+    regionIDs:  int64 (nRegions) ID of the brain region in each column
+The file is then memory-mapped, so that all the worker processes share a single
+read-only copy of the matrix and reading the expression of a gene returns a view
+on one of its rows, without copying or parsing anything.
+"""
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from . import dataManager as dm
+
+
+# Version of the packed file format. Bump it to rebuild the cached files.
+GENE_STORE_VERSION = 2
+
+
+class GeneExpressionStore:
+    """
+    Expression energy of all the genes in all the regions, with a constant-time
+    lookup of the row of a gene.
+
+    PARAMETERS
+    ********************
+    energy:np.ndarray float32 (nGenes, nRegions)
+    geneIDs:np.ndarray (nGenes) AGEA ID of each row
+    regionIDs:np.ndarray int64 (nRegions) region ID of each column
+    fingerprint:str hash of the csv the data comes from
+    """
+    def __init__(self, energy, geneIDs, regionIDs, fingerprint=''):
+        self.energy = energy
+        self.geneIDs = geneIDs
+        self.regionIDs = regionIDs
+        self.fingerprint = fingerprint
+        self._numericIDs = geneIDs.dtype.kind in 'iu'
+        self._row = {gene: row for row, gene in enumerate(geneIDs.tolist())}
+        # Index of the regions shared by all the series returned by geneSeries()
+        self._regionIndex = pd.Index(regionIDs, name='mid')
+
+    def __len__(self):
+        return len(self.geneIDs)
+
+    def __contains__(self, gene):
+        try:
+            self.rowOf(gene)
+        except KeyError:
+            return False
+        return True
+
+    def rowOf(self, gene):
+        """
+        Row of a gene in the energy matrix. Raises KeyError for unknown genes.
+        """
+        try:
+            return self._row[int(gene) if self._numericIDs else str(gene)]
+        except (KeyError, ValueError, TypeError):
+            raise KeyError(f"Unknown gene: {gene}") from None
+
+    def geneEnergy(self, gene):
+        """
+        Expression energy of a gene in all the regions (read-only view, no copy)
+        """
+        return self.energy[self.rowOf(gene)]
+
+    def geneSeries(self, gene, name='geneExp'):
+        """
+        Expression energy of a gene as a pd.Series indexed by region ID ('mid')
+        """
+        return pd.Series(self.geneEnergy(gene), index=self._regionIndex, name=name, copy=False)
+
+
+def loadGeneExpression(pathToFile):
+    """
+    Loads the gene expression csv as a GeneExpressionStore.
+
+    The packed file is built the first time and is then memory-mapped. It is
+    rebuilt automatically when the csv changes.
+    """
+    sha = hashlib.sha1(str(GENE_STORE_VERSION).encode())
+    sha.update(dm.fileHash(pathToFile).encode())
+    fingerprint = sha.hexdigest()[:16]
+
+    def build():
+        energy, geneIDs, regionIDs = packGeneExpression(pathToFile)
+        return dict(energy=energy, geneIDs=geneIDs, regionIDs=regionIDs), {}
+
+    arrays, _ = dm.loadPackedCache('geneExpression', fingerprint, build)
+    return GeneExpressionStore(arrays['energy'], arrays['geneIDs'], arrays['regionIDs'], fingerprint)
+
+
+def packGeneExpression(pathToFile):
+    """
+    Parses the gene expression csv (genes x regions, gene IDs in the first column)
+
+    RETURNS
+    ********************
+    energy:np.ndarray float32 (nGenes, nRegions)
+    geneIDs:np.ndarray (nGenes) int64 if all the IDs are numbers, strings otherwise
+    regionIDs:np.ndarray int64 (nRegions)
+    """
+    ishDf = pd.read_csv(pathToFile, index_col=0)
+    regionIDs = pd.to_numeric(ishDf.columns).to_numpy(dtype=np.int64)
+    geneIDs = ishDf.index.to_numpy()
+    # The csv stores the IDs as floats (e.g. 11126.0)
+    if geneIDs.dtype.kind == 'f' and np.all(np.mod(geneIDs, 1) == 0):
+        geneIDs = geneIDs.astype(np.int64)
+    if geneIDs.dtype.kind not in 'iu':
+        geneIDs = geneIDs.astype(str)
+    energy = np.ascontiguousarray(ishDf.to_numpy(dtype=np.float32))
+    return energy, geneIDs, regionIDs
@@ -0,0 +1,116 @@
+"""
+Search index of the genes shown in the gene dropdown of the genes page.
+
+Instead of embedding the options of all the genes in the layout, the dropdown
+asks the server for the genes that match what is typed in it (search_value) and
+receives only the best GENE_SEARCH_LIMIT matches. Matches are ranked as:
+    1. acronyms starting with the query
+    2. AGEA IDs starting with the query
+    3. acronyms or names containing the query
+Prefix matches are found with a binary search on the sorted keys, the substring
+matches with a single scan of the lowercase labels. Searches are case-insensitive.
+"""
+from bisect import bisect_left
+
+import numpy as np
+
+
+# Maximum number of options returned for each search
+GENE_SEARCH_LIMIT = 50
+
+
+class GeneSearchIndex:
+    """
+    Case-insensitive prefix and substring search over the acronym, name and
+    AGEA ID of the genes.
+
+    PARAMETERS
+    ********************
+    genesDf:pd.DataFrame genes table of the supplementary data (SD4), indexed
+        by gene acronym with the columns 'gene_AGEA_id' and 'gene_name'
+    """
+    def __init__(self, genesDf):
+        genes = genesDf.reset_index()
+        genes = genes.drop_duplicates('gene_AGEA_id').sort_values('gene_acronym', kind='stable')
+        self.geneIDs = genes['gene_AGEA_id'].tolist()
+        acronyms = genes['gene_acronym'].astype(str).tolist()
+        names = genes['gene_name'].fillna('').astype(str).tolist()
+
+        # Option of each gene, in alphabetical order of the acronyms. 'search' is
+        # what the dropdown matches in the browser, so genes found by name or ID
+        # are not filtered out again.
+        self.options = [
+            {'label': acronym, 'value': geneID, 'search': f"{acronym} {name} {geneID}"}
+            for acronym, name, geneID in zip(acronyms, names, self.geneIDs)
+        ]
+        self._position = {geneID: i for i, geneID in enumerate(self.geneIDs)}
+
+        # Sorted keys for the prefix searches, with the position of their gene
+        self._acronymKeys, self._acronymPos = _sortedKeys([a.lower() for a in acronyms])
+        self._idKeys, self._idPos = _sortedKeys([str(g) for g in self.geneIDs])
+        # Lowercase labels for the substring search
+        self._labels = [f"{a}\t{n}".lower() for a, n in zip(acronyms, names)]
+
+    def __len__(self):
+        return len(self.options)
+
+    def option(self, geneID):
+        """
+        Dropdown option of a gene, None for unknown genes
+        """
+        position = self._position.get(geneID)
+        return None if position is None else self.options[position]
+
+    def search(self, query, limit=GENE_SEARCH_LIMIT, selected=None):
+        """
+        Options of the genes that best match a query.
+
+        PARAMETERS
+        ********************
+        query:str text typed in the dropdown. An empty query returns the first
+            genes in alphabetical order
+        limit:int maximum number of matches
+        selected: AGEA ID of the selected gene. Its option is always included so
+            that the dropdown can keep showing its label
+
+        RETURNS
+        ********************
+        options:list of {label, value, search} dictionaries
+        """
+        query = (query or '').strip().lower()
+        if not query:
+            positions = range(min(limit, len(self.options)))
+        else:
+            positions = dict.fromkeys(_prefixMatches(self._acronymKeys, self._acronymPos, query, limit))
+            if len(positions) < limit:
+                positions.update(dict.fromkeys(_prefixMatches(self._idKeys, self._idPos, query, limit)))
+            if len(positions) < limit:
+                for position, label in enumerate(self._labels):
+                    if query in label:
+                        positions[position] = None
+                        if len(positions) >= limit:
+                            break
+            positions = list(positions)[:limit]
+
+        options = [self.options[p] for p in positions]
+        selectedOption = self.option(selected)
+        if selectedOption is not None and selectedOption not in options:
+            options.append(selectedOption)
+        return options
+
+
+def _sortedKeys(keys):
+    order = np.argsort(np.array(keys, dtype=object), kind='stable')
+    return [keys[i] for i in order], order.tolist()
+
+
+def _prefixMatches(sortedKeys, positions, prefix, limit):
+    """
+    Positions of the (at most limit) keys that start with prefix
+    """
+    i = bisect_left(sortedKeys, prefix)
+    matches = []
+    while i < len(sortedKeys) and len(matches) < limit and sortedKeys[i].startswith(prefix):
+        matches.append(positions[i])
+        i += 1
+    return matches
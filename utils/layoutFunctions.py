@@ -1,6 +1,7 @@
 from cProfile import label
 from pydoc import classname
-from dash import dcc, html
+from dash import dcc, html, dash_table
+from dash.dash_table.Format import Format, Scheme
 import dash_bootstrap_components as dbc
 
 
@@ -457,9 +458,14 @@ def make_ColocalizationHistogramSelectionMenu(idFunc, coarseDict, midDict, fineD
     ])
     return menu
 
-def make_GeneCorrSelectionMenu(idFunc, genesDf):
+# Gene selected when the genes page is opened (Aggrecan)
+DEFAULT_GENE = 11382
+
+def make_GeneCorrSelectionMenu(idFunc, geneOptions):
     """
-    Makes the left-side menu with dropdowns for the histogram of the multiple staining metrics
+    Makes the left-side menu with dropdowns for the histogram of the multiple staining metrics.
+    geneOptions are the initial options of the gene dropdown, the others are
+    requested to the server while typing in it.
     """
     menu = html.Div([
         html.H6(["Select a gene ID:"],className='my-1'),
@@ -467,10 +473,11 @@ def make_GeneCorrSelectionMenu(idFunc, genesDf):
             html.Div([
                 dcc.Dropdown(
                     id=idFunc('drpD_geneSelect'),
-                    options=getGenesLabels(genesDf),
-                    value=11382, # Default ID for Aggrecan
+                    options=geneOptions,
+                    value=DEFAULT_GENE,
                     multi=False,
                     clearable=False,
+                    placeholder='Type a gene acronym, name or ID',
                 )],
                 style={'flex-grow':'1'},
             ),
@@ -513,10 +520,16 @@ def make_GeneCorrSelectionMenu(idFunc, genesDf):
     ])
     return menu
 
+# Number of rows in each page of the tabular data
+TABLE_PAGE_SIZE = 25
+
 def make_CollapsableTable(idFunc):
     """
-    Makes the collapsable tabular data section
+    Makes the collapsable tabular data section.
+    The table is paginated on the server: callbacks send only the rows of the
+    page that is shown (see callbackFunctions.tablePage())
     """
+    numberFormat = Format(precision=4, scheme=Scheme.decimal_or_exponent)
     collapsTable = html.Div([
         dbc.Button("Open Tabular Data",
             id=idFunc("btn_openTabDiffuse"),
@@ -524,6 +537,24 @@ def make_CollapsableTable(idFunc):
             color="primary",
         ),
         dbc.Collapse(
+            dash_table.DataTable(
+                id=idFunc('table_data'),
+                columns=[
+                    dict(name='regionName', id='regionName'),
+                    dict(name='acronym', id='acronym'),
+                    dict(name='regionId', id='regionId', type='numeric'),
+                    dict(name='mean', id='mean', type='numeric', format=numberFormat),
+                    dict(name='sem', id='sem', type='numeric', format=numberFormat),
+                ],
+                data=[],
+                page_action='custom',
+                page_current=0,
+                page_size=TABLE_PAGE_SIZE,
+                page_count=1,
+                style_cell={'textAlign':'left', 'fontFamily':'inherit', 'padding':'4px 8px'},
+                style_header={'fontWeight':'bold'},
+                style_data_conditional=[{'if': {'row_index':'odd'}, 'backgroundColor':'rgba(0,0,0,0.05)'}],
+            ),
             id=idFunc("collps_Tab"),
             is_open=False,
         )],
@@ -531,6 +562,56 @@ def make_CollapsableTable(idFunc):
     )
     return collapsTable
 
+def make_GeneInfoTable(record):
+    """
+    Makes the table with the info of a gene (one row for each parameter), from
+    a record returned by callbackFunctions.getGeneInfoTable()
+    """
+    table = dbc.Table([
+        html.Thead([html.Tr([html.Th('Parameter'), html.Th('Value')])]),
+        html.Tbody([html.Tr([html.Td(param), html.Td(value)]) for param, value in record.items()]),
+        ],
+        striped=True, bordered=True, hover=True,
+    )
+    return table
+
+def make_TopGenesTable(idFunc):
+    """
+    Makes the table with the correlation of all the genes with the metric
+    selected in the genes page. Sorting and pagination happen on the server.
+    """
+    numberFormat = Format(precision=3, scheme=Scheme.fixed)
+    topGenes = html.Div([
+        html.P(["Correlation of the expression of every gene with the selected metric, "
+            "computed on the log-transformed values of all the regions where both are available. "
+            "Click on a column header to sort the genes."],
+            className='mt-3 mb-2'),
+        dash_table.DataTable(
+            id=idFunc('table_topGenes'),
+            columns=[
+                dict(name='Gene', id='gene_acronym'),
+                dict(name='Name', id='gene_name'),
+                dict(name='AGEA ID', id='gene_AGEA_id', type='numeric'),
+                dict(name='Spearman r', id='spearman', type='numeric', format=numberFormat),
+                dict(name='Pearson r', id='pearson', type='numeric', format=numberFormat),
+                dict(name='Regions', id='n', type='numeric'),
+            ],
+            data=[],
+            page_action='custom',
+            page_current=0,
+            page_size=TABLE_PAGE_SIZE,
+            page_count=1,
+            sort_action='custom',
+            sort_mode='single',
+            sort_by=[{'column_id':'spearman', 'direction':'desc'}],
+            style_cell={'textAlign':'left', 'fontFamily':'inherit', 'padding':'4px 8px'},
+            style_header={'fontWeight':'bold'},
+            style_data_conditional=[{'if': {'row_index':'odd'}, 'backgroundColor':'rgba(0,0,0,0.05)'}],
+        )],
+        className='mt-3'
+    )
+    return topGenes
+
 def make_AnatomicalExplorerSelectionMenu(idFunc, staining='wfa'):
     """
     Makes the layout for the left-side selection menu of the anatomical explorer
@@ -845,7 +926,9 @@ def make_CC_licenseBanner(idFunc):
 
 def colormapDictListDropdown():
     """
-    Creates a list of dicts to fill a dropdown to select different colormaps
+    Creates a list of dicts to fill a dropdown to select different colormaps.
+    The anatomical explorer colors regions through the lookup table of each of
+    these colormaps (see callbackFunctions.getColormapLut())
     """
     cmapDictList = [
         dict(label='Blue',value='PuBu'),
@@ -875,14 +958,6 @@ def getMetricsLabels(staining='wfa'):
 
     return labels
 
-def getGenesLabels(genesDf):
-    genesDf = genesDf.sort_values(by='gene_acronym')
-    labels = []
-    for idx, row in genesDf.iterrows():
-        temp = {'label':idx,'value':row['gene_AGEA_id']}
-        labels.append(temp)
-    return labels
-
 def getMetricsForGenesLabels():
     labels = [
         {'label':'PNN Energy','value':'wfa_energy'},
@@ -0,0 +1,199 @@
+"""
+Array-backed index of the Allen brain structures ontology (structures.json).
+
+Structures are stored in depth-first (pre-order) order, so that all the
+descendants of a structure occupy a contiguous interval of the arrays:
+    ids:    int64 (n) structure ID at each position
+    parent: int32 (n) position of the parent structure (-1 for root)
+    depth:  int32 (n) number of ancestors of each structure (0 for root)
+    tin:    int32 (n) position of each structure (start of its interval)
+    tout:   int32 (n) end of the interval of each structure (excluded)
+Structure A is a descendant of B if tin[B] <= tin[A] < tout[B], so descendant
+and ancestor queries are O(1). Ancestors at any depth and lowest common
+ancestors are found in O(log(depth)) with a binary lifting table.
+"""
+import json
+
+import numpy as np
+
+
+class Ontology:
+    """
+    Tree of the brain structures. All the methods take and return structure IDs.
+
+    PARAMETERS
+    ********************
+    structures:list list of dicts with at least 'id', 'structure_id_path' and
+        'graph_order' (the content of structures.json)
+    """
+    def __init__(self, structures):
+        byID = {s['id']: s for s in structures}
+        children = {s['id']: [] for s in structures}
+        roots = []
+        for s in sorted(structures, key=lambda s: s['graph_order']):
+            path = s['structure_id_path']
+            if len(path) > 1 and path[-2] in byID:
+                children[path[-2]].append(s['id'])
+            else:
+                roots.append(s['id'])
+        if len(roots) != 1:
+            raise ValueError(f"The ontology must have exactly one root, found {len(roots)}")
+
+        # Pre-order depth-first visit
+        n = len(structures)
+        ids = np.empty(n, dtype=np.int64)
+        parent = np.full(n, -1, dtype=np.int32)
+        depth = np.zeros(n, dtype=np.int32)
+        stack = [(roots[0], -1)]
+        pos = 0
+        while stack:
+            structureID, parentPos = stack.pop()
+            ids[pos] = structureID
+            parent[pos] = parentPos
+            depth[pos] = 0 if parentPos < 0 else depth[parentPos] + 1
+            # Reversed so that children are visited in graph order
+            stack.extend((c, pos) for c in reversed(children[structureID]))
+            pos += 1
+
+        # Subtree sizes, accumulated from the leaves up
+        size = np.ones(n, dtype=np.int32)
+        for p in range(n - 1, 0, -1):
+            size[parent[p]] += size[p]
+
+        self.ids = ids
+        self.parent = parent
+        self.depth = depth
+        self.tin = np.arange(n, dtype=np.int32)
+        self.tout = self.tin + size
+        self.rootID = int(ids[0])
+
+        # Dict for single IDs and sorted IDs to convert arrays of IDs with a binary search
+        self._position = {int(x): p for p, x in enumerate(ids)}
+        self._sortedIdx = np.argsort(ids)
+        self._sortedIDs = ids[self._sortedIdx]
+
+        # Binary lifting table: up[k, p] is the 2^k-th ancestor of p (root stays root)
+        levels = max(1, int(depth.max()).bit_length())
+        up = np.empty((levels, n), dtype=np.int32)
+        up[0] = np.where(parent < 0, 0, parent)
+        for k in range(1, levels):
+            up[k] = up[k - 1][up[k - 1]]
+        self._up = up
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, structureID):
+        return int(structureID) in self._position
+
+    def positionOf(self, structureIDs):
+        """
+        Position in the arrays of one or many structure IDs. Raises KeyError for
+        unknown IDs.
+        """
+        if np.ndim(structureIDs) == 0:
+            try:
+                return self._position[int(structureIDs)]
+            except KeyError:
+                raise KeyError(f"Unknown structure ID: {structureIDs}") from None
+        structureIDs = np.asarray(structureIDs, dtype=np.int64)
+        i = np.clip(np.searchsorted(self._sortedIDs, structureIDs), 0, len(self._sortedIDs) - 1)
+        if not np.all(self._sortedIDs[i] == structureIDs):
+            missing = np.atleast_1d(structureIDs)[np.atleast_1d(self._sortedIDs[i] != structureIDs)]
+            raise KeyError(f"Unknown structure IDs: {missing.tolist()}")
+        return self._sortedIdx[i]
+
+    def parentOf(self, structureID):
+        """
+        ID of the parent structure, None for root
+        """
+        p = self.parent[self.positionOf(structureID)]
+        return None if p < 0 else int(self.ids[p])
+
+    def depthOf(self, structureID):
+        return int(self.depth[self.positionOf(structureID)])
+
+    def isDescendant(self, structureIDs, ancestorID, strict=False):
+        """
+        Whether each of structureIDs is a descendant of ancestorID. A structure is
+        a descendant of itself unless strict is True.
+        """
+        p = self.positionOf(structureIDs)
+        a = self.positionOf(ancestorID)
+        inside = (self.tin[a] <= self.tin[p]) & (self.tin[p] < self.tout[a])
+        if strict:
+            inside &= p != a
+        return inside
+
+    def descendants(self, structureID, strict=False):
+        """
+        IDs of all the descendants of a structure in graph order, starting with the
+        structure itself unless strict is True
+        """
+        a = self.positionOf(structureID)
+        return self.ids[self.tin[a] + int(strict):self.tout[a]]
+
+    def children(self, structureID):
+        """
+        IDs of the direct children of a structure in graph order
+        """
+        a = self.positionOf(structureID)
+        sub = np.arange(self.tin[a] + 1, self.tout[a])
+        return self.ids[sub[self.parent[sub] == a]]
+
+    def ancestors(self, structureID, strict=False):
+        """
+        IDs of all the ancestors of a structure from root down to the structure
+        itself (excluded if strict is True)
+        """
+        p = self.positionOf(structureID)
+        path = []
+        if not strict:
+            path.append(p)
+        while self.parent[p] >= 0:
+            p = int(self.parent[p])
+            path.append(p)
+        return self.ids[path[::-1]]
+
+    def ancestorAtDepth(self, structureIDs, depth):
+        """
+        Ancestor at the given depth of each of structureIDs. Structures that are
+        not as deep as depth are returned unchanged. Useful to roll regions up to
+        a coarser level of the ontology.
+        """
+        p = np.atleast_1d(self.positionOf(structureIDs)).copy()
+        steps = np.maximum(self.depth[p] - depth, 0)
+        for k in range(len(self._up)):
+            lift = (steps >> k) & 1 == 1
+            p[lift] = self._up[k][p[lift]]
+        out = self.ids[p]
+        return out if np.ndim(structureIDs) else int(out[0])
+
+    def lowestCommonAncestor(self, structureA, structureB):
+        """
+        ID of the deepest structure that contains both structureA and structureB
+        """
+        u = self.positionOf(structureA)
+        v = self.positionOf(structureB)
+        if self._contains(u, v):
+            return int(self.ids[u])
+        if self._contains(v, u):
+            return int(self.ids[v])
+        # Lift u as long as its ancestor does not contain v
+        for k in range(len(self._up) - 1, -1, -1):
+            w = int(self._up[k][u])
+            if not self._contains(w, v):
+                u = w
+        return int(self.ids[self.parent[u]])
+
+    def _contains(self, a, p):
+        return self.tin[a] <= self.tin[p] < self.tout[a]
+
+
+def loadOntology(structuresPath):
+    """
+    Builds the ontology index from the Allen structures.json file
+    """
+    with open(structuresPath) as f:
+        structures = json.load(f)
+    return Ontology(structures)
@@ -0,0 +1,83 @@
+"""
+Lazy registry of the pages of the atlas.
+
+Dash needs to know all the callbacks before the server answers its first request,
+so all the page modules are still imported at startup. Importing a page however
+only registers its callbacks: its data is loaded and its layout is built the
+first time the page is visited. A worker therefore only loads the data of the
+pages that are actually visited, unless the pages are preloaded at startup
+(PNNATLAS_PRELOAD_PAGES=1, see settings.py), as it is best on a production server.
+
+Each page module defines:
+    layout: the layout of the page, or a function that builds it with its data
+    validationLayout: optional function that returns the same components as
+        layout without loading any data, used by Dash to validate the callbacks
+    warmCache: optional function that fills the caches of the page in advance,
+        called only when the pages are preloaded
+"""
+import functools
+import threading
+
+from dash import html
+
+
+def loadOnce(loader):
+    """
+    Decorator of a function without arguments that loads or builds something:
+    loader() is called only the first time and the same object is then returned.
+    Concurrent first calls wait for a single load.
+    """
+    result = []
+    lock = threading.Lock()
+
+    @functools.wraps(loader)
+    def wrapper():
+        if not result:
+            with lock:
+                if not result:
+                    result.append(loader())
+        return result[0]
+    return wrapper
+
+
+class PageRegistry:
+    """
+    Pages of the app, each one with its url.
+
+    PARAMETERS
+    ********************
+    pages:dict {pathname: page module}
+    notFound: page module shown for any other pathname
+    """
+    def __init__(self, pages:dict, notFound):
+        self.pages = dict(pages)
+        self.notFound = notFound
+
+    def layout(self, pathname):
+        """
+        Layout of the page at pathname, built the first time it is requested
+        """
+        page = self.pages.get(pathname, self.notFound)
+        return page.layout() if callable(page.layout) else page.layout
+
+    def preload(self):
+        """
+        Loads the data, builds the layout and warms the caches of all the pages
+        """
+        for pathname, page in self.pages.items():
+            self.layout(pathname)
+            if hasattr(page, 'warmCache'):
+                page.warmCache()
+
+    def validationLayout(self, indexLayout):
+        """
+        Layout with the components of all the pages, without their data, to
+        validate the callbacks
+        """
+        layouts = [indexLayout]
+        for page in list(self.pages.values()) + [self.notFound]:
+            if hasattr(page, 'validationLayout'):
+                layouts.append(page.validationLayout())
+            else:
+                layouts.append(page.layout() if callable(page.layout) else page.layout)
+        return html.Div(layouts)
@@ -0,0 +1,87 @@
+"""
+Sizes of the requests and responses of the dash callbacks.
+
+Every call to a callback is a POST to /_dash-update-component whose body holds
+the values of its Inputs and States, and whose response holds the new values of
+its Outputs. Recording their size for each callback shows which callbacks move
+the most data between the browser and the server (e.g. whole figures sent back
+as State). The numbers are kept in memory by each worker process and can be
+read as json from PAYLOAD_METRICS_ROUTE.
+"""
+import threading
+
+from flask import jsonify, request
+
+
+# Url where the collected metrics are served
+PAYLOAD_METRICS_ROUTE = '/_payload-metrics'
+
+_CALLBACK_PATH = '/_dash-update-component'
+
+
+class PayloadMetrics:
+    """
+    Thread-safe count, total and maximum size in bytes of the requests and
+    responses of each callback
+    """
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, callbackID, requestBytes, responseBytes):
+        with self._lock:
+            stats = self._stats.setdefault(callbackID, dict(calls=0,
+                requestBytes=0, maxRequestBytes=0, responseBytes=0, maxResponseBytes=0))
+            stats['calls'] += 1
+            stats['requestBytes'] += requestBytes
+            stats['maxRequestBytes'] = max(stats['maxRequestBytes'], requestBytes)
+            stats['responseBytes'] += responseBytes
+            stats['maxResponseBytes'] = max(stats['maxResponseBytes'], responseBytes)
+
+    def summary(self):
+        """
+        Metrics of each callback, with the mean request and response sizes,
+        sorted by the total number of bytes moved
+        """
+        with self._lock:
+            stats = {k: dict(v) for k, v in self._stats.items()}
+        for v in stats.values():
+            v['meanRequestBytes'] = v['requestBytes'] / v['calls']
+            v['meanResponseBytes'] = v['responseBytes'] / v['calls']
+        return dict(sorted(stats.items(), key=lambda kv: -(kv[1]['requestBytes'] + kv[1]['responseBytes'])))
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+def installPayloadMetrics(server, metrics=None):
+    """
+    Records the payload size of all the callbacks handled by the flask server
+    of the app and serves the metrics at PAYLOAD_METRICS_ROUTE.
+
+    PARAMETERS
+    ********************
+    server: flask server of the dash app (app.server)
+    metrics:PayloadMetrics where to record the sizes, a new one if None
+
+    RETURNS
+    ********************
+    metrics:PayloadMetrics
+    """
+    metrics = PayloadMetrics() if metrics is None else metrics
+
+    @server.after_request
+    def recordPayloadSize(response):
+        if request.path.endswith(_CALLBACK_PATH) and request.method == 'POST':
+            body = request.get_json(silent=True) or {}
+            # The output string identifies the callback (e.g. "wfa-scatterSlice.figure")
+            callbackID = body.get('output', 'unknown')
+            responseBytes = response.calculate_content_length()
+            if responseBytes is None:
+                responseBytes = 0
+            metrics.record(callbackID, request.content_length or 0, responseBytes)
+        return response
+
+    server.add_url_rule(PAYLOAD_METRICS_ROUTE, 'payloadMetrics', lambda: jsonify(metrics.summary()))
+    return metrics
@@ -0,0 +1,206 @@
+"""
+Topology-preserving simplification of the polygons of a coronal slice.
+
+Each polygon is first simplified on its own with the Douglas-Peucker algorithm.
+Then simplified edges that cross any other edge of the slice (of a neighboring
+region or of the polygon itself) are refined by adding back the original vertex
+that deviates the most, until no new crossing is left. This way neighboring
+regions never overlap where they did not overlap in the original data.
+"""
+import numpy as np
+
+
+def douglasPeucker(points, tolerance):
+    """
+    Returns a boolean mask of the vertices of an open polyline to keep so that
+    no removed vertex is farther than tolerance from the simplified polyline.
+    The first and last vertices are always kept.
+    """
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        dist = _pointSegmentDistance(points[start + 1:end], points[start], points[end])
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            i += start + 1
+            keep[i] = True
+            stack.append((start, i))
+            stack.append((i, end))
+    return keep
+
+
+def simplifyRing(ring, tolerance):
+    """
+    Douglas-Peucker simplification of a closed ring (first vertex == last vertex).
+    The simplified ring always keeps at least 3 distinct vertices.
+    """
+    n = len(ring)
+    keep = np.ones(n, dtype=bool)
+    if n <= 4 or tolerance <= 0:
+        return keep
+    # Split the ring at the vertex farthest from the first one
+    far = int(np.argmax(((ring - ring[0]) ** 2).sum(axis=1)))
+    if far == 0:
+        return keep
+    keep[:far + 1] = douglasPeucker(ring[:far + 1], tolerance)
+    keep[far:] = douglasPeucker(ring[far:], tolerance)
+    # Never collapse a polygon to a segment
+    if keep[:-1].sum() < 3:
+        inner = np.flatnonzero(~keep)
+        dist = _pointSegmentDistance(ring[inner], ring[0], ring[far])
+        keep[inner[np.argmax(dist)]] = True
+    return keep
+
+
+def simplifyPolygons(vertices, polyOffsets, tolerance, maxIterations=50):
+    """
+    Simplifies all the polygons of a slice preserving their topology.
+
+    PARAMETERS
+    ********************
+    vertices:np.ndarray (nVertices, 2) vertices of all the polygons
+    polyOffsets:np.ndarray (nPolygons+1) polygon i is vertices[polyOffsets[i]:polyOffsets[i+1]]
+    tolerance:float maximum distance of a removed vertex from the simplified polygon
+
+    RETURNS
+    ********************
+    keep:np.ndarray (nVertices) boolean mask of the vertices to keep
+    """
+    vertices = np.asarray(vertices, dtype=float)
+    nPolys = len(polyOffsets) - 1
+    keep = np.ones(len(vertices), dtype=bool)
+    if tolerance <= 0:
+        return keep
+    for p in range(nPolys):
+        a, b = polyOffsets[p], polyOffsets[p + 1]
+        keep[a:b] = simplifyRing(vertices[a:b], tolerance)
+
+    origSegments = _segments(vertices, polyOffsets, np.ones(len(vertices), dtype=bool))
+    for _ in range(maxIterations):
+        # Add back vertices until simplified edges do not cross anymore
+        segments = _segments(vertices, polyOffsets, keep)
+        crossing = _crossingSegments(segments['start'], segments['end'])
+        # Edges of the original data that already cross can't be fixed
+        refinable = crossing & (segments['toIdx'] - segments['fromIdx'] > 1)
+        for s in np.flatnonzero(refinable):
+            a, b = segments['fromIdx'][s], segments['toIdx'][s]
+            dist = _pointSegmentDistance(vertices[a + 1:b], vertices[a], vertices[b])
+            keep[a + 1 + int(np.argmax(dist))] = True
+        if refinable.any():
+            continue
+
+        # A polygon that ends up inside (or outside) another one without any
+        # crossing is kept at full resolution
+        changed = _containmentChanges(vertices, polyOffsets, keep, origSegments)
+        if not changed:
+            break
+        for p in changed:
+            keep[polyOffsets[p]:polyOffsets[p + 1]] = True
+
+    return keep
+
+
+def _pointSegmentDistance(points, a, b):
+    """
+    Distance of each point from the segment a-b
+    """
+    ab = b - a
+    lengthSq = ab @ ab
+    if lengthSq == 0:
+        return np.sqrt(((points - a) ** 2).sum(axis=1))
+    t = np.clip(((points - a) @ ab) / lengthSq, 0, 1)
+    proj = a + t[:, None] * ab
+    return np.sqrt(((points - proj) ** 2).sum(axis=1))
+
+
+def _segments(vertices, polyOffsets, keep):
+    """
+    Edges of all the simplified polygons, with the indexes of their end vertices
+    in the original vertices array and the polygon they belong to
+    """
+    kept = np.flatnonzero(keep)
+    polyOfVertex = np.searchsorted(polyOffsets, kept, side='right') - 1
+    # Consecutive kept vertices of the same polygon form an edge
+    sameP = polyOfVertex[:-1] == polyOfVertex[1:]
+    fromIdx = kept[:-1][sameP]
+    toIdx = kept[1:][sameP]
+    return dict(
+        fromIdx=fromIdx,
+        toIdx=toIdx,
+        poly=polyOfVertex[:-1][sameP],
+        start=vertices[fromIdx],
+        end=vertices[toIdx],
+    )
+
+
+def _crossingSegments(start, end, chunkSize=512):
+    """
+    Boolean mask of the segments that properly cross at least another segment.
+    Segments that only touch at their end points do not count as crossing.
+    """
+    n = len(start)
+    crossing = np.zeros(n, dtype=bool)
+    lo = np.minimum(start, end)
+    hi = np.maximum(start, end)
+    for c0 in range(0, n, chunkSize):
+        c1 = min(c0 + chunkSize, n)
+        # Bounding box test first
+        overlap = ((lo[c0:c1, None, 0] <= hi[None, :, 0]) & (hi[c0:c1, None, 0] >= lo[None, :, 0]) &
+                   (lo[c0:c1, None, 1] <= hi[None, :, 1]) & (hi[c0:c1, None, 1] >= lo[None, :, 1]))
+        i, j = np.nonzero(overlap)
+        i += c0
+        pairs = i < j
+        i, j = i[pairs], j[pairs]
+        if len(i) == 0:
+            continue
+        p, p2, q, q2 = start[i], end[i], start[j], end[j]
+        d1 = _orientation(p, p2, q)
+        d2 = _orientation(p, p2, q2)
+        d3 = _orientation(q, q2, p)
+        d4 = _orientation(q, q2, p2)
+        cross = (d1 * d2 < 0) & (d3 * d4 < 0)
+        crossing[i[cross]] = True
+        crossing[j[cross]] = True
+    return crossing
+
+
+def _orientation(a, b, c):
+    return (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])
+
+
+def _pointsInPolygon(points, segStart, segEnd):
+    """
+    Even-odd rule test of each point against the polygon made by the given edges
+    """
+    x, y = points[:, None, 0], points[:, None, 1]
+    x0, y0 = segStart[None, :, 0], segStart[None, :, 1]
+    x1, y1 = segEnd[None, :, 0], segEnd[None, :, 1]
+    straddle = (y0 > y) != (y1 > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xCross = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+    return (straddle & (x < xCross)).sum(axis=1) % 2 == 1
+
+
+def _containmentChanges(vertices, polyOffsets, keep, origSegments):
+    """
+    Polygons whose simplification changed which first vertices of other polygons
+    they contain
+    """
+    nPolys = len(polyOffsets) - 1
+    firstVertices = vertices[polyOffsets[:-1]]
+    simpSegments = _segments(vertices, polyOffsets, keep)
+    changed = []
+    for p in range(nPolys):
+        orig = origSegments['poly'] == p
+        simp = simpSegments['poly'] == p
+        others = np.arange(nPolys) != p
+        before = _pointsInPolygon(firstVertices[others], origSegments['start'][orig], origSegments['end'][orig])
+        after = _pointsInPolygon(firstVertices[others], simpSegments['start'][simp], simpSegments['end'][simp])
+        if (before != after).any():
+            changed.append(p)
+    return changed
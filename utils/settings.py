@@ -0,0 +1,62 @@
+"""
+Runtime settings of the atlas.
+
+Every setting can be overridden with an environment variable so that the same
+code runs unchanged locally and on the production server.
+"""
+import os
+from pathlib import Path
+
+
+def _envFlag(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _envInt(name, default):
+    value = os.environ.get(name)
+    return default if value is None else int(value)
+
+
+# Full path of the data folder where to load raw data
+DATA_FOLDER = Path(__file__).parent.parent.absolute() / 'data'
+
+# Folder where precompiled binary versions of the raw data are stored
+CACHE_FOLDER = Path(os.environ.get('PNNATLAS_CACHE_FOLDER', DATA_FOLDER / 'cache'))
+
+# Read the raw data through the binary cache (set to 0 to always parse the raw files)
+USE_DATA_CACHE = _envFlag('PNNATLAS_USE_DATA_CACHE', True)
+
+# Maximum number of figures kept in memory by each worker for each figure cache
+FIGURE_CACHE_SIZE = _envInt('PNNATLAS_FIGURE_CACHE_SIZE', 128)
+
+# Keep a copy of the rendered figures in the cache folder, shared by all the workers
+FIGURE_CACHE_ON_DISK = _envFlag('PNNATLAS_FIGURE_CACHE_ON_DISK', True)
+
+# Maximum size in bytes of the figures kept on disk by each anatomical explorer
+# (all the figures of a version of the data take about 110 MB)
+FIGURE_CACHE_MAX_BYTES = _envInt('PNNATLAS_FIGURE_CACHE_MAX_BYTES', 256 * 1024**2)
+
+# Maximum size in bytes of the responses kept by each cache of the histogram callbacks
+RESPONSE_CACHE_MAX_BYTES = _envInt('PNNATLAS_RESPONSE_CACHE_MAX_BYTES', 64 * 1024**2)
+
+# Where the cached figures shared by all the workers are stored: 'files' (one
+# json file per figure) or 'sqlite' (one database for each cache)
+SHARED_CACHE_BACKEND = os.environ.get('PNNATLAS_SHARED_CACHE_BACKEND', 'files').strip().lower()
+
+# Render all the anatomical explorer figures at startup, together with
+# PRELOAD_PAGES (see pageRegistry.PageRegistry.preload())
+WARM_FIGURE_CACHE = _envFlag('PNNATLAS_WARM_FIGURE_CACHE', False)
+
+# Draw the anatomical explorer in the browser instead of on the server
+CLIENTSIDE_EXPLORER = _envFlag('PNNATLAS_CLIENTSIDE_EXPLORER', False)
+
+# Record the size of the requests and responses of every callback, served as
+# json at /_payload-metrics (see utils/payloadMetrics.py)
+PAYLOAD_METRICS = _envFlag('PNNATLAS_PAYLOAD_METRICS', False)
+
+# Load the data and build the layout of all the pages at startup, instead of the
+# first time each page is visited (see utils/pageRegistry.py)
+PRELOAD_PAGES = _envFlag('PNNATLAS_PRELOAD_PAGES', False)
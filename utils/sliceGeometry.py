@@ -0,0 +1,172 @@
+"""
+Packed geometry of the coronal slices shown in the anatomical explorer.
+
+The coordinates of all the polygons in all the slices are stored in a single
+memory-mapped file in the cache folder:
+    vertices:       float32 (nVertices, 2) x,y coordinates of all the polygons
+    polyOffsets:    int64 (nPolygons+1) polygon i is vertices[polyOffsets[i]:polyOffsets[i+1]]
+    polyRegionID:   int32 (nPolygons) ID of the brain region of each polygon
+    polySlice:      int32 (nPolygons) index of the slice of each polygon
+    sliceOffsets:   int64 (nSlices+1) slice s contains polygons sliceOffsets[s]:sliceOffsets[s+1]
+Acronyms and names of the regions are stored in the metadata.
+
+The file also stores simplified levels of detail (LOD) of the polygons, one for
+each tolerance in LOD_TOLERANCES, as vertices_lod{k} and polyOffsets_lod{k}.
+Simplified polygons keep the same order, so polyRegionID, polySlice and
+sliceOffsets are shared by all the levels. Level 0 is the original data.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from . import dataManager as dm
+from . import polygonSimplification as ps
+
+
+# Bump this number whenever the layout of the geometry file changes
+GEOMETRY_VERSION = 2
+
+# Maximum error in micrometers of each level of detail
+LOD_TOLERANCES = (0, 8, 16, 32)
+
+
+def packSlices(folderPath):
+    """
+    Reads all the json files with the coordinates of the coronal slices in a folder
+    and packs them in flat arrays.
+
+    RETURNS
+    ********************
+    arrays:dict {vertices, polyOffsets, polyRegionID, polySlice, sliceOffsets} and
+        the simplified {vertices_lod{k}, polyOffsets_lod{k}}
+    meta:dict {fileNames, regions:{regionID: [acronym, regionName]}, lodTolerances}
+    """
+    fileNames = sorted(os.listdir(folderPath))
+    coords, regionIDs, sliceIdx, sliceOffsets = [], [], [], [0]
+    regions = {}
+    for s, fileName in enumerate(fileNames):
+        with open(os.path.join(folderPath, fileName)) as f:
+            sliceDict = json.load(f)
+        # Json files are pandas dataframes stored column-wise {column: {row: value}}
+        rows = sorted(sliceDict['regionID'], key=int)
+        for row in rows:
+            regionID = int(sliceDict['regionID'][row])
+            coords.append(np.asarray(sliceDict['coord'][row], dtype=np.float32).reshape(-1, 2))
+            regionIDs.append(regionID)
+            sliceIdx.append(s)
+            regions[str(regionID)] = [sliceDict['acronym'][row], sliceDict['regionName'][row]]
+        sliceOffsets.append(len(coords))
+
+    polyOffsets = np.zeros(len(coords) + 1, dtype=np.int64)
+    polyOffsets[1:] = np.cumsum([len(c) for c in coords])
+    arrays = dict(
+        vertices=np.concatenate(coords) if coords else np.zeros((0, 2), dtype=np.float32),
+        polyOffsets=polyOffsets,
+        polyRegionID=np.array(regionIDs, dtype=np.int32),
+        polySlice=np.array(sliceIdx, dtype=np.int32),
+        sliceOffsets=np.array(sliceOffsets, dtype=np.int64),
+    )
+    for k, tolerance in enumerate(LOD_TOLERANCES):
+        if k > 0:
+            arrays[f'vertices_lod{k}'], arrays[f'polyOffsets_lod{k}'] = simplifySlices(arrays, tolerance)
+    meta = dict(fileNames=fileNames, regions=regions, lodTolerances=list(LOD_TOLERANCES))
+    return arrays, meta
+
+
+def simplifySlices(arrays, tolerance):
+    """
+    Simplifies the polygons of all the slices, one slice at a time so that
+    neighboring regions never end up overlapping.
+
+    RETURNS
+    ********************
+    vertices:np.ndarray float32 (nSimplifiedVertices, 2)
+    polyOffsets:np.ndarray int64 (nPolygons+1) offsets of each polygon in vertices
+    """
+    keep = np.ones(len(arrays['vertices']), dtype=bool)
+    sliceOffsets = arrays['sliceOffsets']
+    for s in range(len(sliceOffsets) - 1):
+        polyOffsets = arrays['polyOffsets'][sliceOffsets[s]:sliceOffsets[s + 1] + 1]
+        v0, v1 = polyOffsets[0], polyOffsets[-1]
+        keep[v0:v1] = ps.simplifyPolygons(arrays['vertices'][v0:v1], polyOffsets - v0, tolerance)
+    # Number of vertices kept before the start of each polygon
+    keptBefore = np.concatenate([[0], np.cumsum(keep)])
+    return arrays['vertices'][keep], keptBefore[arrays['polyOffsets']].astype(np.int64)
+
+
+def loadSliceGeometry(folderPath):
+    """
+    Loads the packed geometry of all the coronal slices in folderPath.
+
+    The packed file is built the first time and is then memory-mapped, so that all
+    the worker processes share the same copy. It is rebuilt automatically when
+    any of the json files changes.
+
+    RETURNS
+    ********************
+    geometry:dict the arrays described in the module docstring plus 'regions',
+        'lodTolerances' and 'fingerprint', a hash of the content of the json files
+    """
+    # Key the packed file on the content of all the json files
+    sha = hashlib.sha1(str(GEOMETRY_VERSION).encode())
+    for fileName in sorted(os.listdir(folderPath)):
+        sha.update(fileName.encode())
+        sha.update(dm.fileHash(os.path.join(folderPath, fileName)).encode())
+    fingerprint = sha.hexdigest()[:16]
+
+    arrays, meta = dm.loadPackedCache('sliceGeometry', fingerprint, lambda: packSlices(folderPath))
+    return _geometryDict(arrays, meta, fingerprint)
+
+
+def _geometryDict(arrays, meta, fingerprint):
+    return dict(arrays, regions=meta['regions'], lodTolerances=meta['lodTolerances'], fingerprint=fingerprint)
+
+
+def numSlices(geometry):
+    return len(geometry['sliceOffsets']) - 1
+
+
+def chooseLodLevel(geometry, sliceIdx, heightPx):
+    """
+    Returns the coarsest level of detail of a slice whose error is below one
+    pixel when the slice is drawn in a figure heightPx pixels high.
+
+    The explorer keeps the aspect ratio of the atlas, so a pixel is at least as
+    big as the height of the slice divided by heightPx.
+    """
+    p0, p1 = geometry['sliceOffsets'][sliceIdx], geometry['sliceOffsets'][sliceIdx + 1]
+    y = geometry['vertices'][geometry['polyOffsets'][p0]:geometry['polyOffsets'][p1], 1]
+    if len(y) == 0 or not heightPx:
+        return 0
+    umPerPx = (float(y.max()) - float(y.min())) / heightPx
+    lod = 0
+    for k, tolerance in enumerate(geometry['lodTolerances']):
+        if tolerance <= umPerPx:
+            lod = k
+    return lod
+
+
+def getSliceView(geometry, sliceIdx, lod=0):
+    """
+    Returns the polygons of a single slice at the given level of detail as views
+    on the packed arrays (no data is copied).
+
+    RETURNS
+    ********************
+    sliceView:dict
+        vertices:       (nVertices, 2) vertices of all the polygons in the slice
+        polyOffsets:    (nPolygons+1) offsets of each polygon in vertices
+        polyRegionID:   (nPolygons) region ID of each polygon
+    """
+    suffix = f'_lod{lod}' if lod > 0 else ''
+    p0, p1 = geometry['sliceOffsets'][sliceIdx], geometry['sliceOffsets'][sliceIdx + 1]
+    polyOffsets = geometry['polyOffsets' + suffix][p0:p1 + 1]
+    v0, v1 = polyOffsets[0], polyOffsets[-1]
+    sliceView = dict(
+        vertices=geometry['vertices' + suffix][v0:v1],
+        polyOffsets=polyOffsets - v0,
+        polyRegionID=geometry['polyRegionID'][p0:p1],
+    )
+    return sliceView